@@ -13,6 +13,7 @@
 # permissions and limitations under the License.
 
 import argparse
+import functools
 import itertools
 import logging
 import math
@@ -59,6 +60,85 @@ def frac_range(
     return close
 
 
+@functools.lru_cache(maxsize=None)
+def _lambdify_factors(params: tuple, factors: tuple):
+    """compile the entries of the generator factors of an irreps table once"""
+    exprs = [entry for mat in factors for entry in mat]
+    return sympy.lambdify(params, exprs, "numpy")
+
+
+def evaluate_words(fc, params, values, order, left=True) -> np.ndarray:
+    """evaluate the irreps of words of generators at many parameter values at once
+
+    The generator factors are compiled with sympy.lambdify (cached over the
+    calls) and the words are multiplied numerically, words sharing a
+    prefix reuse its product.
+
+    Args:
+        fc: the factors of the generators, a sympy.Matrix of scalars for one
+            dimensional irreps or a list of square sympy.Matrix
+        params: the symbols of the parameters
+        values: the values of params, scalars or arrays broadcast together
+        order: the words, the entries are indices of fc
+        left: the factor of a later entry multiplies from the left
+
+    Returns: (npoints, len(order)) values for one dimensional irreps,
+             (npoints, len(order), d, d) matrices otherwise
+    """
+    scalar = isinstance(fc, sympy.MatrixBase)
+    if scalar:
+        factors = tuple(sympy.ImmutableMatrix([[tmp]]) for tmp in fc)
+    else:
+        factors = tuple(sympy.ImmutableMatrix(tmp) for tmp in fc)
+    dim = factors[0].shape[0]
+    values = np.broadcast_arrays(
+        *[np.asarray(tmp, dtype=np.float64) for tmp in values]
+    )
+    npoints = values[0].size
+    values = [tmp.ravel() for tmp in values]
+
+    entries = _lambdify_factors(tuple(params), factors)(*values)
+    mats = np.array(
+        [
+            np.broadcast_to(np.asarray(tmp, dtype=np.complex128), npoints)
+            for tmp in entries
+        ]
+    )
+    mats = mats.reshape(len(factors), dim, dim, npoints).transpose(0, 3, 1, 2)
+
+    products = {(): np.broadcast_to(np.eye(dim), (npoints, dim, dim))}
+    res = np.empty((npoints, len(order), dim, dim), dtype=np.complex128)
+    for ii, word in enumerate(order):
+        word = tuple(word)
+        start = len(word)
+        while word[:start] not in products:
+            start -= 1
+        for jj in range(start, len(word)):
+            prev, mat = products[word[:jj]], mats[word[jj]]
+            products[word[: jj + 1]] = mat @ prev if left else prev @ mat
+        res[:, ii] = products[word]
+    if scalar:
+        return res[:, :, 0, 0]
+    return res
+
+
+def _conjugate_at(expr, params, values) -> list:
+    """the complex conjugates of a scalar or matrix expression at many points
+
+    Args:
+        expr: a sympy expression or sympy.Matrix
+        params: the symbols of the parameters
+        values: the values of params, see evaluate_words
+
+    Returns: one array per point, 0-d for a scalar expression
+    """
+    if isinstance(expr, sympy.MatrixBase):
+        res = evaluate_words([expr], params, values, [[0]])
+    else:
+        res = evaluate_words(sympy.Matrix([expr]), params, values, [[0]])
+    return [np.asarray(tmp) for tmp in res[:, 0].conj()]
+
+
 def get_modified_Dmu(DictParams, tmp_m1, symprec=1e-6):
     family = DictParams["family"]
 
@@ -108,67 +188,37 @@ def get_modified_Dmu(DictParams, tmp_m1, symprec=1e-6):
         ]
 
         func = [func0, func1]
+        params = [k1, m1, n, a, piH, t, s, j]
+        s_values, j_values = np.divmod(np.arange(2 * nrot), 2)
         if np.isclose(tmp_k1, 0, atol=symprec):
             fc = func[0]
-            for ii, tmp in enumerate(range(1, 3)):
-                if ii == 0:
-                    Dmu_rot_symbol = fc[tmp]
-                else:
-                    Dmu_rot_symbol = Dmu_rot_symbol * fc[tmp]
-            Dmu_rot = []
-            for s in range(nrot):
-                for j in range(2):
-                    tmp = Dmu_rot_symbol.subs(
-                        {
-                            "k1": tmp_k1,
-                            "m1": tmp_m1,
-                            "n": nrot,
-                            "a": aL,
-                            "t": 0,
-                            "s": s,
-                            "j": j,
-                        }
-                    ).conjugate()
-
-                    Dmu_rot.append(
-                        np.array(
-                            (tmp.subs({"piH": 1}) + tmp.subs({"piH": -1}))
-                        ).astype(np.complex128)
-                    )
+            Dmu_rot_symbol = fc[1] * fc[2]
+            Dmu_rot = [
+                tmp1 + tmp2
+                for tmp1, tmp2 in zip(
+                    *[
+                        _conjugate_at(
+                            Dmu_rot_symbol,
+                            params,
+                            (tmp_k1, tmp_m1, nrot, aL, piH_value, 0)
+                            + (s_values, j_values),
+                        )
+                        for piH_value in (1, -1)
+                    ]
+                )
+            ]
         else:
             fc = func[1]
+            Dmu_rot_symbol = fc[1] * fc[2]
+            Dmu_rot = _conjugate_at(
+                Dmu_rot_symbol,
+                params,
+                (tmp_k1, tmp_m1, nrot, aL, 0, 0, s_values, j_values),
+            )
 
-            for ii, tmp in enumerate(range(1, 3)):
-                if ii == 0:
-                    Dmu_rot_symbol = fc[tmp]
-                else:
-                    Dmu_rot_symbol = Dmu_rot_symbol * fc[tmp]
-            Dmu_rot = []
-
-            for s in range(nrot):
-                for j in range(2):
-                    Dmu_rot.append(
-                        np.array(
-                            Dmu_rot_symbol.subs(
-                                {
-                                    "k1": tmp_k1,
-                                    "m1": tmp_m1,
-                                    "n": nrot,
-                                    "a": aL,
-                                    "t": 0,
-                                    "s": s,
-                                    "j": j,
-                                }
-                            ).conjugate()
-                        ).astype(np.complex128)
-                    )
-
-        Dmu_tran_symbol = fc[0]
-        Dmu_tran = np.array(
-            Dmu_tran_symbol.subs(
-                {"k1": tmp_k1, "m1": tmp_m1, "n": nrot, "a": aL, "t": 1}
-            ).conjugate()
-        ).astype(np.complex128)
+        Dmu_tran = _conjugate_at(
+            fc[0], params, (tmp_k1, tmp_m1, nrot, aL, 0, 1, 0, 0)
+        )[0]
     elif family == 2:
         qpoints = DictParams["qpoints"]
         nrot = DictParams["nrot"]
@@ -212,64 +262,51 @@ def get_modified_Dmu(DictParams, tmp_m1, symprec=1e-6):
         ]
 
         func = [func0, func1]
+        params = [k1, m1, n, piH, a, t, s]
+        s_values = np.arange(2 * nrot)
         if np.isclose(tmp_k1, 0, atol=symprec) or np.isclose(
             tmp_k1, np.pi / aL, atol=symprec
         ):
             fc = func[0]
-            Dmu_rot_symbol = fc[1]
-            Dmu_rot = []
-            for s in range(2 * nrot):
-                tmp = Dmu_rot_symbol.subs(
-                    {
-                        "k1": tmp_k1,
-                        "m1": tmp_m1,
-                        "n": nrot,
-                        "a": aL,
-                        "t": 0,
-                        "s": s,
-                    }
-                ).conjugate()
-                Dmu_rot.append(
-                    np.array(
-                        (tmp.subs({"piH": 1}) + tmp.subs({"piH": -1}))
-                    ).astype(np.complex128)
+            Dmu_rot = [
+                tmp1 + tmp2
+                for tmp1, tmp2 in zip(
+                    *[
+                        _conjugate_at(
+                            fc[1],
+                            params,
+                            (tmp_k1, tmp_m1, nrot, piH_value, aL, 0, s_values),
+                        )
+                        for piH_value in (1, -1)
+                    ]
                 )
+            ]
         else:
             fc = func[1]
-            Dmu_rot_symbol = fc[1]
-            Dmu_rot = []
-            for s in range(2 * nrot):
-                Dmu_rot.append(
-                    np.array(
-                        Dmu_rot_symbol.subs(
-                            {
-                                "k1": tmp_k1,
-                                "m1": tmp_m1,
-                                "n": nrot,
-                                "a": aL,
-                                "t": 0,
-                                "s": s,
-                            }
-                        ).conjugate()
-                    ).astype(np.complex128)
-                )
+            Dmu_rot = _conjugate_at(
+                fc[1], params, (tmp_k1, tmp_m1, nrot, 0, aL, 0, s_values)
+            )
 
-        Dmu_tran_symbol = fc[0]
-        Dmu_tran = np.array(
-            Dmu_tran_symbol.subs(
-                {
-                    "k1": tmp_k1,
-                    "m1": tmp_m1,
-                    "n": nrot,
-                    "a": aL,
-                    "t": 1,
-                    "s": 0,
-                }
-            ).conjugate()
-        ).astype(np.complex128)
+        Dmu_tran = _conjugate_at(
+            fc[0], params, (tmp_k1, tmp_m1, nrot, 0, aL, 1, 0)
+        )[0]
     return Dmu_rot, Dmu_tran
 
 
+# The generators of the irreps tables of line_group_sympy and
+# line_group_sympy_withparities, named as the factors of
+# group_elements.FAMILY_FACTORS. An entry ii > 0 of a word in
+# DictParams["order"] stands for the ii-th generator, 0 for the identity.
+TABLE_GENERATORS = {
+    2: ("rot",),
+    3: ("rot", "mirror"),
+    4: ("screw", "rot", "mirror"),
+    6: ("screw", "rot", "mirror"),
+    8: ("screw", "rot", "mirror"),
+    13: ("screw", "rot", "u", "mirror"),
+}
+
+
 def line_group_sympy(DictParams, symprec=1e-6):
     family = DictParams["family"]
     if family == 2:
@@ -329,29 +366,17 @@ def line_group_sympy(DictParams, symprec=1e-6):
             fc = func[1]
             paras_symbol = [k1, m1, n]
         paras_values = list(itertools.product(*[qps_value, m1_value, n_value]))
-        characters = []
-        for ii, paras_value in enumerate(paras_values):
-            tmp_k1, tmp_m1, tmp_n = paras_value
-            res = []
-            for tmp_order in order:
-                for jj, tmp in enumerate(tmp_order):
-                    if jj == 0:
-                        tmp0 = fc[tmp]
-                    else:
-                        tmp0 = tmp0 * fc[tmp]
-                        # tmp0 = fc[tmp] * tmp0
-                        set_trace()
-                if len(paras_symbol) == 4:
-                    tmp1 = tmp0.evalf(
-                        subs={k1: tmp_k1, m1: tmp_m1, n: tmp_n, piH: -1}
-                    ) + tmp0.evalf(
-                        subs={k1: tmp_k1, m1: tmp_m1, n: tmp_n, piH: 1}
-                    )
-                    res.append(tmp1)
-                else:
-                    tmp1 = tmp0.evalf(subs={k1: tmp_k1, m1: tmp_m1, n: tmp_n})
-                    res.append(tmp1)
-            characters.append(np.array(res).astype(np.complex128))
+        values = np.array(paras_values, dtype=np.float64).T
+        if len(paras_symbol) == 4:
+            # add up the two parities
+            res = evaluate_words(
+                fc, paras_symbol, (*values, -1), order, left=False
+            ) + evaluate_words(
+                fc, paras_symbol, (*values, 1), order, left=False
+            )
+        else:
+            res = evaluate_words(fc, paras_symbol, values, order, left=False)
+        characters = list(res)
         # characters = np.array(characters).astype(np.complex128)
     elif family == 3:
         qpoint = DictParams["qpoints"]
@@ -412,27 +437,17 @@ def line_group_sympy(DictParams, symprec=1e-6):
             fc = func[1]
             paras_symbol = [k1, m1, n]
         paras_values = list(itertools.product(*[qps_value, m1_value, n_value]))
-        characters = []
-        for ii, paras_value in enumerate(paras_values):
-            tmp_k1, tmp_m1, tmp_n = paras_value
-            res = []
-            for tmp_order in order:
-                for jj, tmp in enumerate(tmp_order):
-                    if jj == 0:
-                        tmp0 = fc[tmp]
-                    else:
-                        tmp0 = tmp0 * fc[tmp]
-                if len(paras_symbol) == 4:
-                    tmp1 = tmp0.evalf(
-                        subs={k1: tmp_k1, m1: tmp_m1, n: tmp_n, piH: -1}
-                    ) + tmp0.evalf(
-                        subs={k1: tmp_k1, m1: tmp_m1, n: tmp_n, piH: 1}
-                    )
-                    res.append(tmp1)
-                else:
-                    tmp1 = tmp0.evalf(subs={k1: tmp_k1, m1: tmp_m1, n: tmp_n})
-                    res.append(tmp1)
-            characters.append(np.array(res).astype(np.complex128))
+        values = np.array(paras_values, dtype=np.float64).T
+        if len(paras_symbol) == 4:
+            # add up the two parities
+            res = evaluate_words(
+                fc, paras_symbol, (*values, -1), order, left=False
+            ) + evaluate_words(
+                fc, paras_symbol, (*values, 1), order, left=False
+            )
+        else:
+            res = evaluate_words(fc, paras_symbol, values, order, left=False)
+        characters = list(res)
         # characters = np.array(characters).astype(np.complex128)
     elif family == 4:
         qpoint = DictParams["qpoints"]
@@ -499,27 +514,17 @@ def line_group_sympy(DictParams, symprec=1e-6):
             fc = func[idx_fc]
             paras_symbol = [k1, m1, n]
         paras_values = list(itertools.product(*[qps_value, m1_value, n_value]))
-        characters = []
-        for ii, paras_value in enumerate(paras_values):
-            tmp_k1, tmp_m1, tmp_n = paras_value
-            res = []
-            for tmp_order in order:
-                for jj, tmp in enumerate(tmp_order):
-                    if jj == 0:
-                        tmp0 = fc[tmp]
-                    else:
-                        tmp0 = fc[tmp] * tmp0
-                if idx_fc == 0:
-                    tmp1 = tmp0.evalf(
-                        subs={k1: tmp_k1, m1: tmp_m1, n: tmp_n, piH: -1}
-                    ) + tmp0.evalf(
-                        subs={k1: tmp_k1, m1: tmp_m1, n: tmp_n, piH: 1}
-                    )
-                    res.append(tmp1)
-                else:
-                    tmp1 = tmp0.evalf(subs={k1: tmp_k1, m1: tmp_m1, n: tmp_n})
-                    res.append(tmp1)
-            characters.append(np.array(res).astype(np.complex128))
+        values = np.array(paras_values, dtype=np.float64).T
+        if idx_fc == 0:
+            # add up the two parities
+            res = evaluate_words(
+                fc, paras_symbol, (*values, -1), order, left=True
+            ) + evaluate_words(
+                fc, paras_symbol, (*values, 1), order, left=True
+            )
+        else:
+            res = evaluate_words(fc, paras_symbol, values, order, left=True)
+        characters = list(res)
     elif family == 6:
         qpoint = DictParams["qpoints"]
         nrot = DictParams["nrot"]
@@ -584,25 +589,19 @@ def line_group_sympy(DictParams, symprec=1e-6):
                 fc = func[1]
                 paras_symbol = [k1, m1, n]
 
-            res = []
-            for tmp_order in order:
-                for jj, tmp in enumerate(tmp_order):
-                    if jj == 0:
-                        tmp0 = fc[tmp]
-                    else:
-                        # tmp0 = tmp0 * fc[tmp]
-                        tmp0 = fc[tmp] * tmp0
-                if len(paras_symbol) == 4:
-                    tmp1 = tmp0.evalf(
-                        subs={k1: tmp_k1, m1: tmp_m1, n: tmp_n, piV: -1}
-                    ) + tmp0.evalf(
-                        subs={k1: tmp_k1, m1: tmp_m1, n: tmp_n, piV: 1}
-                    )
-                    res.append(tmp1)
-                else:
-                    tmp1 = tmp0.evalf(subs={k1: tmp_k1, m1: tmp_m1, n: tmp_n})
-                    res.append(tmp1)
-            characters.append(np.array(res).astype(np.complex128))
+            if len(paras_symbol) == 4:
+                # add up the two parities
+                res = (
+                    evaluate_words(
+                        fc, paras_symbol, (*paras_value, -1), order
+                    )[0]
+                    + evaluate_words(
+                        fc, paras_symbol, (*paras_value, 1), order
+                    )[0]
+                )
+            else:
+                res = evaluate_words(fc, paras_symbol, paras_value, order)[0]
+            characters.append(res)
         # characters = np.array(characters).astype(np.complex128)
     elif family == 8:
         qpoint = DictParams["qpoints"]
@@ -671,26 +670,19 @@ def line_group_sympy(DictParams, symprec=1e-6):
                 fc = func[1]
                 paras_symbol = [k1, m1, n]
 
-            res = []
-            for tmp_order in order:
-                for jj, tmp in enumerate(tmp_order):
-                    if jj == 0:
-                        tmp0 = fc[tmp]
-                    else:
-                        # tmp0 = tmp0 * fc[tmp]
-                        tmp0 = fc[tmp] * tmp0
-                if len(paras_symbol) == 4:
-                    tmp1 = tmp0.evalf(
-                        subs={k1: tmp_k1, m1: tmp_m1, n: tmp_n, piV: -1}
-                    ) + tmp0.evalf(
-                        subs={k1: tmp_k1, m1: tmp_m1, n: tmp_n, piV: 1}
-                    )
-                    # tmp1 = tmp0.evalf(subs={k1: tmp_k1, m1: tmp_m1, n: tmp_n, piV: 0})
-                    res.append(tmp1)
-                else:
-                    tmp1 = tmp0.evalf(subs={k1: tmp_k1, m1: tmp_m1, n: tmp_n})
-                    res.append(tmp1)
-            characters.append(np.array(res).astype(np.complex128))
+            if len(paras_symbol) == 4:
+                # add up the two parities
+                res = (
+                    evaluate_words(
+                        fc, paras_symbol, (*paras_value, -1), order
+                    )[0]
+                    + evaluate_words(
+                        fc, paras_symbol, (*paras_value, 1), order
+                    )[0]
+                )
+            else:
+                res = evaluate_words(fc, paras_symbol, paras_value, order)[0]
+            characters.append(res)
     elif family == 13:
         qpoint = DictParams["qpoints"]
         nrot = DictParams["nrot"]
@@ -871,77 +863,21 @@ def line_group_sympy(DictParams, symprec=1e-6):
                 set_trace()
                 logging.ERROR("Wrong value for k1")
 
-            res = []
-            for tmp_order in order:
-                for jj, tmp in enumerate(tmp_order):
-                    if jj == 0:
-                        tmp0 = fc[tmp]
-                    else:
-                        tmp0 = fc[tmp] * tmp0
-
-                if idx_fc == 0:
-                    tmp1 = (
-                        tmp0.evalf(
-                            subs={
-                                k1: tmp_k1,
-                                m1: tmp_m1,
-                                n: tmp_n,
-                                piV: -1,
-                                piU: 1,
-                            }
-                        )
-                        + tmp0.evalf(
-                            subs={
-                                k1: tmp_k1,
-                                m1: tmp_m1,
-                                n: tmp_n,
-                                piV: 1,
-                                piU: 1,
-                            }
-                        )
-                        + tmp0.evalf(
-                            subs={
-                                k1: tmp_k1,
-                                m1: tmp_m1,
-                                n: tmp_n,
-                                piV: -1,
-                                piU: -1,
-                            }
-                        )
-                        + tmp0.evalf(
-                            subs={
-                                k1: tmp_k1,
-                                m1: tmp_m1,
-                                n: tmp_n,
-                                piV: 1,
-                                piU: -1,
-                            }
-                        )
-                    )
-                    res.append(tmp1)
-                elif idx_fc == 1:
-                    tmp1 = tmp0.evalf(
-                        subs={k1: tmp_k1, m1: tmp_m1, n: tmp_n, piH: -1}
-                    ) + tmp0.evalf(
-                        subs={k1: tmp_k1, m1: tmp_m1, n: tmp_n, piH: 1}
-                    )
-                    res.append(tmp1)
-                elif idx_fc == 2:
-                    tmp1 = tmp0.evalf(
-                        subs={k1: tmp_k1, m1: tmp_m1, n: tmp_n, piV: -1}
-                    ) + tmp0.evalf(
-                        subs={k1: tmp_k1, m1: tmp_m1, n: tmp_n, piV: 1}
-                    )
-                    res.append(tmp1)
-                elif idx_fc == 3:
-                    tmp1 = tmp0.evalf(subs={piU: -1}) + tmp0.evalf(
-                        subs={piU: 1}
-                    )
-                    res.append(tmp1)
-                elif idx_fc == 4:
-                    tmp1 = tmp0.evalf(subs={k1: tmp_k1, m1: tmp_m1, n: tmp_n})
-                    res.append(tmp1)
-            characters.append(np.array(res).astype(np.complex128))
+            # the parities (piU, piV, piH) added up in each case
+            parities = {
+                0: [(1, -1, 0), (1, 1, 0), (-1, -1, 0), (-1, 1, 0)],
+                1: [(0, 0, -1), (0, 0, 1)],
+                2: [(0, -1, 0), (0, 1, 0)],
+                3: [(-1, 0, 0), (1, 0, 0)],
+                4: [(0, 0, 0)],
+            }[idx_fc]
+            res = sum(
+                evaluate_words(
+                    fc, [k1, m1, n, piU, piV, piH], (*paras_value, *tmp), order
+                )[0]
+                for tmp in parities
+            )
+            characters.append(res)
     else:
         raise NotImplementedError("Family %d is not supported yet" % family)
     return characters, paras_values, paras_symbol
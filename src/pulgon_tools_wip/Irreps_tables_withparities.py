@@ -11,6 +11,8 @@ from sympy import symbols
 from sympy.ntheory.factor_ import totient
 from tqdm import tqdm
 
+from pulgon_tools_wip.Irreps_tables import evaluate_words
+
 
 def sym_inverse_eye(n):
     A = sympy.zeros(n)
@@ -70,18 +72,9 @@ def line_group_sympy_withparities(DictParams, symprec=1e-6):
         # set_trace()
 
         def value_fc(fc, tmp_k1, tmp_m1, tmp_piV, nrot, order):
-            res = []
-            for tmp_order in order:
-                for jj, tmp in enumerate(tmp_order):
-                    if jj == 0:
-                        tmp0 = fc[tmp]
-                    else:
-                        tmp0 = fc[tmp] * tmp0
-                tmp1 = tmp0.evalf(
-                    subs={k1: tmp_k1, m1: tmp_m1, n: nrot, piV: tmp_piV}
-                )
-                res.append(tmp1)
-            return res
+            return evaluate_words(
+                fc, [k1, m1, n, piV], (tmp_k1, tmp_m1, nrot, tmp_piV), order
+            )[0]
 
         paras_km = list(itertools.product(*[qps_value, m1_value]))
         paras_symbol = [k1, m1, piV]
@@ -155,18 +148,9 @@ def line_group_sympy_withparities(DictParams, symprec=1e-6):
         m1_value = list(range(0, nrot + 1))
 
         def value_fc(fc, tmp_k1, tmp_m1, tmp_piV, nrot, order):
-            res = []
-            for tmp_order in order:
-                for jj, tmp in enumerate(tmp_order):
-                    if jj == 0:
-                        tmp0 = fc[tmp]
-                    else:
-                        tmp0 = fc[tmp] * tmp0
-                tmp1 = tmp0.evalf(
-                    subs={k1: tmp_k1, m1: tmp_m1, n: nrot, piV: tmp_piV}
-                )
-                res.append(tmp1)
-            return res
+            return evaluate_words(
+                fc, [k1, m1, n, piV], (tmp_k1, tmp_m1, nrot, tmp_piV), order
+            )[0]
 
         paras_km = list(itertools.product(*[qps_value, m1_value]))
         paras_symbol = [k1, m1, piV]
@@ -333,27 +317,13 @@ def line_group_sympy_withparities(DictParams, symprec=1e-6):
             a,
             order,
         ):
-            res = []
-            for tmp_order in order:
-                for jj, tmp in enumerate(tmp_order):
-                    if jj == 0:
-                        tmp0 = fc[tmp]
-                    else:
-                        # tmp0 = fc[tmp] * tmp0
-                        tmp0 = tmp0 * fc[tmp]
-                tmp1 = tmp0.xreplace(
-                    {
-                        k1: tmp_k1,
-                        m1: tmp_m1,
-                        n: nrot,
-                        f: a / 2,
-                        piU: tmp_piU,
-                        piV: tmp_piV,
-                        piH: tmp_piH,
-                    }
-                )
-                res.append(tmp1)
-            return res
+            return evaluate_words(
+                fc,
+                [k1, m1, n, f, piU, piV, piH],
+                (tmp_k1, tmp_m1, nrot, a / 2, tmp_piU, tmp_piV, tmp_piH),
+                order,
+                left=False,
+            )[0]
 
         paras_km = list(itertools.product(*[qps_value, m1_value]))
         paras_symbol = [k1, m1, piU, piV, piH]
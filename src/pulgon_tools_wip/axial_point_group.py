@@ -0,0 +1,399 @@
+# Copyright 2023 The PULGON Project Developers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied. See the License for the specific language governing
+# permissions and limitations under the License.
+
+import logging
+from typing import Union
+
+import numpy as np
+from ase.data import atomic_masses
+
+from pulgon_tools_wip.site_index import PeriodicSiteIndex
+
+
+def axis_angle_matrix(axis: np.ndarray, angle: float) -> np.ndarray:
+    """rotation matrix about an axis through the origin
+
+    Args:
+        axis: rotational axis
+        angle: rotational degree
+
+    Returns: (3, 3) rotation matrix
+
+    """
+    u = np.asarray(axis, dtype=np.float64) / np.linalg.norm(axis)
+    ang = np.radians(angle)
+    ux = np.array([[0, -u[2], u[1]], [u[2], 0, -u[0]], [-u[1], u[0], 0]])
+    return (
+        np.cos(ang) * np.eye(3)
+        + np.sin(ang) * ux
+        + (1 - np.cos(ang)) * np.outer(u, u)
+    )
+
+
+def reflection_matrices(normals: np.ndarray) -> np.ndarray:
+    """reflection matrices about the planes through the origin
+
+    Args:
+        normals: (..., 3) normals of the mirror planes
+
+    Returns: (..., 3, 3) reflection matrices
+
+    """
+    u = normals / np.linalg.norm(normals, axis=-1, keepdims=True)
+    return np.eye(3) - 2 * u[..., :, np.newaxis] * u[..., np.newaxis, :]
+
+
+def screen_rot_orders(
+    coords: np.ndarray, numbers: np.ndarray, tol: float
+) -> list:
+    """find the rotational orders about z allowed by the angular fingerprints
+
+    The off-axis atoms are grouped into shells of the same element,
+    radius and height, which Cn can only permute among themselves. For
+    Cn, every shell holds a multiple of n atoms, and its angular
+    harmonics sum(exp(i*m*phi)) vanish for m not divisible by n, within
+    the error caused by the tolerance.
+
+    Args:
+        coords: (n, 3) coordinates with the z axis through the origin
+        numbers: atomic numbers
+        tol: system precise tolerance
+
+    Returns: the possible rotational orders in descending order
+
+    """
+    r = np.linalg.norm(coords[:, :2], axis=1)
+    off_axis = r > tol
+    if not off_axis.any():
+        return []
+    r, z = r[off_axis], coords[off_axis, 2]
+    phi = np.arctan2(coords[off_axis, 1], coords[off_axis, 0])
+
+    def gap_labels(values):
+        # single linkage clustering of 1D values
+        order = np.argsort(values)
+        labels = np.empty(len(values), dtype=int)
+        labels[order] = np.cumsum(
+            np.concatenate(([0], np.diff(values[order]) > 2 * tol))
+        )
+        return labels
+
+    _, shells = np.unique(
+        np.column_stack(
+            (np.asarray(numbers)[off_axis], gap_labels(r), gap_labels(z))
+        ),
+        axis=0,
+        return_inverse=True,
+    )
+    shells = shells.ravel()
+    counts = np.bincount(shells)
+    g = np.gcd.reduce(counts)
+    candidates = [n for n in range(g, 1, -1) if g % n == 0]
+    if len(candidates) == 0:
+        return candidates
+
+    m = np.arange(1, max(candidates))
+    harmonics = np.exp(1j * np.outer(phi, m))
+    fingerprint = np.abs(
+        np.eye(len(counts))[:, shells] @ harmonics
+    )  # (shells, harmonics)
+    # every angle may be shifted by up to 2 * tol / r
+    err = np.bincount(shells, weights=2 * tol / r)[:, np.newaxis]
+
+    res = []
+    for n in candidates:
+        mm = m[m % n != 0]
+        bound = mm * err / (2 * np.abs(np.sin(np.pi * mm / n)))
+        if (fingerprint[:, mm - 1] <= bound).all():
+            res.append(n)
+    return res
+
+
+class AxialPointGroupAnalyzer:
+    """A NumPy implementation of LineGroupAnalyzer working on plain arrays
+
+    It takes the same decisions in the same order as LineGroupAnalyzer, so
+    sch_symbol and symmops agree with it, but there is no Molecule, no
+    Site and no pymatgen import. The symmetry operations are (4, 4) affine
+    matrices about the center of mass.
+
+    The general outline of the algorithm is as follows:
+
+    1. Specify z axis as the rotation axis, detect the rotational symmetry.
+    2. If the rotational symmetry about z-axis exist, detect U (a two-fold horizontal axis).
+       - If U exist, it's a dihedral group (Dnh, Dnd).
+       - If U does not exist, the group is not dihedral, leaving Cnh, Cnv and S2n as candidates.
+    3. If the rotational symmetry about z-axis does not exist, only possible point groups are C1, Cs and Ci.
+    """
+
+    def __init__(
+        self,
+        positions: np.ndarray,
+        numbers: np.ndarray,
+        masses: Union[np.ndarray, None] = None,
+        tolerance: float = 0.01,
+        chunk: int = 4096,
+    ) -> None:
+        """
+
+        Args:
+            positions: (n, 3) cartesian coordinates, the tube axis along z
+            numbers: atomic numbers
+            masses: atomic masses, the standard ones by default
+            tolerance: Distance tolerance to consider sites as symmetrically equivalent.
+            chunk: number of candidate operations pre-screened at once
+        """
+        logging.debug("--------------------start detecting axial point group")
+        self.numbers = np.asarray(numbers)
+        positions = np.asarray(positions, dtype=np.float64)
+        if masses is None:
+            masses = atomic_masses[self.numbers]
+        self.masses = np.asarray(masses, dtype=np.float64)
+        self.center_of_mass = self.masses @ positions / self.masses.sum()
+        self.coords = positions - self.center_of_mass
+
+        self.tol = tolerance
+        self._chunk = chunk
+        self._zaxis = np.array([0, 0, 1])
+        self._index = PeriodicSiteIndex(
+            self.coords, self.numbers, symprec=self.tol
+        )
+
+        self._analyze()
+
+    def _analyze(self) -> None:
+        """calculate the axial point group elements"""
+        _, eigvecs = np.linalg.eigh(self._inertia_tensor())
+        self.principal_axes = eigvecs.T  # only be used in _proc_no_rot_sym
+
+        self.rot_sym = []
+        self.symmops = [np.eye(4)]
+
+        self._check_rot_sym()
+        if len(self.rot_sym) > 0:
+            logging.debug(
+                "The rot_num along zaxis is: %d" % self.rot_sym[0][1]
+            )
+            self._check_perpendicular_r2_axis(self._zaxis)
+            if len(self.rot_sym) >= 2:
+                logging.debug("U exist, start detecting dihedral group")
+                self._proc_dihedral()
+            else:
+                logging.debug(
+                    "U does not exist, leaving Cnh, Cnv and S2n as candidates"
+                )
+                self._proc_cyclic()
+        else:
+            logging.debug(
+                "leaving Ci, C1h and C1v as candidates, start detecting U, v, h"
+            )
+            self._proc_no_rot_sym()
+
+    def _inertia_tensor(self) -> np.ndarray:
+        """
+
+        Returns: inertia_tensor of the molecular, the same as LineGroupAnalyzer
+
+        """
+        weights, coords = self.masses, self.coords
+        total_inertia = weights @ (coords**2).sum(axis=1)
+        tensor = np.einsum("n,ni,nj->ij", weights, coords, coords)
+        inertia_tensor = (np.ones((3, 3)) - np.eye(3)) * tensor + (
+            total_inertia - np.diag(tensor)
+        ) * np.eye(3)
+        return inertia_tensor / total_inertia
+
+    @staticmethod
+    def _affine(rotation: np.ndarray) -> np.ndarray:
+        affine = np.eye(4)
+        affine[:3, :3] = rotation
+        return affine
+
+    def is_valid_op(self, rotation: np.ndarray) -> bool:
+        """check if a point operation (about the origin) maps the molecule onto itself
+
+        Args:
+            rotation: (3, 3) matrix of the operation
+
+        Returns: judge if the operation is valid
+
+        """
+        operated = self.coords @ rotation.T
+        return bool(self._index.match(operated, self.numbers).all())
+
+    def _first_valid_op(self, rotations: np.ndarray) -> int:
+        """find the first valid operation among the candidates
+
+        The image of the first site is checked for all the candidates at
+        once, the survivors are then checked one by one in the given order.
+
+        Args:
+            rotations: (k, 3, 3) candidate matrices
+
+        Returns: index of the first valid candidate, -1 if there is none
+
+        """
+        for start in range(0, len(rotations), self._chunk):
+            block = rotations[start : start + self._chunk]
+            first = self._index.match(
+                block @ self.coords[0], np.full(len(block), self.numbers[0])
+            )
+            for ii in np.where(first)[0]:
+                if self.is_valid_op(block[ii]):
+                    return start + ii
+        return -1
+
+    def _check_rot_sym(self) -> int:
+        """Determine the rotational symmetry about z axis."""
+        candidates = screen_rot_orders(self.coords, self.numbers, self.tol)
+        logging.debug("Candidate rotational orders: %s" % candidates)
+        for idx in candidates:
+            rot = axis_angle_matrix(self._zaxis, 360 / idx)
+            if self.is_valid_op(rot):
+                self.symmops.append(self._affine(rot))
+                self.rot_sym.append((self._zaxis, idx))
+                return idx
+        return 1
+
+    def _get_smallest_set_not_on_axis(self, axis: np.ndarray) -> np.ndarray:
+        """the same set as pymatgen's PointGroupAnalyzer
+
+        The sites are clustered by species and distance from the origin
+        (single linkage within the tolerance), and the off-axis sites of the
+        first smallest cluster are returned.
+
+        Returns: indices of the sites
+
+        """
+        dists = np.linalg.norm(self.coords, axis=1)
+        order = np.argsort(dists, kind="stable")
+        labels = np.empty(len(dists), dtype=int)
+        labels[order] = np.cumsum(
+            np.concatenate(([0], np.diff(dists[order]) > self.tol))
+        )
+        avg_dist = np.bincount(labels, weights=dists) / np.bincount(labels)
+        not_on_axis = (
+            np.linalg.norm(np.cross(self.coords, axis), axis=1) > self.tol
+        )
+
+        valid_sets = {}
+        for idx in range(len(dists)):
+            if avg_dist[labels[idx]] < self.tol:
+                continue
+            key = (labels[idx], self.numbers[idx])
+            valid_sets.setdefault(key, [])
+            if not_on_axis[idx]:
+                valid_sets[key].append(idx)
+        valid_sets = [tmp for tmp in valid_sets.values() if len(tmp) > 0]
+        return np.array(min(valid_sets, key=len))
+
+    def _check_perpendicular_r2_axis(self, axis: np.ndarray) -> bool:
+        """Check for R2 axes perpendicular to unique axis."""
+        min_set = self._get_smallest_set_not_on_axis(axis)
+        itp1, itp2 = np.triu_indices(len(min_set), k=1)
+        test_axes = np.cross(
+            self.coords[min_set[itp1]] - self.coords[min_set[itp2]], axis
+        )
+        test_axes = test_axes[np.linalg.norm(test_axes, axis=1) > self.tol]
+        if len(test_axes) == 0:
+            return False
+        # 180 degree rotations
+        u = test_axes / np.linalg.norm(test_axes, axis=1, keepdims=True)
+        rotations = 2 * u[:, :, np.newaxis] * u[:, np.newaxis, :] - np.eye(3)
+        ii = self._first_valid_op(rotations)
+        if ii < 0:
+            return False
+        self.symmops.append(self._affine(rotations[ii]))
+        self.rot_sym.append((test_axes[ii], 2))
+        return True
+
+    def _find_mirror(self, axis: np.ndarray) -> str:
+        """Looks for mirror symmetry of specified type about axis.
+
+        Possible types are "h" or "vd". Horizontal (h) mirrors are perpendicular to the
+        axis while vertical (v) or diagonal (d) mirrors are parallel. v mirrors has atoms
+        lying on the mirror plane while d mirrors do not.
+        """
+        mirror = reflection_matrices(np.asarray(axis, dtype=np.float64))
+        if self.is_valid_op(mirror):
+            self.symmops.append(self._affine(mirror))
+            return "h"
+
+        # iterate through all pairs of atoms to find mirror
+        itp1, itp2 = np.triu_indices(len(self.coords), k=1)
+        for start in range(0, len(itp1), self._chunk):
+            jj1 = itp1[start : start + self._chunk]
+            jj2 = itp2[start : start + self._chunk]
+            normals = self.coords[jj1] - self.coords[jj2]
+            mask = (self.numbers[jj1] == self.numbers[jj2]) & (
+                normals @ axis < self.tol
+            )
+            normals = normals[mask]
+            ii = self._first_valid_op(reflection_matrices(normals))
+            if ii < 0:
+                continue
+            normal = normals[ii]
+            self.symmops.append(self._affine(reflection_matrices(normal)))
+            if len(self.rot_sym) > 1:
+                for v, _ in self.rot_sym:
+                    if (
+                        np.linalg.norm(v - axis) >= self.tol
+                        and np.dot(v, normal) < self.tol
+                    ):
+                        return "v"
+                return "d"
+            return "v"
+        return ""
+
+    def _proc_dihedral(self) -> None:
+        """Handles dihedral group molecules."""
+        main_axis, rot = max(self.rot_sym, key=lambda v: v[1])
+        self.sch_symbol = "D%d" % rot
+        mirror_type = self._find_mirror(main_axis)
+        if mirror_type == "h":
+            self.sch_symbol += "h"
+        elif mirror_type != "":
+            self.sch_symbol += "d"
+
+    def _proc_cyclic(self) -> None:
+        """Handles cyclic group molecules."""
+        main_axis, rot = max(self.rot_sym, key=lambda v: v[1])
+        self.sch_symbol = "C%d" % rot
+        mirror_type = self._find_mirror(main_axis)
+        if mirror_type == "h":
+            self.sch_symbol += "h"
+        elif mirror_type == "v":
+            self.sch_symbol += "v"
+        elif mirror_type == "":
+            rotoreflection = axis_angle_matrix(
+                main_axis, 180 / rot
+            ) @ reflection_matrices(np.asarray(main_axis, dtype=np.float64))
+            if self.is_valid_op(rotoreflection):
+                self.sch_symbol = "S%d" % (2 * rot)
+
+    def _proc_no_rot_sym(self) -> None:
+        """Handles molecules with no rotational symmetry, only possible point groups are C1, Cs and Ci."""
+        self.sch_symbol = "C1"
+        if self.is_valid_op(-np.eye(3)):
+            self.sch_symbol = "Ci"
+            self.symmops.append(self._affine(-np.eye(3)))
+        else:
+            for v in self.principal_axes:
+                if self._find_mirror(v) != "":
+                    self.sch_symbol = "Cs"
+                    break
+
+    def get_generators(self) -> list:
+        """Returns the non-identity operations found, the same as LineGroupAnalyzer.get_generators."""
+        return [op for op in self.symmops if not np.allclose(op, np.eye(4))]
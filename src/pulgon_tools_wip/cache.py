@@ -0,0 +1,425 @@
+# Copyright 2023 The PULGON Project Developers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied. See the License for the specific language governing
+# permissions and limitations under the License.
+
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+from typing import Callable, Union
+
+import ase
+import numpy as np
+from ase import Atoms
+from pymatgen.core.operations import SymmOp
+
+from pulgon_tools_wip.detect_generalized_translational_group import (
+    CyclicGroupAnalyzer,
+)
+from pulgon_tools_wip.detect_line_group import LineGroupDetector
+from pulgon_tools_wip.detect_point_group import LineGroupAnalyzer
+from pulgon_tools_wip.utils import get_perms_from_ops
+
+
+def _least_rotation(tokens: np.ndarray) -> int:
+    """start of the lexicographically least rotation of a cyclic sequence (Booth)"""
+    num = len(tokens)
+    fail = [-1] * (2 * num)
+    best = 0
+    for jj in range(1, 2 * num):
+        tok = tokens[jj % num]
+        ii = fail[jj - best - 1]
+        while ii != -1 and tok != tokens[(best + ii + 1) % num]:
+            if tok < tokens[(best + ii + 1) % num]:
+                best = jj - ii - 1
+            ii = fail[ii]
+        if tok != tokens[(best + ii + 1) % num]:
+            # ii == -1 here
+            if tok < tokens[best % num]:
+                best = jj
+            fail[jj - best] = -1
+        else:
+            fail[jj - best] = ii + 1
+    return best % num
+
+
+def canonical_order(
+    atoms: ase.atoms.Atoms, tolerance: float
+) -> [bytes, np.ndarray, float]:
+    """quantize a structure into a form independent of atom order and z shifts
+
+    The scale positions are wrapped into [0, 1) and the atoms are grouped
+    into layers along z, split where two consecutive atoms are more than
+    half a grid step apart. Every layer is described by its atoms relative
+    to its lowest one and by the gap to the next layer, and z is measured
+    from the layer that starts the least rotation of this cyclic sequence,
+    so a single reference is found without trying all the atoms. The
+    positions are rounded onto a grid with a spacing of tolerance and the
+    atoms are sorted by (number, grid position).
+
+    Args:
+        atoms: the structure
+        tolerance: grid spacing in Angstrom
+
+    Returns: the canonical data, the atom order, canonical index ii is the
+             atom order[ii] of the input, and the scale z of the reference
+
+    """
+    scaled = np.remainder(atoms.get_scaled_positions(wrap=False), 1)
+    numbers = atoms.numbers
+    step = tolerance / np.linalg.norm(atoms.cell, axis=1)
+    nbins = np.maximum(np.round(1 / step), 1).astype(np.int64)
+
+    # layers along z, starting after the largest gap so none is cut in two
+    by_z = np.argsort(scaled[:, 2], kind="stable")
+    zz = scaled[by_z, 2]
+    gaps = np.remainder(np.roll(zz, -1) - zz, 1)
+    if len(zz) == 1:
+        gaps[:] = 1
+    by_z = np.roll(by_z, -(int(np.argmax(gaps)) + 1))
+    zz = scaled[by_z, 2]
+    gaps = np.remainder(np.roll(zz, -1) - zz, 1)
+    if len(zz) == 1:
+        gaps[:] = 1
+    cuts = np.where(gaps > step[2] / 2)[0] + 1
+    layers = np.split(by_z, cuts[cuts < len(by_z)])
+    starts = scaled[[layer[0] for layer in layers], 2]
+
+    descriptions = []
+    for ii, layer in enumerate(layers):
+        rows = np.column_stack(
+            (
+                numbers[layer],
+                np.round(scaled[layer, :2] / step[:2]).astype(np.int64),
+                np.round(
+                    np.remainder(scaled[layer, 2] - starts[ii], 1) / step[2]
+                ).astype(np.int64),
+            )
+        )
+        rows = rows[np.lexsort(rows.T[::-1])]
+        gap = np.remainder(starts[(ii + 1) % len(layers)] - starts[ii], 1)
+        descriptions.append(
+            np.round(gap / step[2]).astype(np.int64).tobytes() + rows.tobytes()
+        )
+    _, tokens = np.unique(descriptions, return_inverse=True)
+    z_ref = starts[_least_rotation(tokens.ravel())]
+
+    pos = scaled.copy()
+    pos[:, 2] = np.remainder(pos[:, 2] - z_ref, 1)
+    grid = np.remainder(np.round(pos / step).astype(np.int64), nbins)
+    rows = np.column_stack((numbers, grid))
+    order = np.lexsort(rows.T[::-1])
+    return rows[order].tobytes(), order, z_ref
+
+
+def structure_key(
+    atoms: ase.atoms.Atoms, tolerance: float, *extra, shifts: bool = True
+) -> [str, np.ndarray]:
+    """canonical hash of (cell, numbers, quantized positions, tolerance)
+
+    Args:
+        atoms: the structure
+        tolerance: tolerance of the detection, also used as the grid spacing
+        extra: other things the result depends on, hashed by repr
+        shifts: whether the result is the same for all the z shifts of the
+            structure, if not the z of the reference is hashed as well
+
+    Returns: the key and the canonical atom order (see canonical_order)
+
+    """
+    data, order, z_ref = canonical_order(atoms, tolerance)
+    sha = hashlib.sha256()
+    sha.update(np.round(np.asarray(atoms.cell) / tolerance).tobytes())
+    sha.update(repr(float(tolerance)).encode())
+    sha.update(repr(extra).encode())
+    if not shifts:
+        sha.update(
+            np.round(z_ref * atoms.cell.lengths()[2] / tolerance)
+            .astype(np.int64)
+            .tobytes()
+        )
+    sha.update(data)
+    return sha.hexdigest(), order
+
+
+class ResultCache:
+    """A content-addressed result store in a local directory
+
+    Every entry is a pickle file named by its key. Files are written to a
+    temporary name and renamed, so concurrent readers never see partial
+    entries and concurrent writers of the same key simply overwrite each
+    other with the same content. A hit refreshes the modification time of
+    the entry, and the least recently used entries are removed once the
+    store grows larger than max_size.
+    """
+
+    def __init__(
+        self,
+        path: Union[str, None] = None,
+        max_size: int = 256 * 1024**2,
+    ) -> None:
+        """
+
+        Args:
+            path: directory of the store, $PULGON_CACHE_DIR or
+                ~/.cache/pulgon_tools_wip by default
+            max_size: size limit of the store in bytes
+        """
+        if path is None:
+            path = os.environ.get(
+                "PULGON_CACHE_DIR",
+                os.path.join(
+                    os.path.expanduser("~"), ".cache", "pulgon_tools_wip"
+                ),
+            )
+        self.path = path
+        self.max_size = max_size
+        self.hits, self.misses = 0, 0
+        os.makedirs(self.path, exist_ok=True)
+        self._size = sum(size for _, _, size in self._entries())
+
+    def _filename(self, key: str) -> str:
+        return os.path.join(self.path, key[:2], key + ".pkl")
+
+    def _entries(self) -> list:
+        res = []
+        for sub in os.scandir(self.path):
+            if not sub.is_dir():
+                continue
+            for entry in os.scandir(sub.path):
+                if not entry.name.endswith(".pkl"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                res.append((stat.st_mtime, entry.path, stat.st_size))
+        return res
+
+    def get(self, key: str):
+        """load an entry, None if it does not exist or can not be read"""
+        filename = self._filename(key)
+        try:
+            with open(filename, "rb") as f:
+                value = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except (EOFError, pickle.UnpicklingError):
+            logging.warning("Broken cache entry %s" % filename)
+            return None
+        try:
+            os.utime(filename)
+        except FileNotFoundError:
+            pass
+        return value
+
+    def put(self, key: str, value) -> None:
+        """store an entry and evict old ones if the store is too large"""
+        filename = self._filename(key)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(
+            dir=os.path.dirname(filename), suffix=".tmp"
+        )
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        self._size += os.path.getsize(tmp)
+        os.replace(tmp, filename)
+        if self._size > self.max_size:
+            self.evict()
+
+    def evict(self) -> None:
+        """remove the least recently used entries until the store fits in max_size"""
+        entries = sorted(self._entries())
+        self._size = sum(size for _, _, size in entries)
+        for _, filename, size in entries:
+            if self._size <= self.max_size:
+                break
+            try:
+                os.remove(filename)
+            except FileNotFoundError:
+                pass
+            self._size -= size
+
+    def get_or_compute(self, key: str, compute: Callable):
+        """return the stored value of key, compute and store it on a miss"""
+        value = self.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+        self.misses += 1
+        value = compute()
+        self.put(key, value)
+        return value
+
+
+def _to_matrices(ops):
+    if isinstance(ops, SymmOp):
+        return ops.affine_matrix
+    return [_to_matrices(op) for op in ops]
+
+
+def _to_symmops(ops):
+    if isinstance(ops, np.ndarray):
+        return SymmOp(ops)
+    return [_to_symmops(op) for op in ops]
+
+
+def cached_cyclic_group(
+    atoms: ase.atoms.Atoms,
+    tolerance: float = 0.001,
+    cache: Union[ResultCache, None] = None,
+    **kwargs,
+) -> [list, list]:
+    """CyclicGroupAnalyzer behind a ResultCache
+
+    The operations keep the z axis, they commute with z shifts, so all the
+    shifted copies of a structure share an entry.
+
+    Args:
+        atoms: Line group structure
+        tolerance: passed to CyclicGroupAnalyzer
+        cache: the store, a default ResultCache if None
+        kwargs: other arguments of CyclicGroupAnalyzer
+
+    Returns: the cyclic groups and their symmetry operations
+
+    """
+    cache = ResultCache() if cache is None else cache
+    key, _ = structure_key(atoms, tolerance, "cyclic", sorted(kwargs.items()))
+
+    def compute():
+        cyclic = CyclicGroupAnalyzer(atoms, tolerance=tolerance, **kwargs)
+        return {
+            "cyclic_group": cyclic.cyclic_group,
+            "sym_operations": _to_matrices(cyclic._sym_operations),
+        }
+
+    res = cache.get_or_compute(key, compute)
+    return res["cyclic_group"], _to_symmops(res["sym_operations"])
+
+
+def cached_axial_point_group(
+    atoms: ase.atoms.Atoms,
+    tolerance: float = 0.01,
+    cache: Union[ResultCache, None] = None,
+) -> [str, list]:
+    """LineGroupAnalyzer behind a ResultCache
+
+    The operations refer to the frame of the input, so every z shift of a
+    structure gets an entry of its own.
+
+    Args:
+        atoms: Line group structure
+        tolerance: passed to LineGroupAnalyzer
+        cache: the store, a default ResultCache if None
+
+    Returns: Schoenflies symbol and the symmetry operations found
+
+    """
+    cache = ResultCache() if cache is None else cache
+    key, _ = structure_key(atoms, tolerance, "axial", shifts=False)
+
+    def compute():
+        obj = LineGroupAnalyzer(atoms, tolerance=tolerance)
+        return {
+            "sch_symbol": obj.sch_symbol,
+            "symmops": _to_matrices(obj.symmops),
+        }
+
+    res = cache.get_or_compute(key, compute)
+    return res["sch_symbol"], _to_symmops(res["symmops"])
+
+
+def cached_perms_from_ops(
+    atoms: Atoms,
+    ops_sym: list,
+    symprec: float = 1e-2,
+    cache: Union[ResultCache, None] = None,
+) -> np.ndarray:
+    """get_perms_from_ops behind a ResultCache
+
+    The table is stored in the canonical atom order and mapped back to the
+    atom order of the input, so a permuted structure reuses the entry.
+    Sigma_h and U act about the center of mass of the wrapped positions,
+    which moves with a z shift, so a shifted structure does not.
+
+    Args:
+        atoms: the structure
+        ops_sym: symmetry operations
+        symprec: passed to get_perms_from_ops
+        cache: the store, a default ResultCache if None
+
+    Returns: permutation table
+
+    """
+    cache = ResultCache() if cache is None else cache
+    ops = np.round(np.array([op.affine_matrix for op in ops_sym]) / symprec)
+    key, order = structure_key(
+        atoms, symprec, "perms", ops.tobytes(), shifts=False
+    )
+    inv_order = np.argsort(order)
+
+    def compute():
+        perms = get_perms_from_ops(atoms, ops_sym, symprec=symprec)
+        return inv_order[perms[:, order]]
+
+    perms = cache.get_or_compute(key, compute)
+    return order[perms[:, inv_order]].astype(np.int32)
+
+
+def cached_line_group(
+    atoms: ase.atoms.Atoms,
+    tolerance: float = 1e-3,
+    cyclic_tolerance: float = 1e-2,
+    cache: Union[ResultCache, None] = None,
+) -> dict:
+    """LineGroupDetector behind a ResultCache
+
+    The generators and permutation tables refer to the primitive cell that
+    is stored along with them, which is the one of the first structure
+    detected under this key. The generators refer to the frame of the
+    input, so every z shift of a structure gets an entry of its own.
+
+    Args:
+        atoms: Line group structure
+        tolerance: tolerance of the axial point group
+        cyclic_tolerance: tolerance of the generalized translational group
+        cache: the store, a default ResultCache if None
+
+    Returns: family, translation_symbol, generalized_translation,
+             axial_point_group, generators, perms_table and primitive
+
+    """
+    cache = ResultCache() if cache is None else cache
+    key, _ = structure_key(
+        atoms, tolerance, "line", cyclic_tolerance, shifts=False
+    )
+
+    def compute():
+        obj = LineGroupDetector(
+            atoms, tolerance=tolerance, cyclic_tolerance=cyclic_tolerance
+        )
+        return {
+            "family": obj.family,
+            "translation_symbol": obj.translation_symbol,
+            "generalized_translation": obj.generalized_translation,
+            "axial_point_group": obj.axial_point_group,
+            "generators": _to_matrices(obj.generators),
+            "perms_table": obj.perms_table,
+            "primitive": obj.primitive,
+        }
+
+    res = dict(cache.get_or_compute(key, compute))
+    res["generators"] = _to_symmops(res["generators"])
+    return res
@@ -0,0 +1,230 @@
+# Copyright 2023 The PULGON Project Developers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied. See the License for the specific language governing
+# permissions and limitations under the License.
+
+import argparse
+import functools
+import glob
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from typing import Iterator, Union
+
+from ase.io import read
+
+from pulgon_tools_wip.cache import ResultCache, cached_line_group
+from pulgon_tools_wip.detect_line_group import LineGroupDetector
+
+
+def collect_files(patterns: list) -> list:
+    """expand directories and glob patterns into a sorted list of files
+
+    Args:
+        patterns: directories, files or glob patterns
+
+    Returns: files, without duplicates
+
+    """
+    files = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            candidates = [
+                os.path.join(pattern, tmp) for tmp in os.listdir(pattern)
+            ]
+        else:
+            candidates = glob.glob(pattern, recursive=True)
+        files.extend(
+            tmp
+            for tmp in candidates
+            if os.path.isfile(tmp)
+            and not os.path.basename(tmp).startswith(".")
+        )
+    return sorted(set(files))
+
+
+@functools.lru_cache(maxsize=None)
+def _process_cache(cache_dir: str) -> ResultCache:
+    """one ResultCache per process and directory, the store is scanned once"""
+    return ResultCache(cache_dir)
+
+
+def detect_one(
+    filename: str,
+    tolerance: float = 1e-3,
+    cyclic_tolerance: float = 1e-2,
+    fmt: str = "vasp",
+    cache_dir: Union[str, None] = None,
+) -> dict:
+    """detect the line group of one structure file, never raise
+
+    Args:
+        filename: path of the structure
+        tolerance: tolerance of the axial point group
+        cyclic_tolerance: tolerance of the generalized translational group
+        fmt: file format passed to ase.io.read
+        cache_dir: directory of a ResultCache, None to detect every time
+
+    Returns: a JSON serializable record, "error" is None on success, it is
+             also set when the symbols do not match any line group family
+
+    """
+    res = {
+        "file": filename,
+        "family": None,
+        "generalized_translation": None,
+        "axial_point_group": None,
+        "error": None,
+    }
+    t0 = time.perf_counter()
+    try:
+        atom = read(filename, format=fmt)
+        if cache_dir is None:
+            obj = LineGroupDetector(
+                atom, tolerance=tolerance, cyclic_tolerance=cyclic_tolerance
+            )
+            family, trans_sym, rota_sym = obj.get_line_group()
+        else:
+            obj = cached_line_group(
+                atom,
+                tolerance=tolerance,
+                cyclic_tolerance=cyclic_tolerance,
+                cache=_process_cache(cache_dir),
+            )
+            family = obj["family"]
+            trans_sym = obj["translation_symbol"]
+            rota_sym = obj["axial_point_group"]
+        res["family"] = family
+        res["generalized_translation"] = trans_sym
+        res["axial_point_group"] = rota_sym
+        if family is None:
+            res["error"] = "Unknown line group family of %s %s" % (
+                trans_sym,
+                rota_sym,
+            )
+    except Exception as err:
+        res["error"] = "%s: %s" % (type(err).__name__, err)
+    res["time"] = round(time.perf_counter() - t0, 6)
+    return res
+
+
+def detect_batch(
+    files: list,
+    jobs: int = 1,
+    chunksize: int = 1,
+    **kwargs,
+) -> Iterator[dict]:
+    """detect the line groups of many files with a pool of worker processes
+
+    The workers import the package once and are reused for all the files,
+    the records are yielded as soon as they are ready, not in input order.
+
+    Args:
+        files: paths of the structures
+        jobs: number of worker processes, 1 runs in the current process
+        chunksize: number of files sent to a worker at once
+        kwargs: passed to detect_one
+
+    Returns: the records of detect_one
+
+    """
+    func = functools.partial(detect_one, **kwargs)
+    if jobs == 1:
+        yield from map(func, files)
+        return
+    with multiprocessing.Pool(processes=jobs) as pool:
+        yield from pool.imap_unordered(func, files, chunksize=chunksize)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Detect the line groups of many structures, one JSON line per structure"
+    )
+    parser.add_argument(
+        "paths",
+        nargs="+",
+        help="structure files, directories or glob patterns",
+    )
+    parser.add_argument(
+        "--tol",
+        help="tolerance of axial point group",
+        type=float,
+        default=1e-3,
+    )
+    parser.add_argument(
+        "--cyclic_tol",
+        help="tolerance of generalized translational group",
+        type=float,
+        default=1e-2,
+    )
+    parser.add_argument(
+        "--format", help="file format for ase.io.read", default="vasp"
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        help="number of worker processes",
+        type=int,
+        default=os.cpu_count() or 1,
+    )
+    parser.add_argument(
+        "--chunksize",
+        help="number of files sent to a worker at once",
+        type=int,
+        default=4,
+    )
+    parser.add_argument(
+        "--cache",
+        help="directory of the result cache, no cache by default",
+        default=None,
+    )
+    parser.add_argument(
+        "-o", "--output", help="save the JSON lines to a file", default=None
+    )
+    args = parser.parse_args()
+
+    # the analyzers report problems of single files through logging,
+    # the errors are already in the records
+    logging.getLogger().setLevel(logging.CRITICAL)
+
+    files = collect_files(args.paths)
+    out = sys.stdout if args.output is None else open(args.output, "w")
+    t0 = time.perf_counter()
+    n_failed = 0
+    try:
+        for res in detect_batch(
+            files,
+            jobs=max(1, min(args.jobs, len(files))),
+            chunksize=args.chunksize,
+            tolerance=args.tol,
+            cyclic_tolerance=args.cyclic_tol,
+            fmt=args.format,
+            cache_dir=args.cache,
+        ):
+            n_failed += res["error"] is not None
+            out.write(json.dumps(res) + "\n")
+            out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    print(
+        "%d files, %d failed, %.2f s"
+        % (len(files), n_failed, time.perf_counter() - t0),
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    main()
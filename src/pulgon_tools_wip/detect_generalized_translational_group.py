@@ -26,7 +26,11 @@ from ipdb import set_trace
 from pymatgen.core.operations import SymmOp
 from pymatgen.util.coord import find_in_coord_list
 
-from pulgon_tools_wip.utils import angle_between_points, refine_cell
+from pulgon_tools_wip.utils import (
+    PeriodicSiteIndex,
+    QuantizedSiteSet,
+    angle_between_points,
+)
 
 # logging.basicConfig(
 #     level=logging.DEBUG,  # 设置最低日志级别为 DEBUG
@@ -53,6 +57,7 @@ class CyclicGroupAnalyzer:
         atom: ase.atoms.Atoms,
         tolerance: float = 0.001,
         round_symprec: int = 5,
+        exact_screw: bool = False,
     ) -> None:
         """
 
@@ -60,6 +65,8 @@ class CyclicGroupAnalyzer:
             atom: Line group structure to determine the generalized translational group
             spmprec: system precise tolerance
             round_symprec: system precise tolerance when take "np.round"
+            exact_screw: only try the screw angles on the rational grid
+                360 / (n * ind) and return Q as an exact fraction
 
         """
         logging.debug(
@@ -83,6 +90,15 @@ class CyclicGroupAnalyzer:
 
             self._primitive = self._find_primitive()
             self._pure_trans = self._primitive.cell[2, 2]
+            self._index = PeriodicSiteIndex(
+                self._primitive.positions,
+                self._primitive.numbers,
+                boxsize=[0, 0, self._pure_trans],
+                symprec=self._symprec,
+            )
+            self._exact_screw = exact_screw
+            if exact_screw:
+                self._rot_order = self._get_rotational_order()
 
             self._analyze()
 
@@ -277,6 +293,145 @@ class CyclicGroupAnalyzer:
         )
         return pot_angle
 
+    def _get_rotational_order(self) -> int:
+        """get the order n of the pure rotation Cn of the primitive cell
+
+        Every layer is invariant under Cn, so n divides the number of
+        off-axis atoms of each element in each layer. Only the divisors of
+        their greatest common divisor are checked geometrically.
+
+        Returns: the largest n such that Cn is a symmetry of the primitive cell
+
+        """
+        center = ([0.5, 0.5, 0] @ self._primitive.cell)[:2]
+        off_axis = (
+            np.linalg.norm(self._primitive.positions[:, :2] - center, axis=1)
+            > self._symprec
+        )
+        if not off_axis.any():
+            return 1
+        labels, _, _, _ = self._get_layers(
+            self._primitive.get_scaled_positions()[:, 2]
+        )
+        _, counts = np.unique(
+            np.column_stack(
+                (labels[off_axis], self._primitive.numbers[off_axis])
+            ),
+            axis=0,
+            return_counts=True,
+        )
+        g = np.gcd.reduce(counts)
+        divisors = np.array([d for d in range(g, 1, -1) if g % d == 0])
+        if len(divisors) == 0:
+            return 1
+
+        affine = self._helical_affine_matrices(360 / divisors, 0, 2)[:, 0, 0]
+        coords = np.hstack(
+            (self._primitive.positions, np.ones((len(self._primitive), 1)))
+        )
+        operated = np.einsum("kij,mj->kmi", affine[:, :3], coords)
+        valid = self._index.match(operated, self._primitive.numbers).all(
+            axis=1
+        )
+        return int(divisors[valid][0]) if valid.any() else 1
+
+    def _detect_exact_helical_angle(
+        self, ind: int, monomer: ase.atoms.Atoms
+    ) -> [np.ndarray, list]:
+        """put the candidate screw angles on the rational grid 360 / (n * ind)
+
+        (CQ|f)^ind is a pure translation combined with a rotation of the
+        Cn point group, so the screw angle must be 360 * k / (n * ind) for
+        an integer k. The measured angles only select which k are tried.
+
+        Args:
+            ind: monomer layer numbers in the primitive cell
+            monomer: monomer candidates
+
+        Returns: candidate rotational degrees and the exact Q of each one
+
+        """
+        grid = self._rot_order * ind
+        measured = self._detect_possible_helical_angle(ind, monomer)
+        k = np.round(measured * grid / 360).astype(int)
+        # drop the measured angles far away from any grid point
+        on_grid = (abs(measured - 360 * k / grid) < 90 / grid) & (k > 0)
+        k = np.unique(k[on_grid])
+        return 360 * k / grid, [Fraction(grid, int(kk)) for kk in k]
+
+    def _helical_affine_matrices(
+        self, pot_angle: np.ndarray, tran: np.float64, ind: int
+    ) -> np.ndarray:
+        """stack the screw operations of all candidate angles
+
+        Args:
+            pot_angle: candidate rotational degrees
+            tran: the translational distance of monomer candidates
+            ind: monomer layer numbers in the primitive cell
+
+        Returns: (k, 2, ind - 1, 4, 4) affine matrices, rotating by
+                 +/- angle * layer around the tube axis and moving by
+                 tran * layer along z
+
+        """
+        a, b = ([0.5, 0.5, 0] @ self._primitive.cell)[:2]
+        layers = np.arange(1, ind)
+        theta = np.radians(
+            np.asarray(pot_angle)[:, np.newaxis, np.newaxis]
+            * np.array([1, -1])[np.newaxis, :, np.newaxis]
+            * layers[np.newaxis, np.newaxis, :]
+        )
+        cos_t, sin_t = np.cos(theta), np.sin(theta)
+
+        affine = np.zeros(theta.shape + (4, 4))
+        affine[..., 0, 0] = cos_t
+        affine[..., 0, 1] = -sin_t
+        affine[..., 1, 0] = sin_t
+        affine[..., 1, 1] = cos_t
+        affine[..., 2, 2] = 1
+        affine[..., 3, 3] = 1
+        # the rotation axis passes through the center of the cell
+        affine[..., 0, 3] = a * (1 - cos_t) + b * sin_t
+        affine[..., 1, 3] = b * (1 - cos_t) - a * sin_t
+        affine[..., 2, 3] = tran * layers
+        return affine
+
+    def _detect_rotation_batch(
+        self,
+        monomer: ase.atoms.Atoms,
+        tran: np.float64,
+        ind: int,
+        pot_angle: np.ndarray,
+    ) -> [np.ndarray, np.ndarray, np.ndarray]:
+        """check all the candidate screw operations in one pass
+
+        Args:
+            monomer: monomer candidates
+            tran: the translational distance of monomer candidates
+            ind: monomer layer numbers in the primitive cell
+            pot_angle: candidate rotational degrees
+
+        Returns: affine matrices with shape (k, 2, ind - 1, 4, 4),
+                 the accumulated layer-by-layer result with shape
+                 (k, 2, ind - 1) and the surviving (angle, sign) pairs
+                 with shape (k, 2)
+
+        """
+        affine = self._helical_affine_matrices(pot_angle, tran, ind)
+        coords = np.hstack((monomer.positions, np.ones((len(monomer), 1))))
+        operated = np.einsum(
+            "kij,mj->kmi", affine.reshape(-1, 4, 4)[:, :3], coords
+        )
+        valid = (
+            self._index.match(operated, monomer.numbers)
+            .all(axis=1)
+            .reshape(affine.shape[:3])
+        )
+        # a screw operation is kept only if it works on all previous layers
+        valid = np.logical_and.accumulate(valid, axis=2)
+        survived = valid.all(axis=2)
+        return affine, valid, survived
+
     def _detect_rotation(
         self, monomer: ase.atoms.Atoms, tran: np.float64, ind: int
     ) -> [bool, Union[int, float]]:
@@ -290,92 +445,28 @@ class CyclicGroupAnalyzer:
         Returns: judge if the rotational symmetry exist and rotational index Q
 
         """
-        coords = self._primitive.get_scaled_positions() @ self._primitive.cell
-        center = [0.5, 0.5, 0] @ self._primitive.cell
-
-        # detect the monomer's rotational symmetry for specifying therotation
-        # mol = Molecule(species=monomer.numbers, coords=monomer.positions)
-        # monomer_rot_ind = PointGroupAnalyzer(mol)._check_rot_sym(self._zaxis)
-        # pot_angle = (
-        #     np.array(
-        #         [
-        #             360 * ii / monomer_rot_ind
-        #             for ii in range(1, monomer_rot_ind + 1)
-        #         ]
-        #     )
-        #     / ind
-        # )
-
         # possible rotational angle in cyclic group
-        pot_angle = self._detect_possible_helical_angle(ind, monomer)
+        if self._exact_screw:
+            pot_angle, pot_Q = self._detect_exact_helical_angle(ind, monomer)
+        else:
+            pot_angle = self._detect_possible_helical_angle(ind, monomer)
         logging.debug("Candidate rotational degree is: %s" % str(pot_angle))
-        # set_trace()
-
-        for test_ind in pot_angle:
-            itp1, itp2 = (
-                True,
-                True,
-            )  # record the rotational result from different layer
-
-            tmp_sym_op = []
-            for layer in range(1, ind):
-                # op1 = SymmOp.from_axis_angle_and_translation(
-                #     self._zaxis,
-                #     test_ind * layer,
-                #     translation_vec=(0, 0, tran * layer),
-                # )
-                # op2 = SymmOp.from_axis_angle_and_translation(
-                #     self._zaxis,
-                #     -test_ind * layer,
-                #     translation_vec=(0, 0, tran * layer),
-                # )
-                op1 = SymmOp.from_origin_axis_angle(
-                    origin=center, axis=self._zaxis, angle=test_ind * layer
-                )
-                op1 = SymmOp.from_rotation_and_translation(
-                    op1.rotation_matrix,
-                    op1.translation_vector + [0, 0, tran * layer],
-                )
-                op2 = SymmOp.from_origin_axis_angle(
-                    origin=center, axis=self._zaxis, angle=-test_ind * layer
-                )
-                op2 = SymmOp.from_rotation_and_translation(
-                    op2.rotation_matrix,
-                    op2.translation_vector + [0, 0, tran * layer],
-                )
-
-                itp3, itp4 = (
-                    [],
-                    [],
-                )  # record the rotational result in current layer
-                for ii, site in enumerate(monomer):
-                    coord1 = op1.operate(site.position)
-                    coord2 = op2.operate(site.position)
-                    # coord1 = np.remainder(op1.operate(np.remainder(site.scaled_position - [0.5,0.5,0.5], [1,1,1])), [1,1,1])
-                    # coord2 = np.remainder(op2.operate(np.remainder(site.scaled_position - [0.5,0.5,0.5],[1,1,1])), [1,1,1])
-
-                    tmp1 = find_in_coord_list(coords, coord1, self._symprec)
-                    tmp2 = find_in_coord_list(coords, coord2, self._symprec)
-                    # set_trace()
-                    itp3.append(
-                        len(tmp1) == 1
-                        and self._primitive.numbers[tmp1[0]] == site.number
-                    )
-                    itp4.append(
-                        len(tmp2) == 1
-                        and self._primitive.numbers[tmp2[0]] == site.number
-                    )
-                itp1 = itp1 and np.array(itp3).all()
-                itp2 = itp2 and np.array(itp4).all()
 
-                if not (itp1 or itp2):
-                    break
-                if itp1:
-                    tmp_sym_op.append(op1)
-                if itp2:
-                    tmp_sym_op.append(op2)
-            if itp1 or itp2:
-                Q = Fraction(360 / test_ind).limit_denominator()
+        affine, valid, survived = self._detect_rotation_batch(
+            monomer, tran, ind, pot_angle
+        )
+        for ii, test_ind in enumerate(pot_angle):
+            if survived[ii].any():
+                tmp_sym_op = [
+                    SymmOp(affine[ii, jj, layer])
+                    for layer in range(ind - 1)
+                    for jj in range(2)
+                    if valid[ii, jj, layer]
+                ]
+                if self._exact_screw:
+                    Q = pot_Q[ii]
+                else:
+                    Q = Fraction(360 / test_ind).limit_denominator()
 
                 logging.debug(
                     "The minimal rotational degree is: %s" % test_ind
@@ -383,83 +474,139 @@ class CyclicGroupAnalyzer:
                 return True, Q, tmp_sym_op
         return False, 1, None
 
+    def _mirror_candidate_normals(
+        self, monomer: ase.atoms.Atoms, diff_st: ase.atoms.Atoms, tran
+    ) -> np.ndarray:
+        """generate the normals of the candidate mirror planes
+
+        Every pair of a monomer site and a site of the same type in the
+        other layer defines a candidate normal. Normals pointing in the
+        same direction (within the tolerance) give the same mirror plane
+        and are only kept once, in the order of their first appearance.
+
+        Args:
+            monomer: monomer candidates
+            diff_st: the sites of the primitive cell outside the monomer
+            tran: the translational distance of monomer candidates
+
+        Returns: (k, 3) normals of the candidate mirror planes
+
+        """
+        itp1, itp2 = np.triu_indices(len(monomer), m=len(diff_st))
+        pos1, pos2 = monomer.positions[itp1], diff_st.positions[itp2]
+        mask = (monomer.numbers[itp1] == diff_st.numbers[itp2]) & (
+            pos1[:, 2] + tran - pos2[:, 2] < self._symprec
+        )
+        normals = pos1[mask] - pos2[mask]
+        normals[:, 2] = 0
+        length = np.linalg.norm(normals, axis=1)
+        normals = normals[length > self._symprec]
+        if len(normals) == 0:
+            return normals
+
+        # the direction of a mirror plane is defined modulo pi
+        center = ([0.5, 0.5, 0.5] @ self._primitive.cell)[:2]
+        radius = np.linalg.norm(monomer.positions[:, :2] - center, axis=1)
+        angle_tol = self._symprec / max(2 * radius.max(), self._symprec)
+        angle = np.remainder(np.arctan2(normals[:, 1], normals[:, 0]), np.pi)
+        nbins = max(int(np.round(np.pi / angle_tol)), 1)
+        keys = np.remainder(
+            np.round(angle / angle_tol).astype(np.int64), nbins
+        )
+        _, first = np.unique(keys, return_index=True)
+        return normals[np.sort(first)]
+
     def _detect_mirror(
         self,
         monomer: ase.atoms.Atoms,
         tran: np.float64,
+        max_candidates: int = None,
+        chunk: int = 64,
     ) -> bool:
         """
 
         Args:
             monomer: monomer candidates
             tran: the translational distance of monomer candidates
+            max_candidates: upper bound of the candidate mirror planes to test
+            chunk: number of candidate mirror planes verified at once
 
         Returns: judge if the mirror symmetry exist
 
         """
 
-        coords = self._primitive.positions
-        diff_st_ind = np.array(
-            [
-                find_in_coord_list(coords, coord, self._symprec)
-                # for coord in sites_pos
-                for coord in monomer.positions
-            ]
-        )
-
-        if diff_st_ind.ndim > 1:
-            diff_st_ind = diff_st_ind.T[0]
         # diff_st: diff_st + monomer = primitive cell
-        diff_st = self._primitive[
-            np.setdiff1d(range(len(coords)), diff_st_ind)
-        ]
-
-        for itp1, itp2 in itertools.combinations_with_replacement(
-            range(len(monomer)), 2
-        ):
-            s1, s2 = monomer[itp1], diff_st[itp2]
-
-            if (
-                s1.number == s2.number
-                and (s1.position[2] + tran - s2.position[2]) < self._symprec
-            ):
-                normal = s1.position - s2.position
-                normal[2] = 0
-                op = SymmOp.reflection(
-                    normal, origin=([0.5, 0.5, 0.5] @ self._primitive.cell)
-                )
-                # op = SymmOp.reflection(normal)
-                # set_trace()
+        in_diff_st = np.ones(len(self._primitive), dtype=bool)
+        monomer_ind = self._index.query(monomer.positions)
+        in_diff_st[monomer_ind[monomer_ind >= 0]] = False
+        diff_st = self._primitive[in_diff_st]
+
+        normals = self._mirror_candidate_normals(monomer, diff_st, tran)
+        if max_candidates is not None:
+            normals = normals[:max_candidates]
+        logging.debug("Test %d candidate mirror planes" % len(normals))
+
+        origin = [0.5, 0.5, 0.5] @ self._primitive.cell
+        coords = np.hstack((monomer.positions, np.ones((len(monomer), 1))))
+        for start in range(0, len(normals), chunk):
+            ops = []
+            for normal in normals[start : start + chunk]:
+                op = SymmOp.reflection(normal, origin=origin)
                 op = SymmOp.from_rotation_and_translation(
                     op.rotation_matrix,
                     op.translation_vector + np.array([0, 0, tran]),
                 )
-                itp = []
-                for site in monomer:
-                    coord = op.operate(site.position)
-                    tmp = find_in_coord_list(
-                        diff_st.positions, coord, self._symprec
-                    )
-                    # tmp = find_in_coord_list(diff_st.get_scaled_positions(), coord, self._symprec)
-                    itp.append(
-                        len(tmp) == 1
-                        and diff_st.numbers[tmp[0]] == site.number
-                    )
-                # set_trace()
-                if np.array(itp).all():
-                    return True, op
+                ops.append(op)
+            affine = np.array([op.affine_matrix for op in ops])
+            idx = self._index.query(np.inner(coords, affine)[..., :-1])
+            itp = (
+                (idx >= 0)
+                & in_diff_st[idx]
+                & (self._primitive.numbers[idx] == monomer.numbers[:, None])
+            ).all(axis=0)
+            if itp.any():
+                return True, ops[np.argmax(itp)]
         return False, None
 
-    def _get_monomer_ind(
-        self, z: np.ndarray, z_uniq: np.ndarray
-    ) -> [list, list]:
-        monomer_ind = [np.where(z == tmp)[0] for tmp in z_uniq]
-        monomer_ind_sum = []
-        tmp1 = np.array([])
-        for tmp in monomer_ind:
-            tmp1 = np.sort(np.append(tmp1, tmp)).astype(np.int32)
-            monomer_ind_sum.append(tmp1)
-        return monomer_ind, monomer_ind_sum
+    def _get_layers(
+        self, z: np.ndarray
+    ) -> [np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """cluster the atoms into layers along z in a single sort-and-gap pass
+
+        Args:
+            z: scaled z coordinates of the atoms
+
+        Returns: layer label of each atom, z of each layer, atom numbers of
+                 each layer and the atom indices sorted layer by layer, so
+                 that order[: counts[: ii + 1].sum()] is the monomer made of
+                 the first ii + 1 layers
+
+        """
+        tol = max(
+            10.0**-self._round_symprec, self._symprec / self._pure_trans
+        )
+        z = np.remainder(z, 1)
+        order = np.argsort(z, kind="stable")
+        z_sort = z[order]
+        # the last layer continues the first one across the periodic boundary
+        if len(z) > 1 and z_sort[0] + 1 - z_sort[-1] < tol:
+            breaks = np.where(np.diff(z_sort) >= tol)[0]
+            if len(breaks) > 0:
+                z = z.copy()
+                z[order[breaks[-1] + 1 :]] -= 1
+                order = np.argsort(z, kind="stable")
+                z_sort = z[order]
+
+        new_layer = np.concatenate(([True], np.diff(z_sort) >= tol))
+        labels_sort = np.cumsum(new_layer) - 1
+        counts = np.bincount(labels_sort)
+        layer_z = np.round(
+            np.bincount(labels_sort, weights=z_sort) / counts,
+            self._round_symprec,
+        )
+        labels = np.empty_like(labels_sort)
+        labels[order] = labels_sort
+        return labels, layer_z, counts, order
 
     def _potential_translation(self) -> [list, list]:
         """generate the potential monomer and the scaled translational distance in z axis
@@ -468,16 +615,13 @@ class CyclicGroupAnalyzer:
 
         """
         z = self._primitive.get_scaled_positions()[:, 2]
-        z = np.round(z, self._round_symprec)
-        # z = np.round(z, 6)
-
-        z_uniq, counts = np.unique(z, return_counts=True)
+        _, z_uniq, counts, order = self._get_layers(z)
         potential_trans = np.append((z_uniq - z_uniq[0])[1:], 1)
-        monomer_ind, monomer_ind_sum = self._get_monomer_ind(z, z_uniq)
+        monomer_nums = np.cumsum(counts)
 
         translation, monomer = [], []
         for ii in range(len(z_uniq)):
-            monomer_num = counts[: ii + 1].sum()
+            monomer_num = monomer_nums[ii]
             # check the atomic number and layer number of potential monomer
             # check the translational distance whether correspond to the layer numbers
             if (
@@ -489,12 +633,12 @@ class CyclicGroupAnalyzer:
             ):
                 if len(self._primitive) == monomer_num:
                     # if the monomer is the whole structure
-                    # monomer.append(self._primitive)
                     monomer.append(self._primitive)
                     translation.append(1)
                 else:
-                    # monomer.append(self._primitive[monomer_ind_sum[ii]])
-                    monomer.append(self._primitive[monomer_ind_sum[ii]])
+                    monomer.append(
+                        self._primitive[np.sort(order[:monomer_num])]
+                    )
                     translation.append(potential_trans[ii])
         return monomer, translation
 
@@ -513,25 +657,22 @@ class CyclicGroupAnalyzer:
             logging.debug("It's a primitive cell")
             return self._atom
         else:
-            potential_z = z[ind] - z[0]
-
+            potential_z = np.sort(z[ind] - z[0])
+
+            scale_pos = self._atom.get_scaled_positions()
+            sites = QuantizedSiteSet(
+                scale_pos,
+                self._atom.numbers,
+                step=max(self._symprec, 10.0**-self._round_symprec),
+                tolerance=self._symprec,
+            )
             trans_z = []
+            # candidates are sorted, the first pure translation is minimal
             for tmp in potential_z:
                 v = np.array([0, 0, tmp])
-                pos1, num1 = refine_cell(
-                    self._atom.get_scaled_positions() + v,
-                    self._atom.numbers,
-                    symprec=self._round_symprec,
-                )
-                pos2, num2 = refine_cell(
-                    self._atom.get_scaled_positions(),
-                    self._atom.numbers,
-                    symprec=self._round_symprec,
-                )
-                if (abs(pos1 - pos2) < self._symprec).all() and (
-                    num1 == num2
-                ).all():
+                if sites.contains(scale_pos + v, self._atom.numbers):
                     trans_z.append(tmp)
+                    break
             if len(trans_z) == 0:
                 logging.debug("It's a primitive cell")
                 return self._atom
@@ -0,0 +1,249 @@
+# Copyright 2023 The PULGON Project Developers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied. See the License for the specific language governing
+# permissions and limitations under the License.
+
+import argparse
+import logging
+import re
+from typing import Union
+
+import ase
+import numpy as np
+from ase.io import read
+from pymatgen.core import Molecule
+from pymatgen.core.operations import SymmOp
+
+from pulgon_tools_wip.detect_generalized_translational_group import (
+    CyclicGroupAnalyzer,
+)
+from pulgon_tools_wip.detect_point_group import LineGroupAnalyzer
+from pulgon_tools_wip.line_group_table import get_family_Num_from_sym_symbol
+
+
+class LineGroupDetector:
+    """A class to detect the whole line group of a structure in a single pass
+
+    The general outline of the algorithm is as follows:
+
+    1. CyclicGroupAnalyzer centers the structure, finds the primitive cell
+       and the generalized translational group.
+    2. The primitive cell is handed to LineGroupAnalyzer as it is, without
+       centering it a second time, to find the axial point group.
+    3. All the generators are expressed in the frame of the primitive cell,
+       and the site index of CyclicGroupAnalyzer is reused to build their
+       permutation tables.
+    """
+
+    def __init__(
+        self,
+        atom: ase.atoms.Atoms,
+        tolerance: float = 1e-3,
+        cyclic_tolerance: float = 1e-2,
+        exact_screw: bool = False,
+    ) -> None:
+        """
+
+        Args:
+            atom: Line group structure, the axis should be along OZ
+            tolerance: system precise tolerance of the axial point group
+            cyclic_tolerance: system precise tolerance of the generalized
+                translational group
+            exact_screw: passed to CyclicGroupAnalyzer
+        """
+        logging.debug("--------------------start detecting line group")
+        self._cyclic = CyclicGroupAnalyzer(
+            atom, tolerance=cyclic_tolerance, exact_screw=exact_screw
+        )
+        self.primitive = self._cyclic._primitive
+
+        mol = Molecule(
+            species=self.primitive.numbers, coords=self.primitive.positions
+        )
+        self._point_group = LineGroupAnalyzer(mol, tolerance=tolerance)
+        self._origin = mol.center_of_mass
+
+        self.generalized_translation = self._cyclic.cyclic_group
+        self.translation_symbol, op_tran = self._select_translation()
+        self.axial_point_group = self._point_group.sch_symbol
+        self.generators = self._get_generators(op_tran)
+        self.family = self._get_family()
+        self.perms_table = self._get_perms_table(self.generators)
+
+    def _select_translation(self) -> [str, SymmOp]:
+        """pick the first generalized translational group that holds for the whole primitive cell
+
+        CyclicGroupAnalyzer only checks how the monomer is moved, so its
+        generator is checked once more against all the sites.
+
+        Returns: symbol and generator of the generalized translational group
+
+        """
+        for ii, symbol in enumerate(self.generalized_translation):
+            if symbol == "T":
+                op = SymmOp.from_rotation_and_translation(
+                    np.eye(3), [0, 0, self._cyclic._pure_trans]
+                )
+            else:
+                # the first non-identity operation of the cyclic group
+                op = self._cyclic._sym_operations[ii][1]
+            if self._map_sites(op) is not None:
+                return symbol, op
+            logging.debug("%s does not hold for the primitive cell" % symbol)
+        return "T", SymmOp.from_rotation_and_translation(
+            np.eye(3), [0, 0, self._cyclic._pure_trans]
+        )
+
+    def _map_sites(self, op: SymmOp) -> Union[np.ndarray, None]:
+        """find the site each site of the primitive cell is moved to
+
+        Args:
+            op: symmetry operation in the primitive cell frame
+
+        Returns: the permutation, None if a site is not moved onto a site
+                 of the same type or two sites are moved onto the same one
+
+        """
+        index = self._cyclic._index
+        coords = op.operate_multi(self.primitive.positions)
+        if not index.match(coords, self.primitive.numbers).all():
+            return None
+        idx = index.query(coords)
+        if np.unique(idx).size != len(idx):
+            return None
+        return idx
+
+    def _get_family(self) -> Union[int, None]:
+        """the line group family of the translation and the axial point group
+
+        A glide plane with D_n is the same group as T'C_nh (family 12) if
+        the glide plane contains a U axis, and as T'S_2n (family 10) if it
+        bisects two of them, which get_family_Num_from_sym_symbol can not
+        tell from the symbols alone.
+
+        Returns: family number, None if the pair can not be identified
+
+        """
+        trans_sym, rota_sym = self.translation_symbol, self.axial_point_group
+        if trans_sym.startswith("T'") and re.fullmatch(r"D\d+", rota_sym):
+            family = self._get_glide_dihedral_family(int(rota_sym[1:]))
+        else:
+            family = get_family_Num_from_sym_symbol(trans_sym, rota_sym)
+        if family is None:
+            logging.warning(
+                "The line group family of %s %s is unknown"
+                % (trans_sym, rota_sym)
+            )
+        return family
+
+    def _get_glide_dihedral_family(self, nrot: int) -> Union[int, None]:
+        """tell T'C_nh from T'S_2n by the angle between the glide plane and U
+
+        Args:
+            nrot: order of the principal rotation of D_n
+
+        Returns: 12 or 10, None if no U axis is among the generators
+
+        """
+        glide = self.generators[0].rotation_matrix
+        for op in self.generators[1:]:
+            rot = op.rotation_matrix
+            if not np.isclose(rot[2, 2], -1) or np.linalg.det(rot) < 0:
+                continue
+            # rotation in the xy plane left by the product of the two
+            prod = glide @ rot
+            angle = np.arctan2(prod[1, 0], prod[0, 0]) * nrot / (2 * np.pi)
+            if np.isclose(angle, np.round(angle), atol=1e-3):
+                return 12
+            if np.isclose(angle, np.round(angle * 2) / 2, atol=1e-3):
+                return 10
+        return None
+
+    def _get_generators(self, op_tran: SymmOp) -> list:
+        """collect the generators of both groups in the primitive cell frame
+
+        Args:
+            op_tran: generator of the generalized translational group
+
+        Returns: generator of the generalized translational group followed
+                 by the generators of the axial point group
+
+        """
+        # the point group operations act around the center of mass
+        shift = np.eye(4)
+        shift[:3, 3] = self._origin
+        ops_rot = [
+            SymmOp(shift @ op @ np.linalg.inv(shift))
+            for op in self._point_group.get_generators()
+        ]
+        return [op_tran] + ops_rot
+
+    def _get_perms_table(self, ops: list) -> np.ndarray:
+        """get the permutation table of the operations from the site index
+
+        Args:
+            ops: symmetry operations in the primitive cell frame
+
+        Returns: permutation table, perms_table[ii, jj] is the index of the
+                 site that the jj-th site is moved to by the ii-th operation
+
+        """
+        perms_table = [self._map_sites(op) for op in ops]
+        itp = [ii for ii, perm in enumerate(perms_table) if perm is None]
+        if len(itp) > 0:
+            raise ValueError(
+                "tolerance exceed while calculate perms: op %s" % itp
+            )
+        return np.array(perms_table, dtype=np.int32)
+
+    def get_line_group(self) -> [int, list, str]:
+        """Returns the family number, generalized translational group and axial point group."""
+        return self.family, self.translation_symbol, self.axial_point_group
+
+    def get_generators(self) -> [list, np.ndarray]:
+        """Returns the generators and their permutation tables."""
+        return self.generators, self.perms_table
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Try to detect the line group of a structure"
+    )
+    parser.add_argument(
+        "filename", help="path to the file from which coordinates will be read"
+    )
+    parser.add_argument(
+        "--tol",
+        help="tolerance of axial point group",
+        type=float,
+        default=1e-3,
+    )
+    parser.add_argument(
+        "--cyclic_tol",
+        help="tolerance of generalized translational group",
+        type=float,
+        default=1e-2,
+    )
+    args = parser.parse_args()
+
+    st = read(args.filename)
+    obj = LineGroupDetector(
+        st, tolerance=args.tol, cyclic_tolerance=args.cyclic_tol
+    )
+
+    print("family=", obj.family)
+    print("generalized translation:", obj.translation_symbol)
+    print("axial point group:", obj.axial_point_group)
+
+
+if __name__ == "__main__":
+    main()
@@ -26,7 +26,9 @@ from pymatgen.core import Molecule
 from pymatgen.core.operations import SymmOp
 from pymatgen.symmetry.analyzer import PointGroupAnalyzer
 
+from pulgon_tools_wip.axial_point_group import screen_rot_orders
 from pulgon_tools_wip.utils import (
+    PeriodicSiteIndex,
     brute_force_generate_group,
     find_axis_center_of_nanotube,
 )
@@ -72,6 +74,10 @@ class LineGroupAnalyzer(PointGroupAnalyzer):
         self.tol = tolerance
         self.mat_tol = tolerance
         self._zaxis = np.array([0, 0, 1])
+        self._coords = self.centered_mol.cart_coords
+        self._index = PeriodicSiteIndex(
+            self._coords, self.centered_mol.atomic_numbers, symprec=self.tol
+        )
 
         self._analyze()
         # if self.sch_symbol in ["C1v", "C1h"]:
@@ -112,6 +118,52 @@ class LineGroupAnalyzer(PointGroupAnalyzer):
             )
             self._proc_no_rot_sym()
 
+    def is_valid_op(self, symmop: SymmOp) -> bool:
+        """Rewrite the is_valid_op method, look up all the operated sites in the site index at once.
+
+        Args:
+            symmop (SymmOp): Symmetry operation to test.
+
+        Returns:
+            (bool): Whether SymmOp is valid for Molecule.
+        """
+        operated = symmop.operate_multi(self._coords)
+        # most candidates already fail on the first site, reject them cheaply
+        ind = np.where(
+            np.all(np.abs(self._coords - operated[0]) < self.tol, axis=1)
+        )[0]
+        if (
+            len(ind) != 1
+            or self._index.numbers[ind[0]] != self._index.numbers[0]
+        ):
+            return False
+        return bool(self._index.match(operated, self._index.numbers).all())
+
+    def _check_rot_sym(self, axis: np.ndarray) -> int:
+        """Rewrite the _check_rot_sym method, screen the rotational orders about z before testing them.
+
+        Args:
+            axis: rotational axis
+
+        Returns: the rotational order n of Cn about the axis
+        """
+        if not np.allclose(np.cross(axis, self._zaxis), 0):
+            return super()._check_rot_sym(axis)
+
+        candidates = self._screen_rot_orders()
+        logging.debug("Candidate rotational orders: %s" % candidates)
+        for idx in candidates:
+            op = SymmOp.from_axis_angle_and_translation(axis, 360 / idx)
+            if self.is_valid_op(op):
+                self.symmops.append(op)
+                self.rot_sym.append((axis, idx))
+                return idx
+        return 1
+
+    def _screen_rot_orders(self) -> list:
+        """find the rotational orders about z allowed by the angular fingerprints (see screen_rot_orders)"""
+        return screen_rot_orders(self._coords, self._index.numbers, self.tol)
+
     def _inertia_tensor(self) -> np.ndarray:
         """
 
@@ -0,0 +1,446 @@
+# Copyright 2023 The PULGON Project Developers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied. See the License for the specific language governing
+# permissions and limitations under the License.
+
+import itertools
+import math
+from fractions import Fraction
+from typing import Union
+
+import numpy as np
+
+# An element (rot, sigma_v, sigma_h, tran) maps r to
+#     Rz(2 pi rot / n_rot) Sv^sigma_v Sh^sigma_h r + (0, 0, tran / n_tran)
+# where Sv: y -> -y, Sh: z -> -z and the translation is in units of the
+# period, n_rot and n_tran are shared by all the elements of a group.
+ELEMENT_DTYPE = np.dtype(
+    [
+        ("rot", np.int64),
+        ("sigma_v", np.int8),
+        ("sigma_h", np.int8),
+        ("tran", np.int64),
+    ]
+)
+
+
+def _common_denominator(
+    values: np.ndarray, symec: float, max_den: int
+) -> [np.ndarray, int]:
+    """write the values as integer multiples of 1 / den
+
+    Args:
+        values: the values
+        symec: tolerance of each value
+        max_den: largest denominator of a single value
+
+    Returns: the numerators and den
+
+    """
+    den = 1
+    for value in values:
+        frac = Fraction(float(value)).limit_denominator(max_den)
+        if abs(frac - value) > symec:
+            raise ValueError("%s is not a rational number" % value)
+        den = np.lcm(den, frac.denominator)
+    return np.round(np.asarray(values) * den).astype(np.int64), int(den)
+
+
+def _distance_mod1(val1: np.ndarray, val2: np.ndarray) -> float:
+    diff = np.remainder(val1 - val2, 1)
+    return np.minimum(diff, 1 - diff).max(initial=0)
+
+
+def affine_to_elements(
+    ops: np.ndarray,
+    n_rot: Union[int, None] = None,
+    n_tran: Union[int, None] = None,
+    symec: float = 1e-6,
+    max_den: int = 10000,
+) -> [np.ndarray, int, int]:
+    """convert affine matrices about the z axis into exact elements
+
+    Args:
+        ops: affine matrices, the translation is in units of the period
+        n_rot: rotations are multiples of 2 pi / n_rot, from ops if None
+        n_tran: translations are multiples of 1 / n_tran, from ops if None
+        symec: tolerance
+        max_den: largest order of a single rotation or translation
+
+    Returns: the elements (ELEMENT_DTYPE), n_rot and n_tran
+
+    """
+    ops = np.asarray(ops, dtype=np.float64).reshape(-1, 4, 4)
+    rot = ops[:, :3, :3]
+    if (
+        np.abs(rot[:, 2, :2]).max(initial=0) > symec
+        or np.abs(rot[:, :2, 2]).max(initial=0) > symec
+        or np.abs(ops[:, :2, 3]).max(initial=0) > symec
+        or (np.abs(np.abs(rot[:, 2, 2]) - 1) > symec).any()
+    ):
+        raise ValueError("the operations do not keep the z axis")
+
+    sigma_h = rot[:, 2, 2] < 0
+    sigma_v = np.linalg.det(rot[:, :2, :2]) < 0
+    # remove Sv from the in-plane part, leaving the rotation Rz
+    in_plane = rot[:, :2, :2].copy()
+    in_plane[sigma_v, :, 1] *= -1
+    angle = np.remainder(
+        np.arctan2(in_plane[:, 1, 0], in_plane[:, 0, 0]) / (2 * np.pi), 1
+    )
+    tran = np.remainder(ops[:, 2, 3], 1)
+
+    if n_rot is None:
+        _, n_rot = _common_denominator(angle, symec, max_den)
+    if n_tran is None:
+        _, n_tran = _common_denominator(tran, symec, max_den)
+
+    res = np.empty(len(ops), dtype=ELEMENT_DTYPE)
+    res["rot"] = np.remainder(np.round(angle * n_rot), n_rot)
+    res["sigma_v"] = sigma_v
+    res["sigma_h"] = sigma_h
+    res["tran"] = np.remainder(np.round(tran * n_tran), n_tran)
+    if (
+        _distance_mod1(res["rot"] / n_rot, angle) > symec
+        or _distance_mod1(res["tran"] / n_tran, tran) > symec
+    ):
+        raise ValueError("the operations are not on the given grid")
+    return res, n_rot, n_tran
+
+
+def elements_to_affine(
+    elements: np.ndarray, n_rot: int, n_tran: int
+) -> np.ndarray:
+    """convert exact elements back into affine matrices
+
+    Args:
+        elements: the elements (ELEMENT_DTYPE)
+        n_rot: rotational grid of the elements
+        n_tran: translational grid of the elements
+
+    Returns: affine matrices, shape elements.shape + (4, 4)
+
+    """
+    elements = np.asarray(elements)
+    angle = 2 * np.pi * elements["rot"] / n_rot
+    sv = 1 - 2 * elements["sigma_v"].astype(np.int64)
+    sh = 1 - 2 * elements["sigma_h"].astype(np.int64)
+
+    res = np.zeros(elements.shape + (4, 4))
+    res[..., 0, 0] = np.cos(angle)
+    res[..., 0, 1] = -np.sin(angle) * sv
+    res[..., 1, 0] = np.sin(angle)
+    res[..., 1, 1] = np.cos(angle) * sv
+    res[..., 2, 2] = sh
+    res[..., 2, 3] = elements["tran"] / n_tran
+    res[..., 3, 3] = 1
+    return res
+
+
+def multiply_elements(
+    el1: np.ndarray, el2: np.ndarray, n_rot: int, n_tran: int
+) -> np.ndarray:
+    """exact group multiplication, el1 acts first (see affine_matrix_op)
+
+    Args:
+        el1: elements (ELEMENT_DTYPE), broadcast against el2
+        el2: elements (ELEMENT_DTYPE)
+        n_rot: rotational grid of the elements
+        n_tran: translational grid of the elements
+
+    Returns: the products
+
+    """
+    el1, el2 = np.broadcast_arrays(np.asarray(el1), np.asarray(el2))
+    # Sv Rz(a) = Rz(-a) Sv, Sh commutes with Rz and Sv and flips z
+    sign_v = 1 - 2 * el2["sigma_v"].astype(np.int64)
+    sign_h = 1 - 2 * el2["sigma_h"].astype(np.int64)
+    res = np.empty(el1.shape, dtype=ELEMENT_DTYPE)
+    res["rot"] = np.remainder(el2["rot"] + sign_v * el1["rot"], n_rot)
+    res["sigma_v"] = el1["sigma_v"] ^ el2["sigma_v"]
+    res["sigma_h"] = el1["sigma_h"] ^ el2["sigma_h"]
+    res["tran"] = np.remainder(el2["tran"] + sign_h * el1["tran"], n_tran)
+    return res
+
+
+def inverse_elements(
+    elements: np.ndarray, n_rot: int, n_tran: int
+) -> np.ndarray:
+    """exact inverse of the elements
+
+    Args:
+        elements: the elements (ELEMENT_DTYPE)
+        n_rot: rotational grid of the elements
+        n_tran: translational grid of the elements
+
+    Returns: the inverses
+
+    """
+    elements = np.asarray(elements)
+    sign_v = 1 - 2 * elements["sigma_v"].astype(np.int64)
+    sign_h = 1 - 2 * elements["sigma_h"].astype(np.int64)
+    res = elements.copy()
+    res["rot"] = np.remainder(-sign_v * elements["rot"], n_rot)
+    res["tran"] = np.remainder(-sign_h * elements["tran"], n_tran)
+    return res
+
+
+def encode_elements(elements: np.ndarray, n_tran: int) -> np.ndarray:
+    """a unique integer for every element on the grid"""
+    elements = np.asarray(elements)
+    return (
+        (elements["rot"] * 2 + elements["sigma_v"]) * 2 + elements["sigma_h"]
+    ) * n_tran + elements["tran"]
+
+
+class CayleyTable:
+    """The multiplication table of a finite set of exact line group elements
+
+    The translations are taken modulo the period like in affine_matrix_op,
+    so the elements form a finite group. table[ii, jj] is the index of the
+    product of the ii-th and the jj-th element, the ii-th acting first.
+    """
+
+    def __init__(self, elements: np.ndarray, n_rot: int, n_tran: int) -> None:
+        """
+
+        Args:
+            elements: all the group elements (ELEMENT_DTYPE)
+            n_rot: rotational grid of the elements
+            n_tran: translational grid of the elements
+        """
+        self.elements = np.asarray(elements, dtype=ELEMENT_DTYPE)
+        self.n_rot = n_rot
+        self.n_tran = n_tran
+
+        codes = encode_elements(self.elements, n_tran)
+        self._order = np.argsort(codes, kind="stable")
+        self._codes = codes[self._order]
+        if (np.diff(self._codes) == 0).any():
+            raise ValueError("the elements are not distinct")
+
+        self.table = self.index(
+            multiply_elements(
+                self.elements[:, None], self.elements[None, :], n_rot, n_tran
+            )
+        )
+        if (self.table < 0).any():
+            raise ValueError(
+                "the elements are not closed under multiplication"
+            )
+        self.inverse = self.index(
+            inverse_elements(self.elements, n_rot, n_tran)
+        )
+        self.identity = int(self.index(np.zeros(1, dtype=ELEMENT_DTYPE))[0])
+
+    @classmethod
+    def from_affine(
+        cls,
+        ops: np.ndarray,
+        n_rot: Union[int, None] = None,
+        n_tran: Union[int, None] = None,
+        symec: float = 1e-6,
+    ) -> "CayleyTable":
+        """build the table from affine matrices (see affine_to_elements)"""
+        elements, n_rot, n_tran = affine_to_elements(ops, n_rot, n_tran, symec)
+        return cls(elements, n_rot, n_tran)
+
+    def __len__(self) -> int:
+        return len(self.elements)
+
+    def index(self, elements: np.ndarray) -> np.ndarray:
+        """look up the indices of elements, -1 for the ones outside the group"""
+        codes = encode_elements(elements, self.n_tran)
+        pos = np.searchsorted(self._codes, codes)
+        pos = np.minimum(pos, len(self._codes) - 1)
+        return np.where(self._codes[pos] == codes, self._order[pos], -1)
+
+    def get_affine(self) -> np.ndarray:
+        """the elements as affine matrices"""
+        return elements_to_affine(self.elements, self.n_rot, self.n_tran)
+
+    def conjugate(
+        self, g: Union[int, np.ndarray], h: Union[int, np.ndarray]
+    ) -> Union[int, np.ndarray]:
+        """index of h g h^-1"""
+        return self.table[self.table[self.inverse[h], g], h]
+
+    def conjugacy_classes(self) -> list:
+        """the conjugacy classes as sorted arrays of element indices"""
+        idx = np.arange(len(self))
+        conj = self.conjugate(idx[None, :], idx[:, None])
+        # every element is labelled by the smallest index of its class
+        label = conj.min(axis=0)
+        reps = sorted(
+            np.unique(label),
+            key=lambda rep: (rep != label[self.identity], rep),
+        )
+        return [np.where(label == rep)[0] for rep in reps]
+
+
+# screw^t rot^s mirror^j U^k of every family, the factors are
+#     "Q": (C_Q|f), "T": pure translation (I|a), "2n": (C_2n|a/2),
+#     "c": glide plane (sigma_v|a/2), "C": C_n, "S": S_2n (see S2n),
+#     "v": sigma_v, "h": sigma_h, "U": U, None: absent
+FAMILY_FACTORS = {
+    1: ("Q", "C", None, None),
+    2: ("T", "S", None, None),
+    3: ("T", "C", "h", None),
+    4: ("2n", "C", "h", None),
+    5: ("Q", "C", None, "U"),
+    6: ("T", "C", "v", None),
+    7: ("c", "C", None, None),
+    8: ("2n", "C", "v", None),
+    9: ("T", "S", "v", None),
+    10: ("c", "S", None, None),
+    11: ("T", "C", "v", "U"),
+    12: ("c", "C", "h", None),
+    13: ("2n", "C", "v", "U"),
+}
+
+
+def _element(rot=0, sigma_v=0, sigma_h=0, tran=0) -> np.ndarray:
+    res = np.zeros((), dtype=ELEMENT_DTYPE)
+    res["rot"], res["sigma_v"], res["sigma_h"], res["tran"] = (
+        rot,
+        sigma_v,
+        sigma_h,
+        tran,
+    )
+    return res
+
+
+def _powers(
+    element: np.ndarray, num: int, n_rot: int, n_tran: int
+) -> np.ndarray:
+    """element^0, element^1, ..., element^(num - 1)"""
+    res = np.zeros(num, dtype=ELEMENT_DTYPE)
+    for ii in range(1, num):
+        res[ii] = multiply_elements(res[ii - 1], element, n_rot, n_tran)
+    return res
+
+
+class LineGroupElements:
+    """All the elements of a line group modulo its period, in closed form
+
+    Every element is written as screw^t rot^s mirror^j U^k with the
+    factors of FAMILY_FACTORS, the rightmost factor acting first. The
+    exponents run over t < the number of screw steps per period,
+    s < the order of rot, j < 2 and k < 2, so the elements are emitted
+    directly without any closure search.
+    """
+
+    def __init__(
+        self,
+        family: int,
+        n: int,
+        Q: Union[int, float, Fraction] = 1,
+        f: float = 1.0,
+        max_den: int = 10000,
+    ) -> None:
+        """
+
+        Args:
+            family: line group family, as in get_family_Num_from_sym_symbol
+            n: order of the principal rotation C_n of the axial point group
+            Q: the screw axis (C_Q|f) rotates by 2 pi / Q, families 1 and 5
+            f: translation of the screw axis, or the half period of the
+                families with (C_2n|a/2) and (sigma_v|a/2), or the period
+            max_den: largest denominator of Q
+        """
+        if family not in FAMILY_FACTORS:
+            raise ValueError("Unknown line group family %s" % family)
+        self.family, self.n = family, n
+        screw, rot, mirror, u = FAMILY_FACTORS[family]
+
+        if screw == "Q":
+            self.Q = Fraction(Q).limit_denominator(max_den)
+            q, r = self.Q.numerator, self.Q.denominator
+            # (C_Q|f)^t is a pure translation times an element of C_n
+            n_t = q // math.gcd(q, n * r)
+            self.n_rot, self.n_tran = math.lcm(q, n), n_t
+            self.a = n_t * f
+        elif screw == "T":
+            n_t = 1
+            self.n_rot, self.n_tran = n, 1
+            self.a = f
+        else:
+            n_t = 2
+            self.n_rot = 2 * n if screw == "2n" else n
+            self.n_tran = 2
+            self.a = 2 * f
+        if rot == "S":
+            self.n_rot = math.lcm(self.n_rot, 2 * n)
+
+        n_rot, n_tran = self.n_rot, self.n_tran
+        if screw == "Q":
+            gen_screw = _element(rot=n_rot // q * r, tran=1)
+        elif screw == "2n":
+            gen_screw = _element(rot=n_rot // (2 * n), tran=1)
+        elif screw == "c":
+            gen_screw = _element(sigma_v=1, tran=1)
+        else:
+            gen_screw = _element()
+        if rot == "S":
+            gen_rot = _element(rot=n_rot - n_rot // (2 * n), sigma_h=1)
+            n_s = 2 * n
+        else:
+            gen_rot = _element(rot=n_rot // n)
+            n_s = n
+        gen_mirror = _element(sigma_v=mirror == "v", sigma_h=mirror == "h")
+        gen_u = _element(sigma_v=1, sigma_h=1)
+
+        self.exponents = np.array(
+            list(
+                itertools.product(
+                    range(n_t),
+                    range(n_s),
+                    range(2 if mirror else 1),
+                    range(2 if u else 1),
+                )
+            ),
+            dtype=np.int64,
+        )
+        t, s, j, k = self.exponents.T
+        res = multiply_elements(
+            _powers(gen_u, 2, n_rot, n_tran)[k],
+            _powers(gen_mirror, 2, n_rot, n_tran)[j],
+            n_rot,
+            n_tran,
+        )
+        res = multiply_elements(
+            res, _powers(gen_rot, n_s, n_rot, n_tran)[s], n_rot, n_tran
+        )
+        self.elements = multiply_elements(
+            res, _powers(gen_screw, n_t, n_rot, n_tran)[t], n_rot, n_tran
+        )
+
+    def __len__(self) -> int:
+        return len(self.elements)
+
+    def get_affine(self, cartesian: bool = False) -> np.ndarray:
+        """the elements as affine matrices
+
+        Args:
+            cartesian: translations in Angstrom instead of units of the period
+
+        Returns: affine matrices
+
+        """
+        res = elements_to_affine(self.elements, self.n_rot, self.n_tran)
+        if cartesian:
+            res[:, 2, 3] *= self.a
+        return res
+
+    def get_cayley_table(self) -> CayleyTable:
+        """the multiplication table of the elements, in the same order"""
+        return CayleyTable(self.elements, self.n_rot, self.n_tran)
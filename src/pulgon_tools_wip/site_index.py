@@ -0,0 +1,248 @@
+# Copyright 2023 The PULGON Project Developers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied. See the License for the specific language governing
+# permissions and limitations under the License.
+
+import itertools
+from typing import Union
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+
+class PeriodicSiteIndex:
+    """A KD-tree over atomic sites for bulk site matching
+
+    Two coordinates coincide when every component differs by less than
+    symprec, the same criterion as pymatgen's find_in_coord_list, or when
+    their distance in the p-norm is less than symprec for another p. Each
+    dimension with a nonzero entry in boxsize is treated as periodic.
+    """
+
+    def __init__(
+        self,
+        coords: np.ndarray,
+        numbers: np.ndarray,
+        boxsize: Union[list, np.ndarray] = (0, 0, 0),
+        symprec: float = 1e-3,
+        p: float = np.inf,
+    ) -> None:
+        """
+
+        Args:
+            coords: (n, 3) coordinates of the sites
+            numbers: atomic numbers of the sites
+            boxsize: period of each dimension, 0 for non-periodic dimensions
+            symprec: tolerance of each coordinate component
+            p: Minkowski p-norm of the distance, 2 for the Euclidean one
+        """
+        self.boxsize = np.asarray(boxsize, dtype=np.float64)
+        self.numbers = np.asarray(numbers)
+        self.symprec = symprec
+        self.p = p
+        self._tree = cKDTree(
+            self._wrap(np.asarray(coords, dtype=np.float64)),
+            boxsize=self.boxsize,
+        )
+
+    def _wrap(self, coords: np.ndarray) -> np.ndarray:
+        coords = coords.copy()
+        for ii in np.where(self.boxsize > 0)[0]:
+            coords[:, ii] = np.remainder(coords[:, ii], self.boxsize[ii])
+            coords[coords[:, ii] >= self.boxsize[ii], ii] = 0
+        return coords
+
+    def __len__(self) -> int:
+        return len(self.numbers)
+
+    def query(self, coords: np.ndarray) -> np.ndarray:
+        """find the unique site matching each coordinate
+
+        Args:
+            coords: (..., 3) coordinates to look up
+
+        Returns: index of the matched site for each coordinate,
+                 -1 if there is no match or the match is not unique
+
+        """
+        coords = np.asarray(coords, dtype=np.float64)
+        shape = coords.shape[:-1]
+        dist, idx = self._tree.query(
+            self._wrap(coords.reshape(-1, 3)),
+            k=2,
+            p=self.p,
+            distance_upper_bound=self.symprec,
+        )
+        unique = np.isfinite(dist[:, 0]) & ~np.isfinite(dist[:, 1])
+        res = np.where(unique, idx[:, 0], -1)
+        return res.reshape(shape)
+
+    def count(self, coords: np.ndarray) -> np.ndarray:
+        """count the sites matching each coordinate
+
+        Args:
+            coords: (..., 3) coordinates to look up
+
+        Returns: number of sites within symprec of each coordinate
+
+        """
+        coords = np.asarray(coords, dtype=np.float64)
+        shape = coords.shape[:-1]
+        # query_ball_point includes the sites right at symprec
+        res = self._tree.query_ball_point(
+            self._wrap(coords.reshape(-1, 3)),
+            r=np.nextafter(self.symprec, 0),
+            p=self.p,
+            return_length=True,
+        )
+        return np.asarray(res).reshape(shape)
+
+    def match(self, coords: np.ndarray, numbers: np.ndarray) -> np.ndarray:
+        """check whether each coordinate hits a unique site of the same type
+
+        Args:
+            coords: (..., m, 3) coordinates to look up
+            numbers: (m,) atomic numbers of the coordinates
+
+        Returns: boolean array with shape (..., m)
+
+        """
+        idx = self.query(coords)
+        return (idx >= 0) & (self.numbers[idx] == numbers)
+
+
+class QuantizedSiteSet:
+    """A hash set of sites keyed by quantized scale positions
+
+    Scale positions are wrapped into [0, 1) and rounded onto a grid with
+    spacing step. The sites of the same type in the same or a neighbouring
+    grid cell are the candidates of a lookup, so rounding noise at the cell
+    borders does not break it, and a candidate matches if every component
+    of the periodic difference is less than tolerance.
+    """
+
+    _offsets = np.array(list(itertools.product([0, -1, 1], repeat=3)))
+
+    def __init__(
+        self,
+        scale_pos: np.ndarray,
+        numbers: np.ndarray,
+        step: float = 1e-4,
+        tolerance: Union[float, None] = None,
+    ) -> None:
+        """
+
+        Args:
+            scale_pos: (n, 3) scale positions of the structure
+            numbers: atom_type
+            step: grid spacing of the quantization
+            tolerance: tolerance of each component, step by default, it
+                can not be larger than step
+        """
+        self.step = step
+        self.tolerance = step if tolerance is None else tolerance
+        if self.tolerance > step:
+            raise ValueError("The tolerance can not be larger than the step")
+        self._nbins = np.ceil(1 / step - 1e-8).astype(np.int64)
+        self._scale_pos = np.remainder(scale_pos, 1)
+        keys = self._to_void(self._quantize(scale_pos, numbers))
+        self._order = np.argsort(keys, kind="stable")
+        self._keys = keys[self._order]
+        # the sites sharing a grid cell are adjacent in self._keys
+        self._max_run = (
+            np.unique(self._keys, return_counts=True)[1].max()
+            if len(keys) > 0
+            else 0
+        )
+
+    def __len__(self) -> int:
+        return len(self._order)
+
+    def _quantize(self, scale_pos: np.ndarray, numbers: np.ndarray):
+        grid = np.round(np.remainder(scale_pos, 1) / self.step)
+        grid = np.remainder(grid.astype(np.int64), self._nbins)
+        return np.hstack((np.asarray(numbers)[:, np.newaxis], grid))
+
+    @staticmethod
+    def _to_void(keys: np.ndarray) -> np.ndarray:
+        keys = np.ascontiguousarray(keys, dtype=np.int64)
+        return keys.view(
+            np.dtype((np.void, keys.dtype.itemsize * keys.shape[-1]))
+        ).reshape(keys.shape[:-1])
+
+    def query(self, scale_pos: np.ndarray, numbers: np.ndarray) -> np.ndarray:
+        """find the unique site of the same type matching each position
+
+        Args:
+            scale_pos: (m, 3) scale positions to look up
+            numbers: atom_type
+
+        Returns: index of the matched site for each position,
+                 -1 if there is no match or the match is not unique
+
+        """
+        scale_pos = np.asarray(scale_pos, dtype=np.float64)
+        keys = self._quantize(scale_pos, numbers)
+        candidates = np.repeat(keys[:, np.newaxis], len(self._offsets), axis=1)
+        candidates[..., 1:] = np.remainder(
+            candidates[..., 1:] + self._offsets, self._nbins
+        )
+        candidates = self._to_void(candidates)
+        start = np.searchsorted(self._keys, candidates)
+
+        sites = np.full(start.shape + (self._max_run,), -1, dtype=np.int64)
+        for ii in range(self._max_run):
+            pos = np.minimum(start + ii, len(self._keys) - 1)
+            hit = (start + ii < len(self._keys)) & (
+                self._keys[pos] == candidates
+            )
+            diff = scale_pos[:, np.newaxis] - self._scale_pos[self._order[pos]]
+            diff -= np.round(diff)
+            hit &= (np.abs(diff) < self.tolerance).all(axis=-1)
+            sites[..., ii] = np.where(hit, self._order[pos], -1)
+
+        # neighbouring offsets may wrap onto the same cell for coarse grids
+        sites = sites.reshape(len(scale_pos), -1)
+        first = sites.max(axis=1)
+        unique = (first >= 0) & ((sites == first[:, None]) | (sites < 0)).all(
+            axis=1
+        )
+        return np.where(unique, first, -1)
+
+    def contains(
+        self, scale_pos: np.ndarray, numbers: np.ndarray, chunk: int = 256
+    ) -> bool:
+        """check whether the given sites are mapped one to one onto the set
+
+        Args:
+            scale_pos: (m, 3) scale positions to look up
+            numbers: atom_type
+            chunk: number of sites tested at once, the test stops at the
+                   first chunk with a missing or repeated site
+
+        Returns: True if every site is found and no two sites of the input
+                 match the same site of the set
+
+        """
+        numbers = np.asarray(numbers)
+        used = np.zeros(len(self), dtype=bool)
+        for start in range(0, len(scale_pos), chunk):
+            idx = self.query(
+                scale_pos[start : start + chunk],
+                numbers[start : start + chunk],
+            )
+            if (idx < 0).any() or used[idx].any():
+                return False
+            if np.unique(idx).size != len(idx):
+                return False
+            used[idx] = True
+        return True
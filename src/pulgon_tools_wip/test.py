@@ -29,6 +29,7 @@ from sympy.printing.octave import print_octave_code
 from pulgon_tools_wip.detect_generalized_translational_group import (
     CyclicGroupAnalyzer,
 )
+from pulgon_tools_wip.detect_line_group import LineGroupDetector
 from pulgon_tools_wip.detect_point_group import LineGroupAnalyzer
 from pulgon_tools_wip.generate_structures import (
     Cn,
@@ -45,24 +46,19 @@ from pulgon_tools_wip.utils import get_symbols_from_ops
 
 
 def lingroupfamily(poscar):
-    cyclic = CyclicGroupAnalyzer(poscar, tolerance=1e-2)
-    trans_sym = cyclic.cyclic_group[0]
-    obj = LineGroupAnalyzer(poscar)
-    rota_sym = obj.sch_symbol
+    obj = LineGroupDetector(poscar, tolerance=1e-2)
+    family, trans_sym, rota_sym = obj.get_line_group()
 
     print(trans_sym)
     print(rota_sym)
-
-    family = get_family_Num_from_sym_symbol(trans_sym, rota_sym)
     print("family:", family)
 
 
 def symop_symbol(poscar):
-    cyclic = CyclicGroupAnalyzer(poscar, tolerance=1e-2)
-    obj = LineGroupAnalyzer(poscar)
+    obj = LineGroupDetector(poscar, tolerance=1e-2)
 
-    sch, _, op_trans = cyclic.get_cyclic_group_and_op()
-    op_rotas = obj.get_generators()
+    generators, perms_table = obj.get_generators()
+    op_rotas = [op.affine_matrix for op in generators[1:]]
 
     res = get_symbols_from_ops(op_rotas)
     print(res)
@@ -12,7 +12,13 @@
 # implied. See the License for the specific language governing
 # permissions and limitations under the License.
 
+import contextlib
 import copy
+import functools
+import itertools
+import multiprocessing
+import os
+from multiprocessing.pool import ThreadPool
 from typing import Union
 
 import ase
@@ -20,6 +26,7 @@ import cvxpy as cp
 import scipy as sp
 import scipy.interpolate
 import scipy.sparse as ss
+import scipy.sparse.linalg
 import scipy.spatial.distance
 from ase import Atoms
 from ipdb import set_trace
@@ -27,12 +34,18 @@ from ipdb import set_trace
 # from phonopy.units import VaspToTHz
 from pymatgen.core.operations import SymmOp
 from pymatgen.util.coord import find_in_coord_list
-from sympy.physics.quantum import TensorProduct
 
+from pulgon_tools_wip.group_elements import LineGroupElements
 from pulgon_tools_wip.Irreps_tables import *
 from pulgon_tools_wip.Irreps_tables_withparities import (
     line_group_sympy_withparities,
 )
+from pulgon_tools_wip.site_index import PeriodicSiteIndex, QuantizedSiteSet
+
+try:
+    from threadpoolctl import threadpool_limits
+except ImportError:  # optional, the BLAS threads are not limited without it
+    threadpool_limits = None
 
 
 def e() -> np.ndarray:
@@ -287,9 +300,55 @@ def atom_move_z(atom):
     return atoms
 
 
+def compose_perms(perms_gen: np.ndarray, words: list) -> np.ndarray:
+    """get the permutation table of products of generators by composing the permutations of the generators
+
+    Args:
+        perms_gen: permutation tables of the generators, perms_gen[ii, jj]
+            is the index of the site the jj-th site is moved to by the ii-th
+            generator
+        words: the multiplication order of the generators of every element,
+            1-based with 0 for the identity, the first generator acting
+            first (see brute_force_generate_group_subsquent)
+
+    Returns: permutation table of the elements
+    """
+    perms_gen = np.asarray(perms_gen)
+    known = {(): np.arange(perms_gen.shape[1])}
+    perms_table = np.empty((len(words), perms_gen.shape[1]), dtype=np.int32)
+    for ii, word in enumerate(words):
+        word = tuple(tmp for tmp in word if tmp != 0)
+        # the words of a closure share their prefixes, start from the
+        # longest one already composed
+        jj = len(word)
+        while word[:jj] not in known:
+            jj -= 1
+        perm = known[word[:jj]]
+        for kk in range(jj, len(word)):
+            perm = perms_gen[word[kk] - 1][perm]
+            known[word[: kk + 1]] = perm
+        perms_table[ii] = perm
+    return perms_table
+
+
+def _query_perms(index: PeriodicSiteIndex, operated: np.ndarray) -> np.ndarray:
+    """look up the sites the operated sites land on, raise if one is missing"""
+    perms = index.query(operated)
+    itp = np.argwhere(perms < 0)
+    if len(itp) > 0:
+        raise ValueError(
+            "tolerance exceed while calculate perms: (op, atom) %s"
+            % itp.tolist()
+        )
+    return perms
+
+
 def get_perms(atoms, cyclic_group_ops, point_group_ops, symprec=1e-2):
     """get the permutation table from symmetry operations
 
+    Only the operations of the two groups are matched against the sites,
+    the permutation of every combination is composed from them.
+
     Args:
         atoms:
         cyclic_group_ops:
@@ -299,41 +358,47 @@ def get_perms(atoms, cyclic_group_ops, point_group_ops, symprec=1e-2):
     Returns: permutation table
              rotation matrix (RM) = RM from point group @ RM from cyclic group
     """
-    combs = list(itertools.product(point_group_ops, cyclic_group_ops))
-    coords_car = atoms.positions
     coords_scaled = atoms.get_scaled_positions()
-    coords_car_center = (
-        atoms.get_scaled_positions() - [0.5, 0.5, 0.5]
-    ) @ atoms.cell
-
-    perms, rotation_matrix, translation_vector = [], [], []
-    for ii, op in enumerate(combs):
-        tmp_perm = np.ones((1, len(atoms.numbers)))[0]
-        op1, op2 = op
-        rotation_matrix.append(op1.rotation_matrix @ op2.rotation_matrix)
-        translation_vector.append(
-            op1.translation_vector + op2.translation_vector
-        )
+    coords_car_center = (coords_scaled - [0.5, 0.5, 0.5]) @ atoms.cell
 
-        for jj, site in enumerate(atoms):
-            pos = (site.scaled_position - [0.5, 0.5, 0.5]) @ atoms.cell
-
-            tmp = op1.operate(pos)
-            idx1 = find_in_coord_list(coords_car_center, tmp, symprec)
-
-            tmp1 = op2.operate(coords_car[idx1.item()])
-            tmp1 = np.remainder(tmp1 @ np.linalg.inv(atoms.cell), [1, 1, 1])
-            idx2 = find_in_coord_list(coords_scaled, tmp1, symprec)
+    # the point group acts around the cell center
+    index_center = PeriodicSiteIndex(
+        coords_car_center, atoms.numbers, symprec=symprec
+    )
+    perms_pg = _query_perms(
+        index_center,
+        np.array(
+            [op.operate_multi(coords_car_center) for op in point_group_ops]
+        ),
+    )
+    # the cyclic group acts on the positions, compared in scaled coordinates
+    index_scaled = PeriodicSiteIndex(
+        coords_scaled, atoms.numbers, boxsize=[1, 1, 1], symprec=symprec
+    )
+    invcell = np.linalg.inv(atoms.cell)
+    perms_cy = _query_perms(
+        index_scaled,
+        np.array(
+            [
+                op.operate_multi(atoms.positions) @ invcell
+                for op in cyclic_group_ops
+            ]
+        ),
+    )
 
-            if idx2.size == 0:
-                logging.ERROR("tolerance exceed while calculate perms")
-            tmp_perm[jj] = idx2
-        perms.append(tmp_perm)
+    # point group operation first, then the cyclic group operation
+    npg, ncy = len(perms_pg), len(perms_cy)
+    words = [[ii + 1, npg + jj + 1] for ii in range(npg) for jj in range(ncy)]
+    perms = compose_perms(np.concatenate((perms_pg, perms_cy)), words)
     perms_table, itp = np.unique(perms, axis=0, return_index=True)
     perms_table = perms_table.astype(np.int32)
 
-    rotation_matrix = np.array(rotation_matrix)[itp]
-    translation_vector = np.array(translation_vector)[itp]
+    rot_pg = np.array([op.rotation_matrix for op in point_group_ops])
+    rot_cy = np.array([op.rotation_matrix for op in cyclic_group_ops])
+    tran_pg = np.array([op.translation_vector for op in point_group_ops])
+    tran_cy = np.array([op.translation_vector for op in cyclic_group_ops])
+    rotation_matrix = (rot_pg[:, None] @ rot_cy[None]).reshape(-1, 3, 3)[itp]
+    translation_vector = (tran_pg[:, None] + tran_cy[None]).reshape(-1, 3)[itp]
     sym_operations = [
         SymmOp.from_rotation_and_translation(
             rotation_matrix[ii], translation_vector[ii]
@@ -343,14 +408,43 @@ def get_perms(atoms, cyclic_group_ops, point_group_ops, symprec=1e-2):
     return perms_table, sym_operations
 
 
+class PermutationError(ValueError):
+    """A symmetry operation does not permute the sites
+
+    Attributes:
+        report: one dict per failure with the keys "op" and "atom" (indices
+            of the operation and of the moved site) and "reason"
+    """
+
+    def __init__(self, report: list) -> None:
+        self.report = report
+        lines = [
+            "op %(op)d, atom %(atom)d: %(reason)s" % tmp for tmp in report[:10]
+        ]
+        if len(report) > 10:
+            lines.append("... %d failures in total" % len(report))
+        super().__init__(
+            "tolerance exceed while calculate perms\n" + "\n".join(lines)
+        )
+
+
 def get_perms_from_ops(atoms: Atoms, ops_sym, symprec=1e-2, round=4):
     """get the permutation table from symmetry operations
 
+    All the operations are applied to all the sites at once and looked up in
+    a KD-tree that is periodic along z, a site is matched when exactly one
+    site lies within symprec (Euclidean distance).
+
     Args:
         atoms:
+        ops_sym:
         symprec:
 
     Returns: permutation table
+
+    Raises:
+        PermutationError: if a site has no unique match or an operation does
+            not give a bijection
     """
     invcell = np.linalg.inv(atoms.cell)
     coords_center = atoms.positions - atoms.get_center_of_mass()
@@ -359,73 +453,648 @@ def get_perms_from_ops(atoms: Atoms, ops_sym, symprec=1e-2, round=4):
     coords_scaled_center[coords_center @ invcell <= -0.5] += 1
     coords_center = coords_scaled_center @ atoms.cell
 
-    perms = []
-    for ii, op in enumerate(ops_sym):
-        perms.append([])
-        operated = op.operate_multi(coords_center)
-        operated_scaled = operated @ invcell
-        # to me this seems much safer than the use of remainder - no floating point issues
-        operated_scaled[operated @ invcell >= 0.5] -= 1
-        operated_scaled[operated @ invcell <= -0.5] += 1
-        operated = operated_scaled @ atoms.cell
-        for aid in range(len(coords_center)):
-            equivalents = np.where(
-                np.linalg.norm(operated[aid] - coords_center, axis=1) < symprec
-            )[0]
-            if len(equivalents) == 1:
-                for eq in equivalents:
-                    perms[-1].append(eq)
-            else:
-                print(ii, aid)
-                set_trace()
-                raise ValueError
-                # set_trace()
-    perms_table = np.array(perms).astype(np.int32)
-    return perms_table
+    rotations = np.array([op.rotation_matrix for op in ops_sym])
+    translations = np.array([op.translation_vector for op in ops_sym])
+    operated = (
+        np.einsum("oij,nj->oni", rotations, coords_center)
+        + translations[:, None]
+    )
+    operated_scaled = operated @ invcell
+    # to me this seems much safer than the use of remainder - no floating point issues
+    operated_scaled[operated @ invcell >= 0.5] -= 1
+    operated_scaled[operated @ invcell <= -0.5] += 1
+    operated = operated_scaled @ atoms.cell
+
+    index = PeriodicSiteIndex(
+        coords_center,
+        atoms.numbers,
+        boxsize=[0, 0, atoms.cell[2, 2]],
+        symprec=symprec,
+        p=2,
+    )
+    perms_table = index.query(operated)
+
+    report = []
+    for ii, jj in np.argwhere(perms_table < 0):
+        num = index.count(operated[ii, jj])
+        reason = "no site" if num == 0 else "%d sites" % num
+        report.append(
+            {"op": ii, "atom": jj, "reason": reason + " within symprec"}
+        )
+    # every site is hit exactly once by a permutation
+    natoms = len(atoms.numbers)
+    for ii in np.where(perms_table.min(axis=1) >= 0)[0]:
+        hits = np.bincount(perms_table[ii], minlength=natoms)
+        for site in np.where(hits > 1)[0]:
+            for jj in np.where(perms_table[ii] == site)[0]:
+                report.append(
+                    {
+                        "op": ii,
+                        "atom": jj,
+                        "reason": "site %d is hit %d times"
+                        % (site, hits[site]),
+                    }
+                )
+    if len(report) > 0:
+        raise PermutationError(report)
+    return perms_table.astype(np.int32)
 
 
-def get_matrices(atoms, ops_sym, symprec=1e-5):
-    perms_table = get_perms_from_ops(atoms, ops_sym, symprec=symprec)
+class SymmetryRepresentation:
+    """The representation of symmetry operations on the atomic displacements
 
-    natoms = len(atoms.numbers)
-    matrices = []
-    for ii, perm in enumerate(perms_table):
-        matrix = np.zeros((3 * natoms, 3 * natoms))
-        for jj in range(natoms):
-            idx = perm[jj]
-            matrix[3 * idx : 3 * (idx + 1), 3 * jj : 3 * (jj + 1)] = ops_sym[
-                ii
-            ].rotation_matrix.copy()
-        matrices.append(matrix)
-    return matrices
+    Only the permutation table, the 3x3 rotations and the phase factors are
+    stored. The matrix of the ii-th operation has the block
+    phases[ii] * rotations[ii] at the rows of atom perms_table[ii, jj] and
+    the columns of atom jj, the same matrices as get_matrices builds.
+    """
+
+    def __init__(
+        self,
+        perms_table: np.ndarray,
+        rotations: np.ndarray,
+        phases: Union[np.ndarray, None] = None,
+    ) -> None:
+        """
+
+        Args:
+            perms_table: (nops, natoms) permutation table
+            rotations: (nops, 3, 3) rotation matrices
+            phases: (nops,) phase factors, 1 if None
+        """
+        self.perms_table = np.asarray(perms_table, dtype=np.int64)
+        self.rotations = np.asarray(rotations, dtype=np.float64)
+        self.phases = None if phases is None else np.asarray(phases)
+        # inv_perms[ii, perms_table[ii, jj]] = jj
+        self.inv_perms = np.argsort(self.perms_table, axis=1)
+
+    @classmethod
+    def from_ops(
+        cls,
+        atoms: Atoms,
+        ops_sym: list,
+        qpoint: Union[float, None] = None,
+        symprec: float = 1e-5,
+    ) -> "SymmetryRepresentation":
+        """build the representation of symmetry operations on a structure
+
+        Args:
+            atoms: the structure
+            ops_sym: symmetry operations
+            qpoint: wave vector along z, the phase factor of an operation is
+                exp(1j * qpoint * translation_z), no phases if None
+            symprec: passed to get_perms_from_ops
+
+        Returns: the representation
+        """
+        perms_table = get_perms_from_ops(atoms, ops_sym, symprec=symprec)
+        rotations = np.array([op.rotation_matrix for op in ops_sym])
+        phases = None
+        if qpoint is not None:
+            phases = get_phase_factors(ops_sym, [qpoint])[0]
+        return cls(perms_table, rotations, phases)
+
+    def with_phases(self, phases: np.ndarray) -> "SymmetryRepresentation":
+        """the same operations with other phase factors, the permutations and rotations are shared"""
+        res = copy.copy(self)
+        res.phases = np.asarray(phases)
+        return res
+
+    def adjoint(self) -> "SymmetryRepresentation":
+        """the representation of the conjugate transposed matrices
+
+        The transposed matrix moves atom perms_table[ii, jj] back to jj and
+        rotates it with the transposed rotation.
+        """
+        return SymmetryRepresentation(
+            self.inv_perms,
+            self.rotations.transpose(0, 2, 1),
+            None if self.phases is None else self.phases.conj(),
+        )
+
+    def __len__(self) -> int:
+        return len(self.perms_table)
+
+    @property
+    def natoms(self) -> int:
+        return self.perms_table.shape[1]
+
+    @property
+    def dtype(self):
+        return np.float64 if self.phases is None else np.complex128
+
+    def apply(self, vectors: np.ndarray) -> np.ndarray:
+        """act with every operation on displacement vectors
+
+        Args:
+            vectors: (3 * natoms,) or (3 * natoms, k) vectors
+
+        Returns: (nops,) + vectors.shape, the operated vectors
+        """
+        vectors = np.asarray(vectors)
+        blocks = vectors.reshape((self.natoms, 3) + vectors.shape[1:])
+        # the block of atom jj is rotated and moved to perms_table[ii, jj]
+        res = np.einsum("oab,nb...->ona...", self.rotations, blocks)
+        res = np.take_along_axis(
+            res,
+            self.inv_perms.reshape(
+                self.inv_perms.shape + (1,) * (res.ndim - 2)
+            ),
+            axis=1,
+        )
+        if self.phases is not None:
+            res = res * self.phases.reshape((-1,) + (1,) * (res.ndim - 1))
+        return res.reshape((len(self),) + vectors.shape)
+
+    def trace(self) -> np.ndarray:
+        """the characters, only the atoms kept in place contribute"""
+        fixed = (self.perms_table == np.arange(self.natoms)).sum(axis=1)
+        res = fixed * np.trace(self.rotations, axis1=1, axis2=2)
+        if self.phases is not None:
+            res = res * self.phases
+        return res
+
+    def to_sparse(self, ii: int) -> ss.csr_matrix:
+        """the matrix of the ii-th operation as a sparse matrix"""
+        rows = 3 * self.perms_table[ii][:, None, None] + np.arange(3)[:, None]
+        cols = 3 * np.arange(self.natoms)[:, None, None] + np.arange(3)
+        data = np.broadcast_to(self.rotations[ii], (self.natoms, 3, 3))
+        if self.phases is not None:
+            data = data * self.phases[ii]
+        shape = (3 * self.natoms, 3 * self.natoms)
+        return ss.csr_matrix(
+            (
+                data.ravel(),
+                (
+                    np.broadcast_to(rows, data.shape).ravel(),
+                    np.broadcast_to(cols, data.shape).ravel(),
+                ),
+            ),
+            shape=shape,
+        )
+
+    def to_dense(self, ii: int) -> np.ndarray:
+        """the matrix of the ii-th operation as a dense array"""
+        return self.to_sparse(ii).toarray()
+
+
+def get_phase_factors(ops_sym: list, qpoints: np.ndarray) -> np.ndarray:
+    """get the phase factors exp(1j * q * translation_z) of the operations
+
+    Args:
+        ops_sym: symmetry operations
+        qpoints: wave vectors along z
+
+    Returns: (nq, nops) phase factors
+    """
+    tran = np.array([op.translation_vector[2] for op in ops_sym])
+    return np.exp(1j * np.outer(np.atleast_1d(qpoints), tran))
+
+
+def get_representation_withPhases(
+    atoms: Atoms, ops_sym: list, qpoints: np.ndarray, symprec: float = 1e-5
+) -> [SymmetryRepresentation, np.ndarray]:
+    """get the representation of the operations for many q-points at once
+
+    The permutation table is computed only once. The matrices at the iq-th
+    q-point are those of rep.with_phases(phases[iq]), and the operated
+    vectors are rep.apply(vectors) times phases[iq] for each operation.
+
+    Args:
+        atoms: the structure
+        ops_sym: symmetry operations
+        qpoints: wave vectors along z
+        symprec: passed to get_perms_from_ops
+
+    Returns: the representation without phases and the (nq, nops) phases
+    """
+    rep = SymmetryRepresentation.from_ops(atoms, ops_sym, symprec=symprec)
+    return rep, get_phase_factors(ops_sym, qpoints)
+
+
+def irrep_multiplicities(
+    atoms: Atoms,
+    ops_sym: list,
+    characters: np.ndarray,
+    qpoints: Union[np.ndarray, None] = None,
+    symprec: float = 1e-5,
+    atol: float = 1e-4,
+) -> np.ndarray:
+    """count how many displacement modes belong to each irrep
+
+    Only the characters are used: the character of an operation is the
+    number of atoms it keeps in place times the trace of its rotation
+    (times its phase factor at a q-point), no matrix is built. The number
+    of modes of an irrep is its multiplicity times its dimension, the
+    character of the identity.
+
+    Args:
+        atoms: the structure
+        ops_sym: the operations of a finite group, including the identity
+        characters: (..., nops) characters of the irreps on the operations,
+            (nq, ..., nops) if qpoints is given
+        qpoints: wave vectors along z, no phase factors if None
+        symprec: passed to get_perms_from_ops
+        atol: tolerance of the multiplicities being integers
+
+    Returns: the numbers of modes, with shape characters.shape[:-1]
+
+    Raises:
+        ValueError: if there is no identity among ops_sym, or if a
+            multiplicity is not an integer, i.e. the characters do not
+            belong to the group of the operations
+    """
+    identity = [
+        ii
+        for ii, op in enumerate(ops_sym)
+        if np.allclose(op.affine_matrix, np.eye(4))
+    ]
+    if len(identity) == 0:
+        raise ValueError("The identity is not among the operations")
+    rep = SymmetryRepresentation.from_ops(atoms, ops_sym, symprec=symprec)
+    traces = rep.trace()
+    characters = np.asarray(characters)
+    if qpoints is not None:
+        traces = traces * get_phase_factors(ops_sym, qpoints)
+        traces = traces.reshape(
+            traces.shape[:1] + (1,) * (characters.ndim - 2) + traces.shape[1:]
+        )
+    res = (characters.conj() * traces).sum(axis=-1).real / len(ops_sym)
+    if not np.allclose(res, np.rint(res), atol=atol):
+        raise ValueError(
+            "The multiplicities %s are not integers" % np.round(res, 4)
+        )
+    dimensions = np.rint(characters[..., identity[0]].real)
+    return (np.rint(res) * dimensions).astype(np.int64)
+
+
+def get_matrices(atoms, ops_sym, symprec=1e-5):
+    rep = SymmetryRepresentation.from_ops(atoms, ops_sym, symprec=symprec)
+    return [rep.to_dense(ii) for ii in range(len(rep))]
 
 
 def get_matrices_withPhase(atoms, ops_sym, qpoint, symprec=1e-5):
-    perms_table = get_perms_from_ops(atoms, ops_sym, symprec=symprec)
+    rep = SymmetryRepresentation.from_ops(
+        atoms, ops_sym, qpoint=qpoint, symprec=symprec
+    )
+    return [rep.to_dense(ii) for ii in range(len(rep))]
+
+
+class KroneckerProjector:
+    """The sum of Kronecker products of irrep matrices and operation matrices
+
+    The operator sum_g weight * kron(D_g, M_g) (or kron(M_g, D_g) if
+    irrep_first is False) is never built, it is applied to vectors with the
+    permutation table and the rotations of a SymmetryRepresentation.
+    """
+
+    def __init__(
+        self,
+        rep: SymmetryRepresentation,
+        Dmats: list,
+        weight: float = 1.0,
+        irrep_first: bool = True,
+    ) -> None:
+        """
+
+        Args:
+            rep: the representation of the operations g
+            Dmats: the irrep matrices D_g in the order of the operations,
+                0-d arrays for one dimensional irreps
+            weight: the real common prefactor, e.g. 1 / |G|
+            irrep_first: True for kron(D_g, M_g), False for kron(M_g, D_g)
+        """
+        Dmats = np.array(Dmats, dtype=np.complex128)
+        if Dmats.ndim == 1:
+            Dmats = Dmats[:, np.newaxis, np.newaxis]
+        if len(Dmats) != len(rep):
+            raise ValueError(
+                "%d irrep matrices for %d operations" % (len(Dmats), len(rep))
+            )
+        self.rep = rep
+        self.Dmats = Dmats
+        self.weight = weight
+        self.irrep_first = irrep_first
+        self._adjoint = None
+
+    @property
+    def dim(self) -> int:
+        """the dimension of the irrep"""
+        return self.Dmats.shape[1]
+
+    @property
+    def size(self) -> int:
+        """the number of rows of the operator"""
+        return self.dim * 3 * self.rep.natoms
+
+    @property
+    def shape(self) -> tuple:
+        return (self.size, self.size)
+
+    @property
+    def dtype(self):
+        return np.complex128
+
+    def trace(self) -> complex:
+        """the trace, the number of modes in the range of a projector"""
+        chara = np.trace(self.Dmats, axis1=1, axis2=2)
+        return self.weight * (chara * self.rep.trace()).sum()
+
+    def apply(self, vectors: np.ndarray) -> np.ndarray:
+        """act on vectors
+
+        Args:
+            vectors: (size,) or (size, k) vectors
+
+        Returns: the operated vectors with the shape of the input
+        """
+        return self._apply(self.rep, self.Dmats, vectors)
+
+    def apply_adjoint(self, vectors: np.ndarray) -> np.ndarray:
+        """act with the conjugate transposed operator on vectors"""
+        if self._adjoint is None:
+            self._adjoint = (
+                self.rep.adjoint(),
+                self.Dmats.conj().transpose(0, 2, 1),
+            )
+        return self._apply(*self._adjoint, vectors)
+
+    # the interface of scipy.sparse.linalg.aslinearoperator
+    matvec = matmat = apply
+    rmatvec = rmatmat = apply_adjoint
+
+    def _apply(
+        self,
+        rep: SymmetryRepresentation,
+        Dmats: np.ndarray,
+        vectors: np.ndarray,
+    ) -> np.ndarray:
+        vectors = np.asarray(vectors)
+        block = vectors.reshape(self.size, -1)
+        d, n3 = self.dim, 3 * rep.natoms
+        if self.irrep_first:
+            # kron(D, M) vec: the rows are (irrep index, displacement)
+            block = block.reshape(d, n3, -1).transpose(1, 0, 2)
+        else:
+            block = block.reshape(n3, d, -1)
+        operated = rep.apply(block.reshape(n3, -1)).reshape(
+            (len(rep), n3, d, -1)
+        )
+        if self.irrep_first:
+            res = np.einsum("gab,gnbk->ank", Dmats, operated)
+        else:
+            res = np.einsum("gab,gnbk->nak", Dmats, operated)
+        return (self.weight * res).reshape(vectors.shape)
+
+
+def get_projector_range(
+    operator,
+    num_modes: int,
+    solver: str = "auto",
+    oversampling: int = 10,
+    n_iter: int = 1,
+    dense_limit: int = 64,
+    seed: int = 0,
+) -> [np.ndarray, float]:
+    """find the leading left singular vectors of a projector of known rank
+
+    Only num_modes + 1 singular values are needed for the error, so the
+    full SVD is kept for small matrices only.
+
+    Args:
+        operator: an array, a scipy LinearOperator or an object with shape,
+            matmat and rmatmat, e.g. a KroneckerProjector
+        num_modes: the rank of the projector
+        solver: "dense" for a full SVD, "randomized" for a randomized SVD
+            from a block of num_modes + oversampling random vectors,
+            "svds" for ARPACK, "auto" for "dense" if the smaller dimension
+            is at most dense_limit or twice the number of random vectors,
+            and "randomized" otherwise
+        oversampling: number of extra random vectors
+        n_iter: number of power iterations of the randomized SVD
+        dense_limit: largest dimension solved densely by "auto"
+        seed: seed of the random vectors, fixed for reproducible bases
+
+    Returns: (nrows, num_modes) orthonormal basis of the range and the
+             error 1 - (s[num_modes - 1] - s[num_modes]) / s[num_modes - 1]
+             of the singular values s
+    """
+    nrows, ncols = operator.shape
+    if num_modes <= 0:
+        return np.zeros((nrows, 0), dtype=np.complex128), 0.0
+    nvec = min(num_modes + oversampling, nrows, ncols)
+    if solver == "auto":
+        # the randomized SVD only pays off for a small fraction of the range
+        small = min(nrows, ncols) <= max(dense_limit, 2 * nvec)
+        solver = "dense" if small else "randomized"
+    if solver == "svds" and num_modes + 1 >= min(nrows, ncols):
+        solver = "dense"
+
+    if solver == "dense":
+        if isinstance(operator, np.ndarray):
+            matrix = operator
+        else:
+            matrix = scipy.sparse.linalg.aslinearoperator(operator).matmat(
+                np.eye(ncols)
+            )
+        u, s, _ = scipy.linalg.svd(matrix, full_matrices=False)
+    elif solver == "randomized":
+        operator = scipy.sparse.linalg.aslinearoperator(operator)
+        rng = np.random.default_rng(seed)
+        vectors = rng.standard_normal((ncols, nvec))
+        if np.iscomplexobj(np.empty(0, dtype=operator.dtype)):
+            vectors = vectors + 1j * rng.standard_normal((ncols, nvec))
+        basis = scipy.linalg.qr(operator.matmat(vectors), mode="economic")[0]
+        for _ in range(n_iter):
+            basis = scipy.linalg.qr(
+                operator.matmat(operator.rmatmat(basis)), mode="economic"
+            )[0]
+        # operator ~ basis @ basis^H @ operator, decompose the small factor
+        small = operator.rmatmat(basis).conj().T
+        u, s, _ = scipy.linalg.svd(small, full_matrices=False)
+        u = basis @ u
+    elif solver == "svds":
+        u, s, _ = scipy.sparse.linalg.svds(
+            scipy.sparse.linalg.aslinearoperator(operator),
+            k=num_modes + 1,
+            random_state=seed,
+        )
+        order = np.argsort(s)[::-1]
+        u, s = u[:, order], s[order]
+    else:
+        raise ValueError("unknown solver %s" % solver)
+
+    s_next = s[num_modes] if num_modes < len(s) else 0.0
+    error = 1 - np.abs(s[num_modes - 1] - s_next) / np.abs(s[num_modes - 1])
+    return u[:, :num_modes], error
 
-    natoms = len(atoms.numbers)
-    matrices = []
-    for ii, perm in enumerate(perms_table):
-        matrix = np.zeros((3 * natoms, 3 * natoms)).astype(np.complex128)
-        phasefacter = ops_sym[ii].translation_vector[2]
 
-        for jj in range(natoms):
-            idx = perm[jj]
-            matrix[3 * idx : 3 * (idx + 1), 3 * jj : 3 * (jj + 1)] = ops_sym[
-                ii
-            ].rotation_matrix.copy() * np.exp(1j * qpoint * phasefacter)
-        matrices.append(matrix)
-    return matrices
+def _blas_limits(blas_threads: Union[int, None]):
+    """limit the threads of BLAS and OpenMP, a no-op without threadpoolctl"""
+    if blas_threads is None or threadpool_limits is None:
+        return contextlib.nullcontext()
+    return threadpool_limits(limits=blas_threads)
 
 
-def get_modified_projector(DictParams, atom):
+@contextlib.contextmanager
+def _blas_environ(blas_threads: int):
+    """set the thread variables of BLAS and OpenMP for the processes started inside
+
+    BLAS only reads them when it is loaded, so they have no effect on the
+    current process or on forked ones.
+    """
+    names = ["OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"]
+    old = {name: os.environ.get(name) for name in names}
+    os.environ.update({name: str(blas_threads) for name in names})
+    try:
+        yield
+    finally:
+        for name, value in old.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+# the threadpoolctl limits of a worker process of map_channels, entered by
+# _init_channel_worker and kept for the lifetime of the worker
+_worker_limits = None
+
+
+def _init_channel_worker(blas_threads: int) -> None:
+    """initializer of the worker processes of map_channels"""
+    global _worker_limits
+    _worker_limits = _blas_limits(blas_threads)
+    _worker_limits.__enter__()
+
+
+def map_channels(
+    func,
+    items: list,
+    jobs: int = 1,
+    pool: str = "thread",
+    blas_threads: Union[int, None] = None,
+) -> list:
+    """evaluate independent channels on a pool of workers
+
+    The results are returned in the order of items whatever the order in
+    which the workers finish. BLAS is limited to blas_threads threads per
+    worker, so jobs * blas_threads should not exceed the number of cores.
+    The limit is set by threadpoolctl, without it the thread pool is not
+    limited and the worker processes are spawned with the thread variables
+    of BLAS set, as a forked worker would keep the BLAS of the parent.
+
+    Args:
+        func: function of one item, picklable for a process pool
+        items: the channels, e.g. the m1 quantum numbers
+        jobs: number of workers, 1 runs in the current thread
+        pool: "thread" or "process"
+        blas_threads: BLAS threads per worker, os.cpu_count() // jobs if
+            None and jobs > 1
+
+    Returns: [func(item) for item in items]
+    """
+    if pool not in ["thread", "process"]:
+        raise ValueError("unknown pool %s" % pool)
+    jobs = max(1, min(jobs, len(items)))
+    if jobs == 1:
+        with _blas_limits(blas_threads):
+            return list(map(func, items))
+    if blas_threads is None:
+        blas_threads = max(1, (os.cpu_count() or 1) // jobs)
+    if pool == "thread":
+        # the limits of BLAS are global, they are shared by all the threads
+        with _blas_limits(blas_threads), ThreadPool(processes=jobs) as tp:
+            return tp.map(func, items, chunksize=1)
+    if threadpool_limits is None:
+        context = multiprocessing.get_context("spawn")
+    else:
+        context = multiprocessing.get_context()
+    with _blas_environ(blas_threads), context.Pool(
+        processes=jobs,
+        initializer=_init_channel_worker,
+        initargs=(blas_threads,),
+    ) as pp:
+        return pp.map(func, items, chunksize=1)
+
+
+def _modified_channel(
+    tmp_m1: int,
+    DictParams: dict,
+    rep_apg: SymmetryRepresentation,
+    rep_cyc: Union[SymmetryRepresentation, None],
+    solver: str,
+) -> np.ndarray:
+    """the adapted basis of one m1 channel of get_modified_projector"""
     family = DictParams["family"]
+    nrot = DictParams["nrot"]
+    Dmu_rot_conj, Dmu_tran_conj = get_modified_Dmu(
+        DictParams, tmp_m1, symprec=1e-6
+    )
 
+    ###### the projector for axial point group ########
     if family == 4:
-        nrot = DictParams["nrot"]
-        g_rot = DictParams["generator_rot"]
-        g_tran = DictParams["generator_tran"]
+        # the operation matrices are real, conj only acts on Dmu
+        projector_apg = KroneckerProjector(
+            rep_apg, np.conj(Dmu_rot_conj), weight=1 / (2 * nrot)
+        )
+        ###### the projector for cyclic group ######
+        projector_cyc = KroneckerProjector(rep_cyc, [Dmu_tran_conj])
+        projector = scipy.sparse.linalg.aslinearoperator(
+            projector_cyc
+        ) @ scipy.sparse.linalg.aslinearoperator(projector_apg)
+    else:
+        projector_apg = KroneckerProjector(
+            rep_apg, Dmu_rot_conj, weight=1 / (2 * nrot), irrep_first=False
+        )
+        projector = projector_apg
+    num_modes = int(np.rint(projector_apg.trace().real))
+
+    tmp_basis, error = get_projector_range(projector, num_modes, solver=solver)
+    if error > 0.05:
+        logging.error("the error is larger than 0.05")
+
+    if Dmu_tran_conj.ndim == 0:
+        return tmp_basis
+    tmp_basis1 = np.array(np.array_split(tmp_basis, 2, axis=0))
+    basis_Dmu = np.array([[0, 1], [1, 0]])
+    basis_block1 = np.einsum(
+        "ij,jlm->ilm", basis_Dmu[0][np.newaxis], tmp_basis1
+    )[0]
+    # one of the two components of the irrep, with half of the norm
+    return basis_block1 / np.linalg.norm(basis_block1, axis=0)
+
+
+def get_modified_projector(
+    DictParams,
+    atom,
+    solver="auto",
+    jobs=1,
+    pool="thread",
+    blas_threads=None,
+):
+    """get the symmetry adapted basis of the displacements for families 2 and 4
+
+    The m1 channels are independent, they are evaluated by map_channels.
 
+    Args:
+        DictParams: family, nrot, qpoints, a, generator_rot and
+            generator_tran of the line group
+        atom: the structure
+        solver: passed to get_projector_range
+        jobs: number of workers
+        pool: "thread" or "process"
+        blas_threads: BLAS threads per worker, see map_channels
+
+    Returns: the basis vectors of all the m1 channels as columns and the
+             number of vectors of each channel
+    """
+    family = DictParams["family"]
+    nrot = DictParams["nrot"]
+    g_rot = DictParams["generator_rot"]
+    g_tran = DictParams["generator_tran"]
+
+    if family == 4:
         ops_car_apg = []
         for s in range(nrot):
             for j in range(2):
@@ -440,16 +1109,7 @@ def get_modified_projector(DictParams, atom):
                     rotation_matrix=rot, translation_vec=tran
                 )
                 ops_car_apg.append(op)
-        matrices_apg = get_matrices(atom, ops_car_apg)
-
-        # res, err = [], []
-        # for ii in range(len(matrices_apg)):
-        #     tmp1 = np.array_equal(np.dot(D, matrices_apg[ii]), np.dot(matrices_apg[ii], D))
-        #     tmp2 = np.abs(np.dot(D, matrices_apg[ii]) - np.dot(matrices_apg[ii], D)).sum()
-        #
-        #     res.append(tmp1)
-        #     err.append(tmp2)
-        # set_trace()
+        rep_apg = SymmetryRepresentation.from_ops(atom, ops_car_apg)
 
         ops_car_cyc = [
             SymmOp.from_rotation_and_translation(
@@ -457,97 +1117,9 @@ def get_modified_projector(DictParams, atom):
                 translation_vec=g_tran[0].translation_vector * atom.cell[2, 2],
             )
         ]
-        matrices_cyc = get_matrices(atom, ops_car_cyc)
-        # m1_range = list(range(-nrot + 1, nrot + 1))
-        # m1_range = list(range(1, nrot + 1))
+        rep_cyc = SymmetryRepresentation.from_ops(atom, ops_car_cyc)
         m1_range = list(range(-nrot + 1, 1))
-
-        basis, dimensions = [], []
-        for tmp_m1 in m1_range:
-            Dmu_rot_conj, Dmu_tran_conj = get_modified_Dmu(
-                DictParams, tmp_m1, symprec=1e-6
-            )
-
-            ###### generate the projector for axial point group ########
-            num_modes = 0
-            for ii in range(len(Dmu_rot_conj)):
-                if ii == 0:
-                    projector = TensorProduct(
-                        Dmu_rot_conj[ii], matrices_apg[ii]
-                    )
-                else:
-                    projector += TensorProduct(
-                        Dmu_rot_conj[ii], matrices_apg[ii]
-                    )
-
-                if Dmu_rot_conj[ii].ndim != 0:
-                    num_modes += (
-                        Dmu_rot_conj[ii].trace() * matrices_apg[ii].trace()
-                    )
-                else:
-                    num_modes += Dmu_rot_conj[ii] * matrices_apg[ii].trace()
-
-            num_modes = int(num_modes.real / (2 * nrot))
-            projector_apg = projector / (2 * nrot)
-
-            ###### generate the projector for cyclic group ######
-            projector_cyc = TensorProduct(Dmu_tran_conj, matrices_cyc[0])
-            # projector_cyc2 = np.tensordot(Dmu_tran_conj, matrices_cyc[0], axes=0)
-
-            # projector_cyc2 = np.einsum("ij,kl->ijkl",Dmu_tran_conj, matrices_cyc[0])
-            # projector_cyc2 = projector_cyc2.transpose(0,2,1,3).reshape(projector_cyc2.shape[0]*projector_cyc2.shape[2], projector_cyc2.shape[0]*projector_cyc2.shape[2])
-            # res = (projector_cyc1==projector_cyc2).all()
-
-            # eigenvectors,eigenvalues,_ = scipy.linalg.svd(projector_cyc)
-            # eigenprojectors = []
-            # for i in range(len(eigenvalues)):
-            #     v = eigenvectors[:, i]
-            #     P = np.outer(v, v.conj())
-            #     eigenprojectors.append(P)
-            # eigenprojectors = np.array(eigenprojectors)
-            # mask_eig = np.isclose(eigenvalues, 1, atol=1e-5)
-            # projector_cyc1 =  eigenprojectors[mask_eig].sum(axis=0)
-
-            # projector = projector_cyc1 @ projector_apg
-            # projector = eigenvectors @ projector_apg
-            projector = projector_cyc @ projector_apg.conj()
-            # projector = projector_apg
-
-            u, s, vh = scipy.linalg.svd(projector)
-            error = 1 - np.abs(s[num_modes - 1] - s[num_modes]) / np.abs(
-                s[num_modes - 1]
-            )
-
-            # print("m=%s" % tmp_m1, "error=%s" % error)
-            if error > 0.05:
-                logging.ERROR("the error is lager than 0.05")
-
-            if Dmu_tran_conj.ndim == 0:
-                # set_trace()
-                basis.append(u[:, :num_modes])
-                dimensions.append(num_modes)
-            else:
-                tmp_basis = u[:, :num_modes]
-                tmp_basis1 = np.array(np.array_split(tmp_basis, 2, axis=0))
-                # tmp_basis1 = tmp_basis1[0] + tmp_basis1[1]
-
-                # tmp_basis1 = np.array(np.array_split(tmp_basis1, 2, axis=1))[0]
-                # basis_Dmu = Dmu_rot_conj[ii]
-                # basis_Dmu = scipy.linalg.orth(Dmu_rot_conj[ii])
-                # basis_Dmu = np.abs(basis_Dmu).reshape(-1)
-                basis_Dmu = np.array([[0, 1], [1, 0]])
-                basis_block1 = np.einsum(
-                    "ij,jlm->ilm", basis_Dmu[0][np.newaxis], tmp_basis1
-                )[0]
-                # basis_partial_scalar_product = np.tensordot(basis_Dmu, basis_block, axes=([0, 1], [0, 1]))
-
-                basis.append(basis_block1)
-                dimensions.append(basis_block1.shape[1])
     elif family == 2:
-        nrot = DictParams["nrot"]
-        g_rot = DictParams["generator_rot"]
-        g_tran = DictParams["generator_tran"]
-
         ops_car_apg = []
         for s in range(2 * nrot):
             rot = np.linalg.matrix_power(g_rot[0].rotation_matrix, s)
@@ -556,85 +1128,225 @@ def get_modified_projector(DictParams, atom):
                 rotation_matrix=rot, translation_vec=tran
             )
             ops_car_apg.append(op)
-        matrices_apg = get_matrices(atom, ops_car_apg)
-
-        ops_car_cyc = [
-            SymmOp.from_rotation_and_translation(
-                rotation_matrix=g_tran[0].rotation_matrix,
-                translation_vec=g_tran[0].translation_vector * atom.cell[2, 2],
-            )
-        ]
-        matrices_cyc = get_matrices(atom, ops_car_cyc)
+        rep_apg = SymmetryRepresentation.from_ops(atom, ops_car_apg)
+        # the cyclic projector is not used for family 2
+        rep_cyc = None
         m1_range = list(range(int(-nrot / 2 + 1), int(nrot / 2 + 1)))
+    else:
+        raise ValueError("family %s is not supported" % family)
+
+    func = functools.partial(
+        _modified_channel,
+        DictParams=DictParams,
+        rep_apg=rep_apg,
+        rep_cyc=rep_cyc,
+        solver=solver,
+    )
+    basis = map_channels(
+        func, m1_range, jobs=jobs, pool=pool, blas_threads=blas_threads
+    )
+    dimensions = [tmp.shape[1] for tmp in basis]
+    adapted = np.concatenate(basis, axis=1)
+    return adapted, dimensions
 
-        basis, dimensions = [], []
-        for tmp_m1 in m1_range:
-            Dmu_rot_conj, Dmu_tran_conj = get_modified_Dmu(
-                DictParams, tmp_m1, symprec=1e-6
-            )
-            ###### generate the projector for axial point group ########
-            num_modes = 0
-            tmp = []
-            for ii in range(len(Dmu_rot_conj)):
-                if ii == 0:
-                    projector = TensorProduct(
-                        matrices_apg[ii], Dmu_rot_conj[ii]
-                    )
-                else:
-                    projector += TensorProduct(
-                        matrices_apg[ii], Dmu_rot_conj[ii]
-                    )
-
-                if Dmu_rot_conj[ii].ndim != 0:
-                    num_modes += (
-                        Dmu_rot_conj[ii].trace() * matrices_apg[ii].trace()
-                    )
-                    tmp.append(matrices_apg[ii].trace())
-                else:
-                    num_modes += Dmu_rot_conj[ii] * matrices_apg[ii].trace()
-
-            num_modes = int(num_modes.real / (2 * nrot))
-            projector_apg = projector / (2 * nrot)
 
-            ###### generate the projector for cyclic group ######
-            projector_cyc = TensorProduct(matrices_cyc[0], Dmu_tran_conj)
-            # projector_cyc2 = np.einsum("ij,kl->ijkl",Dmu_tran_conj, matrices_cyc[0])
-            # projector_cyc2 = projector_cyc2.transpose(0,2,1,3).reshape(projector_cyc2.shape[0]*projector_cyc2.shape[2], projector_cyc2.shape[0]*projector_cyc2.shape[2])
+def get_table_elements(DictParams, atom) -> [list, list]:
+    """list the elements of a line group in the layout of its irreps table
 
-            # projector = projector_cyc1 @ projector_apg
-            # projector = eigenvectors @ projector_apg
-            # projector = projector_cyc @ projector_apg
-            projector = projector_apg
+    The elements screw^t rot^s mirror^j U^k are enumerated with the
+    exponents of LineGroupElements and built from the generators of the
+    structure, no closure search is needed. Only the families with an
+    irreps table, the keys of TABLE_GENERATORS, are covered: there are
+    no tables of the families 1, 5, 7 and 9 to 12 in this package.
 
-            u, s, vh = scipy.linalg.svd(projector)
-            error = 1 - np.abs(s[num_modes - 1] - s[num_modes]) / np.abs(
-                s[num_modes - 1]
-            )
+    Args:
+        DictParams: family, nrot and generators, the symmetry operations of
+            TABLE_GENERATORS[family] with translations in units of the period
+        atom: the structure
 
-            if error > 0.05:
-                # set_trace()
-                logging.ERROR("the error is lager than 0.05")
+    Returns: the words of the elements for DictParams["order"] and the
+             elements as SymmOps with Cartesian translations
+    """
+    family = DictParams["family"]
+    if family not in TABLE_GENERATORS:
+        raise NotImplementedError(
+            "Family %d has no irreps table, only the families %s have one"
+            % (family, ", ".join(str(ii) for ii in TABLE_GENERATORS))
+        )
+    names = TABLE_GENERATORS[family]
+    generators = DictParams["generators"]
+    if len(generators) != len(names):
+        raise ValueError(
+            "family %d needs the generators %s" % (family, ", ".join(names))
+        )
+    affine = {}
+    for name, gen in zip(names, generators):
+        affine[name] = gen.affine_matrix.copy()
+        affine[name][2, 3] *= atom.cell[2, 2]
+
+    words, ops = [], []
+    for t, s, j, k in LineGroupElements(family, DictParams["nrot"]).exponents:
+        powers = {"screw": t, "rot": s, "mirror": j, "u": k}
+        word, mat = [], np.eye(4)
+        # U acts first and the screw axis last
+        for name in ["u", "mirror", "rot", "screw"]:
+            if name not in names or powers[name] == 0:
+                continue
+            word += [names.index(name) + 1] * powers[name]
+            mat = np.linalg.matrix_power(affine[name], powers[name]) @ mat
+        words.append(word if word else [0])
+        ops.append(SymmOp(mat))
+    return words, ops
+
+
+def _table_character(Dmat: np.ndarray) -> np.ndarray:
+    """the characters of an entry of an irreps table"""
+    Dmat = np.asarray(Dmat)
+    return Dmat if Dmat.ndim == 1 else np.trace(Dmat, axis1=1, axis2=2)
+
+
+def _is_table_decomposition(
+    charas: list, table: np.ndarray, phases: np.ndarray, atol: float = 1e-6
+) -> bool:
+    """check that the entries of an irreps table split a representation
+
+    The representation M_ii of the ii-th element carries the phase
+    phases[ii], so M_ii M_jj = omega_ij M_table[jj, ii]. The entry with the
+    characters chi is projected out by e = sum_g chi_g^* M_g / lambda, which
+    is an orthogonal projector commuting with all the M_g only if the
+    characters fit omega: e e = e, e M_h = M_h e and e^+ = e, all checked in
+    the group algebra. The projectors of all the entries have to add up to
+    the identity. A table of the wrong wave vector, or one missing some
+    entries, fails here instead of giving a wrong basis.
 
-            if Dmu_tran_conj.ndim == 0:
-                basis.append(u[:, :num_modes])
-                dimensions.append(num_modes)
-            else:
-                tmp_basis = u[:, :num_modes]
-                tmp_basis1 = np.array(np.array_split(tmp_basis, 2, axis=0))
-                basis_Dmu = np.array([[0, 1], [1, 0]])
+    Args:
+        charas: the characters of every entry, see _table_character
+        table: Cayley table of the elements (CayleyTable.table)
+        phases: the phase factor of every element
+        atol: tolerance
 
-                basis_block1 = np.einsum(
-                    "ij,jlm->ilm", basis_Dmu[0][np.newaxis], tmp_basis1
-                )[0]
-                # basis_partial_scalar_product = np.tensordot(basis_Dmu, basis_block, axes=([0, 1], [0, 1]))
+    Returns: whether the entries decompose the representation
+    """
+    num = len(table)
+    idx = np.arange(num)
+    prod = table.T
+    omega = phases[:, None] * phases[None, :] / phases[prod]
+    identity = int(np.where((table == idx).all(axis=1))[0][0])
+    inverse = np.argmax(prod == identity, axis=1)
+
+    total = np.zeros(num, dtype=np.complex128)
+    for chara in charas:
+        coeff = np.conj(chara).astype(np.complex128)
+        square = np.zeros(num, dtype=np.complex128)
+        np.add.at(square, prod, coeff[:, None] * coeff[None, :] * omega)
+        lam = square[identity] / coeff[identity]
+        if np.abs(lam) < atol or not np.allclose(
+            square, lam * coeff, atol=atol * np.abs(lam)
+        ):
+            return False
+        # M_h e and e M_h in the group algebra, row h
+        left = np.zeros((num, num), dtype=np.complex128)
+        right = np.zeros((num, num), dtype=np.complex128)
+        left[idx[:, None], prod] = coeff[None, :] * omega
+        right[idx[:, None], prod.T] = coeff[None, :] * omega.T
+        if not np.allclose(left, right, atol=atol):
+            return False
+        # M_g^+ = M_g^-1 = M_inverse[g] / omega[g, inverse[g]]
+        if not np.allclose(
+            np.conj(coeff) / omega[idx, inverse], coeff[inverse], atol=atol
+        ):
+            return False
+        total += coeff / lam
+    return np.allclose(total, idx == identity, atol=atol)
+
+
+def _adapted_channel(
+    Dmat: np.ndarray, rep: SymmetryRepresentation, solver: str
+) -> np.ndarray:
+    """the adapted basis of one entry of an irreps table"""
+    chara = _table_character(Dmat)
+    # an entry is a sum of irreps with c_i = ratio * d_i copies of the irrep
+    # i of dimension d_i (a single irrep, parities added up, ...), then
+    # sum_g chi_g^* M_g / (ratio |G|) is the projector on all of them
+    ratio = (np.abs(chara) ** 2).sum() / len(chara) / chara[0].real
+    projector = KroneckerProjector(rep, chara.conj(), 1 / (ratio * len(rep)))
+    num_modes = int(np.rint(projector.trace().real))
+    basis, error = get_projector_range(projector, num_modes, solver=solver)
+    if error > 0.05:
+        logging.error("the error is larger than 0.05")
+    return basis
+
+
+def get_adapted_basis(
+    DictParams,
+    atom,
+    withparities=False,
+    symprec=1e-6,
+    solver="auto",
+    jobs=1,
+    pool="thread",
+    blas_threads=None,
+):
+    """get the symmetry adapted basis of the displacements from the irreps tables
+
+    A table-validated engine, not one for all the line groups: the elements
+    come from get_table_elements, the irreps from line_group_sympy (or
+    line_group_sympy_withparities) and each entry is projected out
+    matrix-free by _adapted_channel on map_channels. The table is checked
+    against the phases of the wave vector first (_is_table_decomposition)
+    and ValueError is raised if it does not decompose the representation.
+    The check passes for the families 6 and 8 at every q, the families 2
+    and 3 with an even nrot and the families 4 and 13 at q = 0; the screw
+    axis tables of the families 4 and 13 do not pair with the phases at
+    other wave vectors. The families 1, 5, 7 and 9 to 12 have no irreps
+    table and are out of scope (NotImplementedError). The m1 channels of
+    the families 2 and 4 at any q are still given by get_modified_projector.
 
-                basis.append(basis_block1)
-                dimensions.append(basis_block1.shape[1])
+    Args:
+        DictParams: family, nrot, qpoints, a and generators, see
+            get_table_elements
+        atom: the structure
+        withparities: use line_group_sympy_withparities
+        symprec: passed to the irreps table
+        solver: passed to get_projector_range
+        jobs: number of workers
+        pool: "thread" or "process"
+        blas_threads: BLAS threads per worker, see map_channels
+
+    Returns: the basis vectors of all the entries as columns, the number of
+             vectors of each entry and the parameters of the entries
+    """
+    words, ops = get_table_elements(DictParams, atom)
+    params = dict(DictParams, order=words)
+    if withparities:
+        Dmats, paras_values, _ = line_group_sympy_withparities(params, symprec)
+    else:
+        Dmats, paras_values, _ = line_group_sympy(params, symprec)
+    rep = SymmetryRepresentation.from_ops(
+        atom, ops, qpoint=DictParams["qpoints"]
+    )
+    table = (
+        LineGroupElements(DictParams["family"], DictParams["nrot"])
+        .get_cayley_table()
+        .table
+    )
+    phases = np.ones(len(ops)) if rep.phases is None else rep.phases
+    if not _is_table_decomposition(
+        [_table_character(Dmat) for Dmat in Dmats], table, phases
+    ):
+        raise ValueError(
+            "the irreps table of family %d with nrot = %d does not decompose "
+            "the representation at qpoint %s"
+            % (DictParams["family"], DictParams["nrot"], DictParams["qpoints"])
+        )
 
+    func = functools.partial(_adapted_channel, rep=rep, solver=solver)
+    basis = map_channels(
+        func, Dmats, jobs=jobs, pool=pool, blas_threads=blas_threads
+    )
+    dimensions = [tmp.shape[1] for tmp in basis]
     adapted = np.concatenate(basis, axis=1)
-    # if adapted.shape[0] != adapted.shape[1]:
-    #     set_trace()
-    return adapted, dimensions
+    return adapted, dimensions, paras_values
 
 
 def affine_matrix_op(af1, af2):
@@ -667,105 +1379,149 @@ def dimino_affine_matrix_and_character(
 
     Args:
         generators: the generators of point group
+        character: the representation matrices of the generators
         symec: system precision
 
     Returns: all the group elements and correspond character
 
     """
-    e_in = np.array([[1, 0, 0, 0], [0, 1, 0, 0], [0, 0, 1, 0], [0, 0, 0, 1]])
+    L, L_chara, _ = _dimino(generators, symec, character)
+    return L, np.trace(L_chara, axis1=1, axis2=2)
 
-    if character[0].ndim == 0:
-        L_chara = np.array([np.complex128(1)])
-        C_chara = np.array([np.complex128(1)])
-    else:
-        L_chara = np.array([np.complex128(1) * np.eye(character[0].shape[0])])
-        C_chara = np.array([np.complex128(1) * np.eye(character[0].shape[0])])
-
-    G = generators
-    g, g1 = G[0].copy(), G[0].copy()
-    g_chara, g1_chara = character[0].copy(), character[0].copy()
-    L = np.array([e_in])
-    while not ((g - e_in) < symec).all():
-        L = np.vstack((L, [g]))
-        L_chara = np.vstack((L_chara, [g_chara]))
-
-        # g = np.dot(g, g1)
-        g = affine_matrix_op(g, g1)
-        g_chara = np.dot(g_chara, g1_chara)
-
-    for ii in range(len(G)):
-        C = np.array([e_in])
-        L1 = L.copy()
-        L1_chara = L_chara.copy()
-
-        more = True
-        while more:
-            more = False
-            for jj, g in enumerate(list(C)):
-                g_chara = C_chara[jj]
-
-                for kk, ss in enumerate(G[: ii + 1]):
-                    ss_chara = character[kk]
-                    sg = affine_matrix_op(ss, g)
-                    sg_chara = np.dot(ss_chara, g_chara)
-
-                    itp = (abs((sg - L).sum(axis=1).sum(axis=1)) < 0.001).any()
-                    if not itp:
-                        if C.ndim == 3:
-                            C = np.vstack((C, [sg]))
-                            C_chara = np.vstack((C_chara, [sg_chara]))
-                        else:
-                            C = np.array((C, sg))
-                            C_chara = np.array((C_chara, sg_chara))
-
-                        if L.ndim == 3:
-                            L = np.vstack(
-                                (
-                                    L,
-                                    np.array(
-                                        [affine_matrix_op(sg, t) for t in L1]
-                                    ),
-                                )
-                            )
-                            tmp = np.array(
-                                [
-                                    np.dot(sg_chara, t_chara)
-                                    for t_chara in L1_chara
-                                ]
-                            )
-                            L_chara = np.vstack((L_chara, tmp))
-                        else:
-                            L = np.array(
-                                L,
-                                np.array(
-                                    [affine_matrix_op(sg, t) for t in L1]
-                                ),
-                            )
-                        more = True
-    L_chara_trace = []
-    for lc in L_chara:
-        if lc.ndim == 1:
-            L_chara_trace.append(lc)
-        else:
-            L_chara_trace.append(np.trace(lc))
-    return L, np.array(L_chara_trace)
+
+# the cells of the hash of the group elements are _CELL * symec wide, so
+# the tolerance ball of an entry reaches one neighbouring cell at most
+_CELL = 8
+
+
+def _affine_keys(ops: np.ndarray, symec: float) -> [np.ndarray, np.ndarray]:
+    """the cells of affine matrices around a grid with a spacing of _CELL * symec
+
+    Args:
+        ops: affine matrices, shape (n, 4, 4)
+        symec: tolerance
+
+    Returns: the cells of the upper three rows, and the direction (-1, 0 or
+             1) of the neighbouring cell each entry is closer than symec to
+
+    """
+    scaled = ops[:, :3, :].reshape(len(ops), -1) / (_CELL * symec)
+    # the cells are centered on the grid points, where 0 and 1 lie
+    keys = np.round(scaled)
+    frac = (scaled - keys + 0.5) * _CELL
+    reach = np.where(frac < 1, -1, np.where(frac > _CELL - 1, 1, 0))
+    return keys.astype(np.int64), reach
+
+
+def _find_key(
+    seen: dict,
+    L: np.ndarray,
+    op: np.ndarray,
+    key: np.ndarray,
+    reach: np.ndarray,
+    symec: float,
+):
+    """look up an element within symec of op in all the cells its tolerance ball reaches
+
+    The cells only propose the candidates, an element matches if all the
+    entries differ by less than symec as in the brute force search.
+
+    Args:
+        seen: the indices of the elements of L in every cell
+        L: the elements
+        op: the affine matrix looked up
+        key: its cell, see _affine_keys
+        reach: its neighbouring cells, see _affine_keys
+        symec: tolerance
+
+    Returns: the index of the first matching element found, None if none
+
+    """
+    idx = np.where(reach != 0)[0]
+    for flips in itertools.product((False, True), repeat=len(idx)):
+        tmp = key.copy()
+        tmp[idx[list(flips)]] += reach[idx[list(flips)]]
+        cands = seen.get(tmp.tobytes())
+        if cands is None:
+            continue
+        match = (np.abs(L[cands] - op) < symec).all(axis=(1, 2))
+        if match.any():
+            return cands[int(np.argmax(match))]
+    return None
+
+
+def _group_closure(
+    generators: np.ndarray, symec: float = 0.01
+) -> [np.ndarray, list]:
+    """close the generators into a group with a hash table of the elements
+
+    Every element is multiplied by all the generators once, in the order
+    the elements were found, which gives the same elements in the same
+    order as multiplying all of them again until nothing new comes out.
+    The elements are looked up in the cells of a hash of their matrices and
+    only compared with the ones in the cells within symec, an element is
+    new if no entry-wise difference is below symec as in the brute force
+    search. The storage grows by doubling.
+
+    Args:
+        generators: The most basic elements used to generate complete groups
+        symec: tolerance
+
+    Returns:
+        L: all group elements
+        L_seq: the multiplication order of the generators
+    """
+    G = np.asarray(generators, dtype=np.float64).reshape(-1, 4, 4)
+    ng = len(G)
+    L = np.empty((16, 4, 4))
+    L[0] = np.eye(4)
+    L_seq = [[0]]
+    keys, _ = _affine_keys(L[:1], symec)
+    seen = {keys[0].tobytes(): [0]}
+
+    num, start = 1, 0
+    while start < num:
+        block = L[start:num]
+        # gh = affine_matrix_op(g, h) for all g in the block and h in G
+        prod = np.zeros((len(block), ng, 4, 4))
+        prod[..., :3, :3] = np.einsum(
+            "hij,gjk->ghik", G[:, :3, :3], block[:, :3, :3]
+        )
+        prod[..., :3, 3] = (
+            G[None, :, :3, 3]
+            + np.einsum("hij,gj->ghi", G[:, :3, :3], block[:, :3, 3])
+        ) % 1
+        prod[..., 3, 3] = 1
+        prod = prod.reshape(-1, 4, 4)
+        keys, reach = _affine_keys(prod, symec)
+        for kk in range(len(prod)):
+            if (
+                _find_key(seen, L, prod[kk], keys[kk], reach[kk], symec)
+                is not None
+            ):
+                continue
+            if num == len(L):
+                L = np.concatenate((L, np.empty_like(L)), axis=0)
+            L[num] = prod[kk]
+            seen.setdefault(keys[kk].tobytes(), []).append(num)
+            ii, jj = divmod(kk, ng)
+            L_seq.append(L_seq[start + ii] + [jj + 1])
+            num += 1
+        start += len(block)
+    return L[:num].copy(), L_seq
 
 
 def brute_force_generate_group(generators: np.ndarray, symec: float = 0.01):
-    e_in = np.eye(4)
-    G = generators
-    L = np.array([e_in])
-    while True:
-        numL_old = len(L)
-        for g in L:
-            for h in G:
-                gh = affine_matrix_op(g, h)
-                judge = (abs(L - gh) < symec).all(axis=1).all(axis=1).any()
-                if not judge:
-                    L = np.concatenate((L, [gh]), axis=0)
-        numL_new = len(L)
-        if numL_old == numL_new:
-            break
+    """generate all the group elements by brute force algorithm
+
+    Args:
+        generators: The most basic elements used to generate complete groups
+        symec: tolerance
+
+    Returns: all group elements
+
+    """
+    L, _ = _group_closure(generators, symec)
     return L
 
 
@@ -782,25 +1538,132 @@ def brute_force_generate_group_subsquent(
         L: all group elements
         L_seq: the multiplication order of the generators
     """
-    e_in = np.eye(4)
-    G = generators
-    L = np.array([e_in])
-    L_seq = [[0]]
-    while True:
-        numL_old = len(L)
-        for ii, g in enumerate(L):
-            tmp_seq1 = L_seq[ii]
-            for jj, h in enumerate(G):
-                gh = affine_matrix_op(g, h)
-                tmp_seq2 = tmp_seq1 + [jj + 1]
-                judge = (abs(L - gh) < symec).all(axis=1).all(axis=1).any()
-                if not judge:
-                    L = np.concatenate((L, [gh]), axis=0)
-                    L_seq.append(tmp_seq2)
-        numL_new = len(L)
-        if numL_old == numL_new:
-            break
-    return L, L_seq
+    return _group_closure(generators, symec)
+
+
+class _ElementStore:
+    """group elements looked up in the cells of a hash of their matrices (see _find_key), with a buffer growing by doubling"""
+
+    def __init__(self, dim: int, symec: float) -> None:
+        self.symec = symec
+        self.num = 0
+        self.L = np.empty((16, 4, 4))
+        self.values = np.empty((16, dim, dim), dtype=np.complex128)
+        self.words = []
+        self._seen = {}
+
+    def _wrap(self, ops: np.ndarray) -> np.ndarray:
+        # a translation of 1 - 1e-16 is the same as 0
+        ops = ops.copy()
+        tran = np.remainder(ops[:, :3, 3], 1)
+        tran[tran > 1 - self.symec / 2] -= 1
+        ops[:, :3, 3] = tran
+        return ops
+
+    def __contains__(self, op: np.ndarray) -> bool:
+        op = self._wrap(op[None])
+        keys, reach = _affine_keys(op, self.symec)
+        return (
+            _find_key(self._seen, self.L, op[0], keys[0], reach[0], self.symec)
+            is not None
+        )
+
+    def append(self, ops: np.ndarray, values: np.ndarray, words: list):
+        ops = self._wrap(ops)
+        while self.num + len(ops) > len(self.L):
+            self.L = np.concatenate((self.L, np.empty_like(self.L)))
+            self.values = np.concatenate(
+                (self.values, np.empty_like(self.values))
+            )
+        end = self.num + len(ops)
+        self.L[self.num : end] = ops
+        self.values[self.num : end] = values
+        self.words.extend(words)
+        keys, _ = _affine_keys(ops, self.symec)
+        for ii, key in enumerate(keys):
+            self._seen.setdefault(key.tobytes(), []).append(self.num + ii)
+        self.num = end
+
+
+def _join_words(word1: list, word2: list) -> list:
+    return [ii for ii in word1 + word2 if ii != 0] or [0]
+
+
+def _dimino(
+    generators: np.ndarray, symec: float = 0.01, character=None
+) -> [np.ndarray, np.ndarray, list]:
+    """generate all the group elements by Dimino's algorithm
+
+    The group grows one generator at a time, every new coset of the
+    previous group is formed with one batched product and the membership
+    is looked up by the quantized matrices. With x * y meaning
+    affine_matrix_op(x, y), the cosets are H * r and the new
+    representatives are r * s, and character follows D(x * y) = D(x) D(y).
+
+    Args:
+        generators: the generators
+        symec: tolerance
+        character: representation matrices (or numbers) of the generators
+
+    Returns:
+        L: all group elements
+        L_chara: their representation matrices
+        L_subs: the multiplication order of the generators
+    """
+    G = np.asarray(generators, dtype=np.float64).reshape(-1, 4, 4)
+    if character is None:
+        D = np.ones((len(G), 1, 1), dtype=np.complex128)
+    else:
+        D = np.array([np.atleast_2d(tmp) for tmp in character])
+        D = D.astype(np.complex128)
+    dim = D.shape[1]
+
+    store = _ElementStore(dim, symec)
+    store.append(np.eye(4)[None], np.eye(dim)[None], [[0]])
+    # the cyclic group of the first generator
+    g, g_chara, g_subs = G[0], D[0], [1]
+    while g not in store:
+        store.append(g[None], g_chara[None], [g_subs])
+        g = affine_matrix_op(g, G[0])
+        g_chara = g_chara @ D[0]
+        g_subs = g_subs + [1]
+
+    for ii in range(1, len(G)):
+        if G[ii] in store:
+            continue
+        num = store.num
+        H = store.L[:num].copy()
+        H_chara = store.values[:num].copy()
+        H_subs = store.words[:num]
+
+        reps = [(np.eye(4), np.eye(dim), [0])]
+        pos = 0
+        while pos < len(reps):
+            r, r_chara, r_subs = reps[pos]
+            pos += 1
+            for kk in range(ii + 1):
+                x = affine_matrix_op(r, G[kk])
+                if x in store:
+                    continue
+                x_chara = r_chara @ D[kk]
+                x_subs = _join_words(r_subs, [kk + 1])
+                reps.append((x, x_chara, x_subs))
+
+                # the coset H * x = affine_matrix_op(h, x) for all h in H
+                coset = np.zeros((num, 4, 4))
+                coset[:, :3, :3] = x[:3, :3] @ H[:, :3, :3]
+                coset[:, :3, 3] = (x[:3, 3] + H[:, :3, 3] @ x[:3, :3].T) % 1
+                coset[:, 3, 3] = 1
+                store.append(
+                    coset,
+                    H_chara @ x_chara,
+                    [_join_words(tmp, x_subs) for tmp in H_subs],
+                )
+    return (
+        store.L[: store.num].copy(),
+        store.values[: store.num].copy(),
+        store.words,
+    )
 
 
 def dimino_affine_matrix(
@@ -812,41 +1675,10 @@ def dimino_affine_matrix(
         generators: the generators of point group
         symec: system precision
 
-    Returns: all the group elements and correspond character
+    Returns: all the group elements
 
     """
-    e_in = np.eye(4)
-
-    G = generators
-    g, g1 = G[0].copy(), G[0].copy()
-    L = np.array([e_in])
-    while not ((g - e_in) < symec).all():
-        L = np.vstack((L, [g]))
-        g = affine_matrix_op(g, g1)
-    for ii in range(len(G)):
-        C = np.array([e_in])
-        L1 = L.copy()
-        more = True
-        while more:
-            more = False
-            for g in list(C):
-                for ss in G[: ii + 1]:
-                    sg = affine_matrix_op(ss, g)
-                    itp = (abs((sg - L).sum(axis=1).sum(axis=1)) < symec).any()
-                    if not itp:
-                        if C.ndim == 3:
-                            C = np.vstack((C, [sg]))
-                        if L.ndim == 3:
-                            L = np.vstack(
-                                (
-                                    L,
-                                    np.array(
-                                        [affine_matrix_op(sg, t) for t in L1]
-                                    ),
-                                )
-                            )
-                        more = True
-    L = np.unique(L, axis=0)
+    L, _, _ = _dimino(generators, symec)
     return L
 
 
@@ -859,70 +1691,10 @@ def dimino_affine_matrix_and_subsquent(
         generators: the generators of point group
         symec: system precision
 
-    Returns: all the group elements and correspond character
+    Returns: all the group elements and the multiplication order of the generators
 
     """
-    e_in = np.eye(4)
-
-    G = generators
-    g, g1 = G[0].copy(), G[0].copy()
-    g_subs, g1_subs = [1], [1]
-    L = np.array([e_in])
-    L_subs = [[0]]
-
-    while not ((g - e_in) < symec).all():
-        L = np.vstack((L, [g]))
-        L_subs.append(g_subs.copy())
-
-        g = affine_matrix_op(g, g1)
-        g_subs = g_subs + g1_subs
-    for ii in range(len(G)):
-        C = np.array([e_in])
-        C_subs = [[0]]
-
-        L1 = L.copy()
-        L1_subs = L_subs.copy()
-        more = True
-        while more:
-            more = False
-            for jj, g in enumerate(list(C)):
-                g_subs = C_subs[jj]
-                for kk, ss in enumerate(G[: ii + 1]):
-                    ss_subs = [kk + 1]
-
-                    sg = affine_matrix_op(ss, g)
-                    sg_subs = ss_subs + g_subs
-
-                    itp = (abs((sg - L).sum(axis=1).sum(axis=1)) < 0.001).any()
-                    if not itp:
-                        if C.ndim == 3:
-                            C = np.vstack((C, [sg]))
-                            C_subs.append(sg_subs)
-                        else:
-                            C = np.array((C, sg))
-                            C_subs = C_subs.append(sg_subs)
-                        if L.ndim == 3:
-                            L = np.vstack(
-                                (
-                                    L,
-                                    np.array(
-                                        [affine_matrix_op(sg, t) for t in L1]
-                                    ),
-                                )
-                            )
-                            tmp = [sg_subs + t_subs for t_subs in L1_subs]
-                            L_subs = L_subs + tmp
-
-                        else:
-                            L = np.array(
-                                L,
-                                np.array(
-                                    [affine_matrix_op(sg, t) for t in L1]
-                                ),
-                            )
-                            tmp = [sg_subs + t_subs for t_subs in L1_subs]
-                            L_subs = L_subs + tmp
-                        more = True
+    L, _, L_subs = _dimino(generators, symec)
     return L, L_subs
 
 
@@ -971,14 +1743,14 @@ def get_character_num_withparities(DictParams, symprec=1e-8):
     return characters, paras_values, paras_symbols
 
 
-def fast_orth(A, num):
+def fast_orth(A, num, solver="auto"):
     """Reimplementation of scipy.linalg.orth() which takes only the vectors with
     values almost equal to the maximum, and returns at most maxrank vectors.
+
+    Only the leading num singular vectors are computed, large matrices use a
+    randomized SVD (see get_projector_range).
     """
-    # u, s, vh = scipy.linalg.interpolative.svd(A, maxrank)
-    u, s, vh = scipy.linalg.svd(A)
-    error = 1 - np.abs(s[num - 1] - s[num]) / np.abs(s[num - 1])
-    return u[:, :num], error
+    return get_projector_range(A, num, solver=solver)
 
 
 def get_sym_constrains_matrices_M(ops, permutations, diminsion=3):
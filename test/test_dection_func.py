@@ -16,15 +16,24 @@ import os
 from pathlib import Path
 from pdb import set_trace
 
+import numpy as np
 import pretty_errors
 import pytest
 import pytest_datadir
 from ase.io.vasp import read_vasp
 from pymatgen.core import Molecule
+from pymatgen.core.operations import SymmOp
 
+from pulgon_tools_wip.axial_point_group import AxialPointGroupAnalyzer
+from pulgon_tools_wip.detect_batch import (
+    collect_files,
+    detect_batch,
+    detect_one,
+)
 from pulgon_tools_wip.detect_generalized_translational_group import (
     CyclicGroupAnalyzer,
 )
+from pulgon_tools_wip.detect_line_group import LineGroupDetector
 from pulgon_tools_wip.detect_point_group import LineGroupAnalyzer
 
 pytest_plugins = ["pytest-datadir"]
@@ -58,6 +67,16 @@ class TestCyclicGroupAnalyzer:
         assert str(monomers[0].symbols) == "Mo9S18"
         assert translations[0] == 0.5
 
+    def test_generate_monomer_with_noise(self, shared_datadir):
+        st_name = shared_datadir / "9-9-AM"
+        st = read_vasp(st_name)
+        rng = np.random.default_rng(0)
+        st.positions[:, 2] += rng.uniform(-1e-3, 1e-3, len(st))
+        cy = CyclicGroupAnalyzer(st, tolerance=1e-2)
+        monomers, translations = cy._potential_translation()
+        assert str(monomers[0].symbols) == "Mo9S18"
+        assert abs(translations[0] - 0.5) < 1e-3
+
     def test_rotational_tolerance(self, shared_datadir):
         st_name = shared_datadir / "st1"
         st = read_vasp(st_name)
@@ -74,6 +93,13 @@ class TestCyclicGroupAnalyzer:
         assert idx1 == True and Q1 == 12
         assert idx2 == False and Q2 == 1
 
+    def test_exact_screw(self, shared_datadir):
+        st_name = shared_datadir / "12-12-AM"
+        st = read_vasp(st_name)
+        cy = CyclicGroupAnalyzer(st, tolerance=1e-3, exact_screw=True)
+        assert cy._rot_order == 12
+        assert cy.cyclic_group[0] == "(C24|T2(1.596))"
+
     def test_mirror(self, shared_datadir):
         st_name = shared_datadir / "st7"
         st = read_vasp(st_name)
@@ -101,6 +127,23 @@ class TestCyclicGroupAnalyzer:
         assert idx1 == True
         assert idx2 == False
 
+    def test_find_primitive_from_supercell(self, shared_datadir):
+        st_name = shared_datadir / "9-9-AM"
+        st = read_vasp(st_name)
+        cy1 = CyclicGroupAnalyzer(st, tolerance=1e-2)
+        cy2 = CyclicGroupAnalyzer(st.repeat((1, 1, 4)), tolerance=1e-2)
+        assert len(cy2._primitive) == len(cy1._primitive)
+        assert abs(cy2._pure_trans - cy1._pure_trans) < 1e-6
+
+    def test_cyclic_group_24_0_zz(self, shared_datadir):
+        # the (24, 0) zigzag tube has the screw axis 48_24 and a glide plane
+        st = read_vasp(shared_datadir / "24-0-ZZ")
+        cy1 = CyclicGroupAnalyzer(st, tolerance=1e-2)
+        assert cy1.cyclic_group == ["(C48|T2(2.74))", "T'(2.74)", "T"]
+        assert len(cy1._primitive) == len(st)
+        cy2 = CyclicGroupAnalyzer(st, tolerance=1e-3)
+        assert cy2.cyclic_group == ["T'(2.74)", "T"]
+
     def test_the_whole_function_st1(self, shared_datadir):
         st_name = shared_datadir / "st1"
         st = read_vasp(st_name)
@@ -206,3 +249,80 @@ class TestAxialPointGroupAnalyzer:
         obj = LineGroupAnalyzer(st)
         pg = obj.get_pointgroup()
         assert str(pg) == "C24v"
+
+    def test_screen_rot_orders(self, shared_datadir):
+        st = read_vasp(shared_datadir / "24-0-ZZ")
+        obj = LineGroupAnalyzer(st)
+        assert obj._screen_rot_orders()[0] == 24
+        assert obj.rot_sym[0][1] == 24
+
+        st = read_vasp(shared_datadir / "non-sym")
+        obj = LineGroupAnalyzer(st)
+        assert obj._screen_rot_orders() == []
+
+    def test_numpy_engine(self, shared_datadir):
+        for st_name in ["12-12-AM", "C4h", "m2", "st1", "non-sym"]:
+            st = read_vasp(shared_datadir / st_name)
+            mol = Molecule(species=st.numbers, coords=st.positions)
+            obj1 = LineGroupAnalyzer(mol)
+            obj2 = AxialPointGroupAnalyzer(st.positions, st.numbers)
+            assert obj1.sch_symbol == obj2.sch_symbol
+            assert len(obj1.symmops) == len(obj2.symmops)
+            for op1, op2 in zip(obj1.symmops, obj2.symmops):
+                assert np.allclose(op1.rotation_matrix, op2[:3, :3])
+
+
+class TestLineGroupDetector:
+    def test_line_group_st1(self, shared_datadir):
+        st_name = shared_datadir / "st1"
+        st = read_vasp(st_name)
+        obj = LineGroupDetector(st, tolerance=1e-2)
+        family, trans_sym, rota_sym = obj.get_line_group()
+        assert family == 5
+        assert trans_sym == "(C12|T3(1.5))" and rota_sym == "D4"
+
+    def test_line_group_perms(self, shared_datadir):
+        st_name = shared_datadir / "24-0-ZZ"
+        st = read_vasp(st_name)
+        obj = LineGroupDetector(st)
+        generators, perms_table = obj.get_generators()
+        assert len(generators) == len(perms_table)
+        for op, perm in zip(generators, perms_table):
+            assert (np.sort(perm) == np.arange(len(obj.primitive))).all()
+            new_pos = op.operate_multi(obj.primitive.positions)
+            diff = new_pos - obj.primitive.positions[perm]
+            period = obj.primitive.cell[2, 2]
+            diff[:, 2] -= np.round(diff[:, 2] / period) * period
+            assert np.abs(diff).max() < 1e-2
+
+    def test_line_group_st7(self, shared_datadir):
+        # two planar rings related by a glide plane, which is T'C_6h
+        st = read_vasp(shared_datadir / "st7")
+        obj = LineGroupDetector(st)
+        family, trans_sym, rota_sym = obj.get_line_group()
+        assert family == 12
+        assert trans_sym == "T'(1.5)" and rota_sym == "D6"
+
+        # a glide plane onto sites of another element is not a symmetry
+        glide = obj.generators[0]
+        st2 = st.copy()
+        st2.numbers[st2.get_scaled_positions()[:, 2] > 0.5] = 7
+        obj2 = LineGroupDetector(st2)
+        assert obj2._map_sites(glide) is None
+        # neither is a map of all the sites onto a single one
+        collapse = np.zeros((4, 4))
+        collapse[:3, 3], collapse[3, 3] = obj.primitive.positions[0], 1
+        assert obj._map_sites(SymmOp(collapse)) is None
+
+    def test_detect_batch(self, shared_datadir):
+        files = collect_files([str(shared_datadir / "st*")])
+        assert [os.path.basename(tmp) for tmp in files] == ["st1", "st7"]
+        res = list(detect_batch(files + ["not_exist"], jobs=2))
+        res = {os.path.basename(tmp["file"]): tmp for tmp in res}
+        assert res["st1"]["family"] == 5 and res["st1"]["error"] is None
+        assert res["not_exist"]["error"] is not None
+
+        # detected, but the symbols do not match any family
+        res = detect_one(str(shared_datadir / "9-9-AM"))
+        assert res["family"] is None
+        assert res["error"].startswith("Unknown line group family")
@@ -1,13 +1,64 @@
+import os
+
+import numpy as np
+import pytest
 import pytest_datadir
+import sympy
+from ase import Atoms
 from ase.io.vasp import read_vasp
 from ipdb import set_trace
+from pymatgen.core.operations import SymmOp
 
+from pulgon_tools_wip.cache import (
+    ResultCache,
+    cached_cyclic_group,
+    cached_perms_from_ops,
+    canonical_order,
+)
 from pulgon_tools_wip.detect_generalized_translational_group import (
     CyclicGroupAnalyzer,
 )
 from pulgon_tools_wip.detect_point_group import LineGroupAnalyzer
+from pulgon_tools_wip.group_elements import (
+    CayleyTable,
+    LineGroupElements,
+    affine_to_elements,
+)
+from pulgon_tools_wip.Irreps_tables import evaluate_words
+from pulgon_tools_wip.Irreps_tables_withparities import (
+    line_group_sympy_withparities,
+)
 from pulgon_tools_wip.line_group_table import get_family_Num_from_sym_symbol
-from pulgon_tools_wip.utils import get_perms, get_symbols_from_ops
+from pulgon_tools_wip.utils import (
+    Cn,
+    KroneckerProjector,
+    PeriodicSiteIndex,
+    PermutationError,
+    QuantizedSiteSet,
+    SymmetryRepresentation,
+    U,
+    affine_matrix_op,
+    brute_force_generate_group,
+    brute_force_generate_group_subsquent,
+    compose_perms,
+    dimino_affine_matrix,
+    dimino_affine_matrix_and_character,
+    dimino_affine_matrix_and_subsquent,
+    find_axis_center_of_nanotube,
+    get_adapted_basis,
+    get_matrices_withPhase,
+    get_modified_projector,
+    get_perms,
+    get_perms_from_ops,
+    get_projector_range,
+    get_representation_withPhases,
+    get_symbols_from_ops,
+    get_table_elements,
+    irrep_multiplicities,
+    map_channels,
+    sigmaH,
+    sigmaV,
+)
 
 
 def test_get_perms_st1(shared_datadir):
@@ -58,3 +109,521 @@ def test_symop_symbol(shared_datadir):
     op_rotas = obj.get_generators()
     symbols = get_symbols_from_ops(op_rotas)
     assert symbols[0] == "C9" and symbols[1] == "S18"
+
+
+def test_periodic_site_index(shared_datadir):
+    poscar = read_vasp(shared_datadir / "24-0-ZZ")
+    index = PeriodicSiteIndex(
+        poscar.positions,
+        poscar.numbers,
+        boxsize=[0, 0, poscar.cell[2, 2]],
+        symprec=1e-3,
+    )
+    shifted = poscar.positions + [0, 0, poscar.cell[2, 2]]
+    assert (index.query(shifted) == np.arange(len(poscar))).all()
+    assert index.match(shifted, poscar.numbers).all()
+    assert (index.query(shifted + [0.1, 0, 0]) == -1).all()
+
+
+def test_quantized_site_set(shared_datadir):
+    poscar = read_vasp(shared_datadir / "24-0-ZZ")
+    scale_pos = poscar.get_scaled_positions()
+    sites = QuantizedSiteSet(
+        scale_pos, poscar.numbers, step=1e-2, tolerance=1e-3
+    )
+    assert (
+        sites.query(scale_pos + [0, 0, 1], poscar.numbers)
+        == np.arange(len(poscar))
+    ).all()
+    assert sites.contains(scale_pos + [0, 0, 1], poscar.numbers)
+    # a neighbouring grid cell but farther than the tolerance
+    assert not sites.contains(scale_pos + [0, 0, 5e-3], poscar.numbers)
+    # the right position with the wrong species
+    assert not sites.contains(scale_pos, poscar.numbers[::-1])
+    # two sites onto the same one
+    assert not sites.contains(scale_pos[[0, 0]], poscar.numbers[[0, 0]])
+    with pytest.raises(ValueError):
+        QuantizedSiteSet(scale_pos, poscar.numbers, step=1e-3, tolerance=1e-2)
+
+
+def test_result_cache(shared_datadir, tmp_path):
+    cache = ResultCache(tmp_path)
+    poscar = find_axis_center_of_nanotube(read_vasp(shared_datadir / "st1"))
+    perm = np.random.default_rng(0).permutation(len(poscar))
+    shifted = poscar[perm]
+    shifted.positions += [0, 0, 0.37]
+    shifted.wrap()
+
+    cy1, _ = cached_cyclic_group(poscar, 1e-2, cache)
+    cy2, _ = cached_cyclic_group(shifted, 1e-2, cache)
+    assert cy1 == cy2 and cache.hits == 1 and cache.misses == 1
+
+    ops = [
+        SymmOp.from_axis_angle_and_translation([0, 0, 1], 90 * ii)
+        for ii in range(4)
+    ]
+    cached_perms_from_ops(poscar, ops, cache=cache)
+    perms = cached_perms_from_ops(poscar[perm], ops, cache=cache)
+    assert cache.hits == 2
+    assert (perms == get_perms_from_ops(poscar[perm], ops)).all()
+
+    # sigma_h acts about the center of mass, a shifted tube is not a hit
+    _, tube = _screw_tube(4, 3)
+    shifted = tube[np.random.default_rng(1).permutation(len(tube))]
+    shifted.positions += [0, 0, 1.3]
+    shifted.wrap()
+    assert canonical_order(shifted, 1e-2)[0] == canonical_order(tube, 1e-2)[0]
+    ops = [
+        SymmOp.from_rotation_and_translation(sigmaH(), [0, 0, 0]),
+        SymmOp.from_rotation_and_translation(Cn(3), [0, 0, 0]),
+    ]
+    cached_perms_from_ops(tube, ops, cache=cache)
+    with pytest.raises(PermutationError):
+        get_perms_from_ops(shifted, ops)
+    with pytest.raises(PermutationError):
+        cached_perms_from_ops(shifted, ops, cache=cache)
+    assert cache.hits == 2
+
+    cache.max_size = 0
+    cache.evict()
+    assert len(list(tmp_path.glob("*/*.pkl"))) == 0
+
+
+def test_brute_force_generate_group():
+    screw, u = np.eye(4), np.eye(4)
+    screw[:3, :3], screw[2, 3] = Cn(12), 1 / 16
+    u[:3, :3] = U()
+    L = brute_force_generate_group([screw, u], symec=1e-3)
+    assert L.shape == (96, 4, 4)
+    # no two elements are the same
+    diff = np.abs(L[:, None] - L[None]).max(axis=(2, 3))
+    assert (diff[np.triu_indices(len(L), 1)] > 1e-3).all()
+
+    L2, L_seq = brute_force_generate_group_subsquent([screw, u], symec=1e-3)
+    assert np.allclose(L, L2)
+    for op, seq in zip(L2, L_seq):
+        res = np.eye(4)
+        for ii in seq[1:]:
+            res[:3, :3] = [screw, u][ii - 1][:3, :3] @ res[:3, :3]
+        assert np.allclose(res[:3, :3], op[:3, :3])
+
+
+def test_brute_force_generate_group_noisy():
+    # noise far below symec must not split an element into several
+    for seed in range(5):
+        rng = np.random.default_rng(seed)
+        generators = np.tile(np.eye(4), (2, 1, 1))
+        for gen, rot in zip(generators, [Cn(6), U()]):
+            gen[:3, :3] = rot + rng.uniform(-1e-3, 1e-3, (3, 3))
+        L = brute_force_generate_group(generators, symec=0.01)
+        assert L.shape == (12, 4, 4)
+        L2, _ = brute_force_generate_group_subsquent(generators, symec=0.01)
+        assert np.allclose(L, L2)
+        assert len(dimino_affine_matrix(generators, symec=0.01)) == 12
+
+
+def test_cayley_table():
+    screw, u = np.eye(4), np.eye(4)
+    screw[:3, :3], screw[2, 3] = Cn(12), 1 / 16
+    u[:3, :3] = U()
+    L = brute_force_generate_group([screw, u], symec=1e-3)
+    ct = CayleyTable.from_affine(L)
+    assert (ct.n_rot, ct.n_tran) == (12, 16)
+    assert np.allclose(ct.get_affine(), L)
+
+    ops = ct.get_affine()
+    for ii, jj in [(1, 2), (5, 40), (95, 17)]:
+        res = affine_matrix_op(ops[ii], ops[jj])
+        assert np.allclose(res, ops[ct.table[ii, jj]])
+    assert (ct.table[np.arange(len(ct)), ct.inverse] == ct.identity).all()
+
+    classes = ct.conjugacy_classes()
+    assert classes[0].tolist() == [ct.identity]
+    assert sum(len(cl) for cl in classes) == len(ct) == 96
+
+
+def test_line_group_elements():
+    for family, n, Q in [(5, 2, 3.5), (9, 3, 1), (13, 6, 1)]:
+        lg = LineGroupElements(family, n, Q=Q, f=1.5)
+        ops = lg.get_affine()
+        gens = [ops[ii] for ii, ex in enumerate(lg.exponents) if ex.sum() == 1]
+        L = brute_force_generate_group(gens, symec=1e-3)
+        ct = lg.get_cayley_table()
+        idx = ct.index(affine_to_elements(L, lg.n_rot, lg.n_tran)[0])
+        assert sorted(set(idx)) == list(range(len(lg)))
+    assert (len(lg), lg.a) == (48, 3.0)
+    # (C_2n|a/2) of family 13
+    screw = np.where((lg.exponents == [1, 0, 0, 0]).all(axis=1))[0][0]
+    assert np.isclose(lg.get_affine(cartesian=True)[screw, 2, 3], 1.5)
+
+
+def test_dimino():
+    lg = LineGroupElements(13, 6, f=1.5)
+    ops = lg.get_affine()
+    gens = [ops[ii] for ii, ex in enumerate(lg.exponents) if ex.sum() == 1]
+    L, L_subs = dimino_affine_matrix_and_subsquent(gens, symec=1e-3)
+    idx = lg.get_cayley_table().index(
+        affine_to_elements(L, lg.n_rot, lg.n_tran)[0]
+    )
+    assert sorted(idx) == list(range(len(lg))) == list(range(48))
+    for op, subs in zip(L, L_subs):
+        res = np.eye(4)
+        for ii in subs:
+            if ii > 0:
+                res = affine_matrix_op(res, gens[ii - 1])
+        assert np.allclose(res[:3, :3], op[:3, :3])
+
+    # the transposed rotations satisfy D(x * y) = D(x) D(y)
+    chara = [gen[:3, :3].T for gen in gens]
+    L, traces = dimino_affine_matrix_and_character(gens, chara, symec=1e-3)
+    assert np.allclose(traces, np.trace(L[:, :3, :3], axis1=1, axis2=2))
+
+
+def test_compose_perms(shared_datadir):
+    poscar = find_axis_center_of_nanotube(read_vasp(shared_datadir / "C4v"))
+    ops = [SymmOp(op) for op in LineGroupAnalyzer(poscar).get_generators()]
+    perms_gen = get_perms_from_ops(poscar, ops)
+    words = [[0], [1], [1, 2], [2, 1], [1, 2, 1, 1]]
+    perms = compose_perms(perms_gen, words)
+    for word, perm in zip(words, perms):
+        # the first generator of a word acts first
+        op = SymmOp(np.eye(4))
+        for ii in word:
+            if ii > 0:
+                op = ops[ii - 1] * op
+        assert (perm == get_perms_from_ops(poscar, [op])[0]).all()
+    # C4 and sigma_v do not commute
+    assert not (perms[2] == perms[3]).all()
+
+    poscar = read_vasp(shared_datadir / "12-12-AM")
+    cyclic = CyclicGroupAnalyzer(poscar, tolerance=1e-2)
+    _, _, sym_cy_ops = cyclic.get_cyclic_group_and_op()
+    atom = cyclic._primitive
+    sym_pg_ops = LineGroupAnalyzer(poscar).get_symmetry_operations()
+    perms_table, sym_operations = get_perms(atom, sym_cy_ops[0], sym_pg_ops)
+    assert len(perms_table) == len(sym_operations) == 24
+
+
+def test_get_perms_from_ops(shared_datadir):
+    poscar = find_axis_center_of_nanotube(read_vasp(shared_datadir / "st1"))
+    ops = [
+        SymmOp.from_axis_angle_and_translation(
+            [0, 0, 1], 90 * ii, translation_vec=[0, 0, poscar.cell[2, 2] * ii]
+        )
+        for ii in range(4)
+    ]
+    perms = get_perms_from_ops(poscar, ops)
+    assert (np.sort(perms, axis=1) == np.arange(len(poscar))).all()
+    assert (perms[2] == perms[1][perms[1]]).all()
+
+    ops.append(SymmOp.from_rotation_and_translation(np.eye(3), [0.5, 0, 0]))
+    with pytest.raises(PermutationError) as err:
+        get_perms_from_ops(poscar, ops)
+    assert {tmp["op"] for tmp in err.value.report} == {4}
+
+
+def _dense_matrices(atoms, ops, qpoint=0.0):
+    """the 3N x 3N matrices of the operations, filled block by block"""
+    perms = get_perms_from_ops(atoms, ops, symprec=1e-5)
+    natoms = len(atoms)
+    matrices = np.zeros((len(ops), 3 * natoms, 3 * natoms), dtype=complex)
+    for ii, (op, perm) in enumerate(zip(ops, perms)):
+        phase = np.exp(1j * qpoint * op.translation_vector[2])
+        for jj in range(natoms):
+            matrices[
+                ii, 3 * perm[jj] : 3 * perm[jj] + 3, 3 * jj : 3 * jj + 3
+            ] = (phase * op.rotation_matrix)
+    return matrices
+
+
+def test_symmetry_representation(shared_datadir):
+    poscar = find_axis_center_of_nanotube(read_vasp(shared_datadir / "st1"))
+    ops = [
+        SymmOp.from_axis_angle_and_translation(
+            [0, 0, 1], 90 * ii, translation_vec=[0, 0, poscar.cell[2, 2] * ii]
+        )
+        for ii in range(4)
+    ]
+    vectors = np.random.default_rng(0).random((3 * len(poscar), 2))
+    for qpoint in [None, 0.2]:
+        rep = SymmetryRepresentation.from_ops(poscar, ops, qpoint=qpoint)
+        matrices = _dense_matrices(
+            poscar, ops, 0.0 if qpoint is None else qpoint
+        )
+        assert np.allclose(
+            rep.apply(vectors), [mat @ vectors for mat in matrices]
+        )
+        assert np.allclose(rep.trace(), np.trace(matrices, axis1=1, axis2=2))
+        for ii in range(len(ops)):
+            assert np.allclose(rep.to_sparse(ii).toarray(), matrices[ii])
+    assert not np.allclose(matrices[1], matrices[0])
+    assert np.allclose(get_matrices_withPhase(poscar, ops, 0.2), matrices)
+
+
+def test_representation_with_phases(shared_datadir):
+    poscar = find_axis_center_of_nanotube(read_vasp(shared_datadir / "st1"))
+    ops = [
+        SymmOp.from_axis_angle_and_translation(
+            [0, 0, 1], 90 * ii, translation_vec=[0, 0, poscar.cell[2, 2] * ii]
+        )
+        for ii in range(4)
+    ]
+    qpoints = np.linspace(0, np.pi / poscar.cell[2, 2], 3)
+    rep, phases = get_representation_withPhases(poscar, ops, qpoints)
+    assert phases.shape == (3, 4)
+    for iq, qpoint in enumerate(qpoints):
+        ref = [np.exp(1j * qpoint * ii * poscar.cell[2, 2]) for ii in range(4)]
+        assert np.allclose(phases[iq], ref)
+        matrices = _dense_matrices(poscar, ops, qpoint)
+        tmp = rep.with_phases(phases[iq])
+        for ii in range(len(ops)):
+            assert np.allclose(tmp.to_dense(ii), matrices[ii])
+        assert np.allclose(tmp.trace(), np.trace(matrices, axis1=1, axis2=2))
+    assert not np.allclose(phases[-1], 1)
+
+
+def test_irrep_multiplicities(shared_datadir):
+    poscar = find_axis_center_of_nanotube(read_vasp(shared_datadir / "C4v"))
+    generators = [
+        SymmOp.from_rotation_and_translation(np.eye(3), [0, 0, 1]),
+        SymmOp.from_rotation_and_translation(Cn(4), [0, 0, 0]),
+        SymmOp.from_rotation_and_translation(sigmaV(), [0, 0, 0]),
+    ]
+    DictParams = {
+        "family": 6,
+        "nrot": 4,
+        "qpoints": 0.0,
+        "a": poscar.cell[2, 2],
+        "generators": generators,
+    }
+    words, ops = get_table_elements(DictParams, poscar)
+    Dmats, _, _ = line_group_sympy_withparities(dict(DictParams, order=words))
+    characters = np.array(
+        [
+            tmp if tmp.ndim == 1 else np.trace(tmp, axis1=1, axis2=2)
+            for tmp in map(np.asarray, Dmats)
+        ]
+    )
+    # the same numbers of modes as the adapted basis of each irrep
+    _, dimensions, _ = get_adapted_basis(DictParams, poscar, withparities=True)
+    res = irrep_multiplicities(poscar, ops, characters)
+    assert res.tolist() == dimensions and res.sum() == 3 * len(poscar)
+    res = irrep_multiplicities(poscar, ops, characters[None], [0.3])
+    assert res[0].tolist() == dimensions
+
+    # a character that does not belong to C4v
+    with pytest.raises(ValueError):
+        irrep_multiplicities(poscar, ops, np.exp(1j * np.arange(len(ops))))
+    with pytest.raises(ValueError):
+        irrep_multiplicities(poscar, ops[1:], characters[:, 1:])
+
+
+def test_kronecker_projector(shared_datadir):
+    poscar = find_axis_center_of_nanotube(read_vasp(shared_datadir / "st1"))
+    ops = [
+        SymmOp.from_axis_angle_and_translation([0, 0, 1], 90 * ii)
+        for ii in range(4)
+    ]
+    rep = SymmetryRepresentation.from_ops(poscar, ops)
+    matrices = get_matrices_withPhase(poscar, ops, 0)
+    # the sum of the irreps m=1 and m=-1 of C4
+    Dmats = [
+        np.diag(np.exp([0.5j * np.pi * ii, -0.5j * np.pi * ii]))
+        for ii in range(4)
+    ]
+    vectors = np.random.default_rng(0).random((6 * len(poscar), 3))
+    for irrep_first in [True, False]:
+        projector = KroneckerProjector(
+            rep, np.conj(Dmats), weight=1 / 4, irrep_first=irrep_first
+        )
+        dense = (
+            sum(
+                np.kron(D.conj(), mat)
+                if irrep_first
+                else np.kron(mat, D.conj())
+                for D, mat in zip(Dmats, matrices)
+            )
+            / 4
+        )
+        assert np.allclose(projector.apply(vectors), dense @ vectors)
+        assert np.isclose(projector.trace(), dense.trace())
+
+        assert np.allclose(
+            projector.apply_adjoint(vectors), dense.conj().T @ vectors
+        )
+
+        num_modes = int(np.rint(projector.trace().real))
+        for solver in ["dense", "randomized", "svds"]:
+            basis, error = get_projector_range(
+                projector, num_modes, solver=solver
+            )
+            assert basis.shape == (6 * len(poscar), num_modes)
+            assert error < 1e-6
+            assert np.allclose(basis.conj().T @ basis, np.eye(num_modes))
+            assert np.allclose(dense @ basis, basis)
+
+
+def test_map_channels():
+    items = [-3, 2, -1, 0, 5]
+    for pool in ["thread", "process"]:
+        res = map_channels(np.abs, items, jobs=2, pool=pool, blas_threads=1)
+        assert res == [3, 2, 1, 0, 5]
+    with pytest.raises(ValueError):
+        map_channels(np.abs, items, pool="mpi")
+
+    # the worker processes see the limit before they load BLAS
+    names = ["OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS"]
+    before = [os.environ.get(name) for name in names]
+    res = map_channels(
+        os.getenv, names, jobs=2, pool="process", blas_threads=1
+    )
+    assert res == ["1", "1"]
+    assert [os.environ.get(name) for name in names] == before
+
+
+def test_adapted_basis(shared_datadir):
+    poscar = find_axis_center_of_nanotube(read_vasp(shared_datadir / "C4v"))
+    generators = [
+        SymmOp.from_rotation_and_translation(np.eye(3), [0, 0, 1]),
+        SymmOp.from_rotation_and_translation(Cn(4), [0, 0, 0]),
+        SymmOp.from_rotation_and_translation(sigmaV(), [0, 0, 0]),
+    ]
+    DictParams = {
+        "family": 6,
+        "nrot": 4,
+        "qpoints": 0.0,
+        "a": poscar.cell[2, 2],
+        "generators": generators,
+    }
+    words, ops = get_table_elements(DictParams, poscar)
+    assert len(words) == 8 and words[0] == [0] and words[-1] == [3, 2, 2, 2]
+
+    for withparities in [False, True]:
+        adapted, dimensions, paras_values = get_adapted_basis(
+            DictParams, poscar, withparities=withparities
+        )
+        assert len(dimensions) == len(paras_values)
+        assert adapted.shape == (3 * len(poscar), 3 * len(poscar))
+        assert np.allclose(adapted.conj().T @ adapted, np.eye(len(adapted)))
+
+    # the entries are invariant subspaces
+    rep = SymmetryRepresentation.from_ops(poscar, ops)
+    start = 0
+    for dim in dimensions:
+        block = adapted[:, start : start + dim]
+        operated = rep.apply(block)
+        assert np.allclose(block @ (block.conj().T @ operated), operated)
+        start += dim
+
+    with pytest.raises(NotImplementedError):
+        get_adapted_basis(dict(DictParams, family=1), poscar)
+
+
+def _screw_tube(family, nrot, a=4.0):
+    """a tube of two orbits of the line group with the screw axis (C_2n|a/2)"""
+    seeds = np.array([[3.2, 0.8, 0.3], [3.7, 1.5, 1.1]])
+    elements = LineGroupElements(family, nrot, f=a / 2)
+    positions = np.concatenate(
+        [seeds @ op[:3, :3].T + op[:3, 3] for op in elements.get_affine(True)]
+    )
+    positions[:, 2] = np.remainder(positions[:, 2], a)
+    atoms = Atoms(
+        numbers=[6] * len(positions),
+        positions=positions,
+        cell=[20, 20, a],
+        pbc=True,
+    )
+    generators = [
+        SymmOp.from_rotation_and_translation(Cn(2 * nrot), [0, 0, 0.5]),
+        SymmOp.from_rotation_and_translation(Cn(nrot), [0, 0, 0]),
+        SymmOp.from_rotation_and_translation(
+            sigmaV() if family == 8 else sigmaH(), [0, 0, 0]
+        ),
+    ]
+    DictParams = {
+        "family": family,
+        "nrot": nrot,
+        "a": a,
+        "generators": generators,
+    }
+    return DictParams, atoms
+
+
+def test_adapted_basis_screw_axis():
+    DictParams, atoms = _screw_tube(8, 3)
+    for qpoint in [0.0, 0.3 * np.pi / 4.0, np.pi / 4.0]:
+        params = dict(DictParams, qpoints=qpoint)
+        _, ops = get_table_elements(params, atoms)
+        rep = SymmetryRepresentation.from_ops(atoms, ops, qpoint=qpoint)
+        for withparities in [False, True]:
+            adapted, dimensions, _ = get_adapted_basis(
+                params, atoms, withparities=withparities
+            )
+            assert adapted.shape == (3 * len(atoms), 3 * len(atoms))
+            assert np.allclose(
+                adapted.conj().T @ adapted, np.eye(len(adapted))
+            )
+            start = 0
+            for dim in dimensions:
+                block = adapted[:, start : start + dim]
+                operated = rep.apply(block)
+                assert np.allclose(
+                    block @ (block.conj().T @ operated), operated
+                )
+                start += dim
+
+    # the table of family 4 only pairs with the phases at q = 0
+    DictParams, atoms = _screw_tube(4, 3)
+    get_adapted_basis(dict(DictParams, qpoints=0.0), atoms)
+    with pytest.raises(ValueError):
+        get_adapted_basis(dict(DictParams, qpoints=0.3 * np.pi / 4.0), atoms)
+
+
+def test_modified_projector():
+    DictParams, atoms = _screw_tube(4, 3)
+    qpoint = 0.3 * np.pi / DictParams["a"]
+    DictParams = dict(
+        DictParams,
+        qpoints=qpoint,
+        generator_rot=DictParams["generators"][1:],
+        generator_tran=DictParams["generators"][:1],
+    )
+    adapted, dimensions = get_modified_projector(
+        DictParams, atoms, jobs=2, pool="process"
+    )
+    assert adapted.shape == (3 * len(atoms), 3 * len(atoms))
+    assert np.allclose(adapted.conj().T @ adapted, np.eye(len(adapted)))
+
+    # sigma_h takes q to -q, the blocks only keep the elements keeping z
+    _, ops = get_table_elements(DictParams, atoms)
+    ops = [op for op in ops if op.rotation_matrix[2, 2] > 0]
+    rep = SymmetryRepresentation.from_ops(atoms, ops, qpoint=qpoint)
+    start = 0
+    for dim in dimensions:
+        block = adapted[:, start : start + dim]
+        operated = rep.apply(block)
+        assert np.allclose(block @ (block.conj().T @ operated), operated)
+        start += dim
+
+
+def test_evaluate_words():
+    m1, n, s = sympy.symbols("m1 n s")
+    rot = sympy.Matrix([[sympy.exp(1j * 2 * sympy.pi * m1 / n), 0], [0, 1]])
+    mirror = sympy.Matrix([[0, 1], [1, 0]])
+    order = [[0], [1], [0, 0], [1, 0], [0, 1]]
+    res = evaluate_words([rot, mirror], [m1, n], ([1, 2], 4), order)
+    assert res.shape == (2, 5, 2, 2)
+    for ii, value in enumerate([1, 2]):
+        R = np.array(rot.subs({m1: value, n: 4}), dtype=np.complex128)
+        M = np.array(mirror, dtype=np.complex128)
+        for word, mat in zip(order, res[ii]):
+            ref = np.eye(2)
+            for jj in word:
+                ref = [R, M][jj] @ ref
+            assert np.allclose(mat, ref)
+
+    # one dimensional irreps and symbolic exponents
+    fc = sympy.Matrix([sympy.exp(1j * sympy.pi * m1 / n) ** s])
+    res = evaluate_words(fc, [m1, n, s], (1, 4, np.arange(8)), [[0]])
+    assert res.shape == (8, 1)
+    assert np.allclose(res[:, 0], np.exp(1j * np.pi * np.arange(8) / 4))